@@ -1,20 +1,33 @@
 """
 即梦自拍应用
+
+导出对象按需加载：HTTP 客户端（requests 等）只在首次访问
+JimengAPIClient / generate_image / ThreadedJimengAPIClient 时才导入，
+`--help`、`--list-styles` 等不涉及网络的命令因此启动更快。
 """
-from .jimeng_api import JimengAPIClient, generate_image
-from .strategy import SelfieStrategy, ReferenceImageManager
-from .config import (
-    SELFIE_STYLES,
-    OTHER_STYLES,
-    PLATFORM_STRATEGY,
-    OUTPUT_DIR,
-    REFERENCE_DIR
-)
+import importlib
+from typing import TYPE_CHECKING
 
 __version__ = "1.0.0"
+
+# 导出名称 -> 所在子模块
+_LAZY_ATTRS = {
+    "JimengAPIClient": "jimeng_api",
+    "generate_image": "jimeng_api",
+    "ThreadedJimengAPIClient": "async_api",
+    "SelfieStrategy": "strategy",
+    "ReferenceImageManager": "strategy",
+    "SELFIE_STYLES": "config",
+    "OTHER_STYLES": "config",
+    "PLATFORM_STRATEGY": "config",
+    "OUTPUT_DIR": "config",
+    "REFERENCE_DIR": "config",
+}
+
 __all__ = [
     "JimengAPIClient",
     "generate_image",
+    "ThreadedJimengAPIClient",
     "SelfieStrategy",
     "ReferenceImageManager",
     "SELFIE_STYLES",
@@ -23,3 +36,23 @@ __all__ = [
     "OUTPUT_DIR",
     "REFERENCE_DIR",
 ]
+
+if TYPE_CHECKING:
+    from .jimeng_api import JimengAPIClient, generate_image
+    from .async_api import ThreadedJimengAPIClient
+    from .strategy import SelfieStrategy, ReferenceImageManager
+    from .config import SELFIE_STYLES, OTHER_STYLES, PLATFORM_STRATEGY, OUTPUT_DIR, REFERENCE_DIR
+
+
+def __getattr__(name: str):
+    """首次访问导出名称时导入对应子模块，并缓存到包命名空间"""
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{module_name}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,150 @@
+"""
+即梦图片生成 asyncio 接口（线程卸载）
+在协程中调用同步客户端：阻塞的 HTTP 请求交给专用线程池执行，事件循环不被阻塞。
+每个进行中的请求仍占用一个线程，并发上限即线程池大小；
+HTTP 层依赖 requests，没有原生异步实现。
+"""
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable
+
+from .config import ASYNC_MAX_CONCURRENCY, DEFAULT_SIZE, DEFAULT_WATERMARK
+from .jimeng_api import JimengAPIClient
+from .cache import CACHE_DEFAULT
+from .timeouts import Deadline
+
+
+class ThreadedJimengAPIClient:
+    """
+    即梦图片生成 asyncio 接口（线程卸载封装）
+
+    同步调用在 max_concurrency 个线程的线程池中通过 JimengAPIClient 的连接池会话执行，
+    超出上限的调用在线程池队列中等待，与事件循环无关，可在多个事件循环中使用。
+    返回结果与 JimengAPIClient.generate() 相同：
+
+        async with ThreadedJimengAPIClient(max_concurrency=8) as client:
+            results = await asyncio.gather(*[client.generate(p) for p in prompts])
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        client: Optional[JimengAPIClient] = None
+    ):
+        """
+        参数:
+            api_key: API Key（默认读取配置）
+            max_concurrency: 同时进行的请求上限（线程池大小）
+            client: 复用已有的同步客户端（可选）
+        """
+        self.max_concurrency = max_concurrency or ASYNC_MAX_CONCURRENCY
+        self.client = client or JimengAPIClient(api_key=api_key, pool_size=self.max_concurrency)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_concurrency,
+            thread_name_prefix="jimeng-async"
+        )
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+    @property
+    def api_key(self) -> str:
+        return self.client.api_key
+
+    @property
+    def output_dir(self) -> str:
+        return self.client.output_dir
+
+    @output_dir.setter
+    def output_dir(self, value: str):
+        self.client.output_dir = value
+
+    @property
+    def in_flight(self) -> int:
+        """当前正在执行的请求数（不含排队中的调用）"""
+        return self._in_flight
+
+    async def _run(self, func: Callable, *args, **kwargs) -> Any:
+        """在线程池中执行同步调用（线程池大小即并发上限）"""
+        def call() -> Any:
+            with self._in_flight_lock:
+                self._in_flight += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                with self._in_flight_lock:
+                    self._in_flight -= 1
+
+        return await asyncio.get_running_loop().run_in_executor(self._executor, call)
+
+    async def generate(
+        self,
+        prompt: str,
+        size: str = DEFAULT_SIZE,
+        watermark: bool = DEFAULT_WATERMARK,
+        reference_images: Optional[List[str]] = None,
+        save_to_file: bool = True,
+        filename_prefix: str = "jimeng",
+        seed: Optional[int] = None,
+        n: int = 1,
+        deadline: Any = None,
+        cache_mode: str = CACHE_DEFAULT,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """生成图片（参数与返回值同 JimengAPIClient.generate，deadline 含排队等待时间）"""
+        if deadline is not None:
+            deadline = Deadline.coerce(deadline)
+        return await self._run(
+            self.client.generate,
+            prompt,
+            size=size,
+            watermark=watermark,
+            reference_images=reference_images,
+            save_to_file=save_to_file,
+            filename_prefix=filename_prefix,
+            seed=seed,
+            n=n,
+            deadline=deadline,
+            cache_mode=cache_mode,
+            metadata=metadata
+        )
+
+    async def generate_selfie(
+        self,
+        character_prompt: str,
+        selfie_style: str = None,
+        reference_images: Optional[List[str]] = None,
+        platform: str = "private"
+    ) -> Dict[str, Any]:
+        """生成自拍图片（参数与返回值同 JimengAPIClient.generate_selfie）"""
+        return await self._run(
+            self.client.generate_selfie,
+            character_prompt,
+            selfie_style=selfie_style,
+            reference_images=reference_images,
+            platform=platform
+        )
+
+    async def download(
+        self,
+        url: str,
+        prefix: str = "jimeng",
+        seed: Optional[int] = None
+    ) -> Optional[str]:
+        """下载图片到输出目录，返回本地路径（失败返回 None）"""
+        return await self._run(self.client._download_image, url, prefix, seed)
+
+    async def aclose(self):
+        """等待进行中的请求结束后关闭线程池与连接池"""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+        self.client.close()
+
+    async def __aenter__(self) -> "ThreadedJimengAPIClient":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.aclose()
+
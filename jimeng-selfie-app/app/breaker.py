@@ -0,0 +1,174 @@
+"""
+熔断器
+接口持续失败时快速失败，冷却后放行探测请求以恢复
+"""
+import time
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from .config import BREAKER_FAILURE_THRESHOLD, BREAKER_RECOVERY_TIMEOUT
+
+# 熔断器状态
+CLOSED = "closed"          # 正常放行
+OPEN = "open"              # 快速失败
+HALF_OPEN = "half_open"    # 放行少量探测请求
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开时拒绝请求"""
+
+    def __init__(self, retry_in: float):
+        self.retry_in = retry_in
+        super().__init__(f"熔断器已打开，{retry_in:.1f} 秒后重新探测")
+
+
+class CircuitBreaker:
+    """
+    熔断器
+
+    - closed:    连续失败 failure_threshold 次后转为 open
+    - open:      拒绝所有请求，recovery_timeout 秒后转为 half_open
+    - half_open: 最多放行 half_open_max_calls 个探测请求，
+                 探测成功转为 closed，失败重新转为 open
+
+    状态变化时依次调用监听器 listener(old_state, new_state, breaker)。
+    """
+
+    def __init__(
+        self,
+        failure_threshold: Optional[int] = None,
+        recovery_timeout: Optional[float] = None,
+        half_open_max_calls: int = 1,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        参数:
+            failure_threshold: 触发熔断的连续失败次数
+            recovery_timeout: 熔断后到开始探测的冷却时长（秒）
+            half_open_max_calls: 半开状态下同时放行的探测请求数
+            clock: 时钟函数（便于测试替换）
+        """
+        self.failure_threshold = max(1, failure_threshold or BREAKER_FAILURE_THRESHOLD)
+        self.recovery_timeout = (
+            recovery_timeout if recovery_timeout is not None else BREAKER_RECOVERY_TIMEOUT
+        )
+        self.half_open_max_calls = max(1, half_open_max_calls)
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._listeners: List[Callable[[str, str, "CircuitBreaker"], None]] = []
+
+        # 统计
+        self._open_count = 0
+        self._rejected_count = 0
+
+    def add_listener(self, listener: Callable[[str, str, "CircuitBreaker"], None]):
+        """注册状态变化监听器"""
+        self._listeners.append(listener)
+
+    @property
+    def state(self) -> str:
+        """当前状态（open 冷却结束后视为 half_open）"""
+        with self._lock:
+            change = self._check_recovery()
+            state = self._state
+        self._notify(change)
+        return state
+
+    def _transition(self, new_state: str) -> Optional[Tuple[str, str]]:
+        """切换状态（需持有锁），返回待通知的 (旧状态, 新状态)"""
+        old_state = self._state
+        if old_state == new_state:
+            return None
+
+        self._state = new_state
+        if new_state == OPEN:
+            self._opened_at = self._clock()
+            self._open_count += 1
+        if new_state != HALF_OPEN:
+            self._probes_in_flight = 0
+        return old_state, new_state
+
+    def _check_recovery(self) -> Optional[Tuple[str, str]]:
+        """冷却结束则转为 half_open（需持有锁）"""
+        if self._state == OPEN and self._clock() - self._opened_at >= self.recovery_timeout:
+            return self._transition(HALF_OPEN)
+        return None
+
+    def _notify(self, change: Optional[Tuple[str, str]]):
+        """在锁外通知监听器"""
+        if change is None:
+            return
+        for listener in list(self._listeners):
+            try:
+                listener(change[0], change[1], self)
+            except Exception as e:
+                print(f"[WARN] 熔断器监听器出错: {e}")
+
+    def before_request(self):
+        """
+        请求前检查
+
+        异常:
+            CircuitOpenError: 熔断器打开（或半开且探测名额已满）
+        """
+        with self._lock:
+            change = self._check_recovery()
+            if self._state == CLOSED:
+                allowed, retry_in = True, 0.0
+            elif self._state == HALF_OPEN and self._probes_in_flight < self.half_open_max_calls:
+                self._probes_in_flight += 1
+                allowed, retry_in = True, 0.0
+            else:
+                allowed = False
+                retry_in = max(0.0, self._opened_at + self.recovery_timeout - self._clock())
+                self._rejected_count += 1
+
+        self._notify(change)
+        if not allowed:
+            raise CircuitOpenError(retry_in)
+
+    def release_probe(self):
+        """
+        归还 before_request() 取得的探测名额（请求未发出时调用）
+
+        不计为成功或失败，半开状态下名额可由下一个请求使用。
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._probes_in_flight > 0:
+                self._probes_in_flight -= 1
+
+    def record_success(self):
+        """记录一次成功"""
+        with self._lock:
+            self._consecutive_failures = 0
+            change = self._transition(CLOSED) if self._state == HALF_OPEN else None
+        self._notify(change)
+
+    def record_failure(self):
+        """记录一次失败（超时、连接错误或服务端错误）"""
+        with self._lock:
+            self._consecutive_failures += 1
+            change = None
+            if self._state == HALF_OPEN:
+                change = self._transition(OPEN)
+            elif self._state == CLOSED and self._consecutive_failures >= self.failure_threshold:
+                change = self._transition(OPEN)
+        self._notify(change)
+
+    def stats(self) -> Dict[str, Any]:
+        """熔断器指标"""
+        with self._lock:
+            change = self._check_recovery()
+            stats = {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "open_count": self._open_count,
+                "rejected_count": self._rejected_count,
+            }
+        self._notify(change)
+        return stats
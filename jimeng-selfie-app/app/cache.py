@@ -0,0 +1,212 @@
+"""
+生成结果缓存
+以规范化请求体的哈希为键，将指定种子的生成结果缓存在本地磁盘
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from typing import Optional, List, Dict, Any, Iterator
+
+from .config import CACHE_ENABLED, CACHE_DIR, CACHE_MAX_BYTES, CACHE_MAX_AGE
+from .storage import link_or_copy
+
+# 不影响生成结果的请求字段，不参与缓存键计算
+_NON_SEMANTIC_FIELDS = ("stream", "response_format")
+
+# 缓存模式
+CACHE_DEFAULT = "default"   # 命中则直接返回，未命中则生成后写入
+CACHE_REFRESH = "refresh"   # 忽略已有缓存，重新生成并覆盖
+CACHE_BYPASS = "bypass"     # 完全不读写缓存
+CACHE_MODES = (CACHE_DEFAULT, CACHE_REFRESH, CACHE_BYPASS)
+
+
+class ResultCache:
+    """
+    生成结果磁盘缓存
+
+    - 键: 请求体（模型、提示词、尺寸、种子、参考图等）规范化 JSON 的 SHA-256
+    - 存储: cache_dir/objects/<键前两位>/<键>/<序号>.jpg，索引保存在 SQLite
+    - 淘汰: 超过 max_age 的条目被删除；总大小超过 max_bytes 时按最近访问时间（LRU）淘汰
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[str] = None,
+        max_bytes: Optional[int] = None,
+        max_age: Optional[float] = None
+    ):
+        """
+        参数:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节，0 表示不限）
+            max_age: 条目最长保留时间（秒，0 表示不限）
+        """
+        self.cache_dir = cache_dir or CACHE_DIR
+        self.max_bytes = max_bytes if max_bytes is not None else CACHE_MAX_BYTES
+        self.max_age = max_age if max_age is not None else CACHE_MAX_AGE
+        self.db_path = os.path.join(self.cache_dir, "index.sqlite3")
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    result TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries(accessed_at)")
+
+    @contextlib.contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """打开索引连接，退出时提交并关闭"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any]) -> str:
+        """由请求体计算缓存键"""
+        normalized = {k: v for k, v in payload.items() if k not in _NON_SEMANTIC_FIELDS}
+        raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "objects", key[:2], key)
+
+    def get(self, key: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        读取缓存
+
+        返回:
+            图片列表 [{"url", "seed", "size", "cache_path"}]，未命中（含已过期）返回 None
+        """
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT result, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+
+            if self.max_age and row[1] < time.time() - self.max_age:
+                self._delete(conn, key)
+                return None
+
+            images = json.loads(row[0])
+            if not all(os.path.exists(image["cache_path"]) for image in images):
+                # 文件被外部删除，条目失效
+                self._delete(conn, key)
+                return None
+
+            conn.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return images
+
+    def put(self, key: str, images: List[Dict[str, Any]]):
+        """
+        写入缓存
+
+        参数:
+            key: 缓存键
+            images: 生成结果中的图片列表（需已保存到 local_path）
+        """
+        if not images or not all(image.get("local_path") for image in images):
+            return
+
+        # 先在临时目录中准备好条目，再整体替换到位，并发写入同一键时不会留下不完整的条目
+        entry_dir = self._entry_dir(key)
+        staging_dir = os.path.join(os.path.dirname(entry_dir), f".{key}.{uuid.uuid4().hex}.tmp")
+
+        cached = []
+        size_bytes = 0
+        try:
+            for index, image in enumerate(images):
+                name = f"{index}{os.path.splitext(image['local_path'])[1]}"
+                staged = os.path.join(staging_dir, name)
+                link_or_copy(image["local_path"], staged)
+                size_bytes += os.path.getsize(staged)
+                cached.append({
+                    "url": image.get("url"),
+                    "seed": image.get("seed"),
+                    "size": image.get("size"),
+                    "cache_path": os.path.join(entry_dir, name),
+                })
+        except BaseException:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            try:
+                os.replace(staging_dir, entry_dir)
+            except OSError:
+                shutil.rmtree(staging_dir, ignore_errors=True)
+                raise
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, result, size_bytes, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(cached, ensure_ascii=False), size_bytes, now, now)
+            )
+            self._evict(conn)
+
+    def _delete(self, conn: sqlite3.Connection, key: str):
+        conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+        shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def _evict(self, conn: sqlite3.Connection):
+        """按过期时间与总大小淘汰条目"""
+        if self.max_age:
+            expired = conn.execute(
+                "SELECT key FROM entries WHERE created_at < ?", (time.time() - self.max_age,)
+            ).fetchall()
+            for (key,) in expired:
+                self._delete(conn, key)
+
+        if self.max_bytes:
+            total = conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM entries").fetchone()[0]
+            if total > self.max_bytes:
+                rows = conn.execute(
+                    "SELECT key, size_bytes FROM entries ORDER BY accessed_at ASC"
+                ).fetchall()
+                for key, size_bytes in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._delete(conn, key)
+                    total -= size_bytes
+
+    def evict(self):
+        """立即执行一次淘汰"""
+        with self._lock, self._connect() as conn:
+            self._evict(conn)
+
+    def invalidate(self, key: str):
+        """删除指定条目"""
+        with self._lock, self._connect() as conn:
+            self._delete(conn, key)
+
+    def stats(self) -> Dict[str, int]:
+        """缓存条目数与总大小"""
+        with self._connect() as conn:
+            count, total = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM entries"
+            ).fetchone()
+        return {"entries": count, "bytes": total}
+
+
+def create_result_cache() -> Optional[ResultCache]:
+    """按配置创建结果缓存（CACHE_ENABLED 关闭时返回 None）"""
+    if not CACHE_ENABLED:
+        return None
+    return ResultCache()
@@ -9,7 +9,6 @@ from typing import Optional, List
 # 添加项目路径
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from app.jimeng_api import JimengAPIClient
 from app.strategy import SelfieStrategy, ReferenceImageManager
 from app.config import OUTPUT_DIR, REFERENCE_DIR, SELFIE_STYLES, OTHER_STYLES
 
@@ -18,6 +17,9 @@ class SelfieAppCLI:
     """即梦自拍应用 CLI"""
 
     def __init__(self):
+        # HTTP 客户端延迟导入，不涉及生成的命令无需加载 requests
+        from app.jimeng_api import JimengAPIClient
+
         self.client = JimengAPIClient()
         self.strategy = SelfieStrategy()
         self.ref_manager = ReferenceImageManager(REFERENCE_DIR)
@@ -163,7 +165,9 @@ class SelfieAppCLI:
         # 执行生成
         print(f"\n使用风格: {style}")
         print("正在生成图片...")
-        result = self.client.generate(prompt, filename_prefix=f"other_{style.replace(' ', '_')}")
+        result = self.client.generate(
+            prompt, filename_prefix=f"other_{style.replace(' ', '_')}", metadata={"style": style}
+        )
 
         self._display_result(result)
 
@@ -199,11 +203,12 @@ class SelfieAppCLI:
         """管理参考图"""
         print("\n--- 参考图管理 ---")
 
-        refs = self.ref_manager.list_references()
+        refs = self.ref_manager.list_reference_info()
         if refs:
             print(f"当前参考图 ({len(refs)} 张):")
             for ref in refs:
-                print(f"  - {os.path.basename(ref)}")
+                detail = f"{ref['width']}x{ref['height']} {ref['format']}" if ref["format"] else "无法识别"
+                print(f"  - {ref['name']} ({detail})")
         else:
             print("当前没有参考图")
 
@@ -237,8 +242,243 @@ class SelfieAppCLI:
         print("-" * 40)
 
 
+def _open_dedup_index(output_dir: str):
+    """打开输出目录的近重复索引，并补入上次运行之后新增的图片"""
+    from app.dedup import DuplicateIndex
+
+    index = DuplicateIndex(output_dir)
+    stats = index.refresh()
+    if stats["added"] or stats["removed"]:
+        print(f"近重复索引已更新: 新增 {stats['added']} 张，移除 {stats['removed']} 张，共 {stats['total']} 张",
+              file=sys.stderr)
+    return index
+
+
+def _run_jobs_file(args) -> int:
+    """执行 --jobs 批量任务，返回进程退出码（有失败任务时为 1）"""
+    from app.jimeng_api import JimengAPIClient
+    from app.jobs import run_jobs, run_jobs_queued
+
+    source = sys.stdin if args.jobs == "-" else open(args.jobs, "r", encoding="utf-8")
+    out = open(args.results, "w", encoding="utf-8") if args.results else sys.stdout
+    try:
+        with JimengAPIClient() as client:
+            if args.output:
+                client.output_dir = args.output
+                os.makedirs(client.output_dir, exist_ok=True)
+            if args.queue is not None:
+                from app.jobqueue import JobQueue
+
+                queue = JobQueue(args.queue or None)
+                stats = run_jobs_queued(queue, client, source, out, max_workers=args.parallel)
+            elif args.pipeline or args.renditions or args.dedup:
+                from app.pipeline import GenerationPipeline
+
+                postprocessors = []
+                if args.dedup:
+                    postprocessors.append(_open_dedup_index(client.output_dir))
+                if args.renditions:
+                    from app.renditions import RenditionProcessor
+
+                    postprocessors.append(RenditionProcessor())
+                try:
+                    with GenerationPipeline(
+                        client, generate_workers=args.parallel, postprocessors=postprocessors
+                    ) as pipeline:
+                        stats = run_jobs(client, source, out, pipeline=pipeline)
+                finally:
+                    for processor in postprocessors:
+                        if hasattr(processor, "close"):
+                            processor.close()
+                for name, stage in pipeline.stats().items():
+                    print(
+                        f"[{name}] 线程 {stage['workers']}，处理 {stage['processed']} 个，"
+                        f"{stage['throughput']:.2f} 个/秒",
+                        file=sys.stderr
+                    )
+            else:
+                stats = run_jobs(client, source, out, max_workers=args.parallel)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if out is not sys.stdout:
+            out.close()
+
+    # 汇总信息写到标准错误，标准输出只保留 JSONL 结果
+    print(
+        f"批量任务完成: 共 {stats['total']} 个，成功 {stats['succeeded']} 个，失败 {stats['failed']} 个",
+        file=sys.stderr
+    )
+    return 1 if stats["failed"] else 0
+
+
+def _serve(argv: List[str]):
+    """jimeng-selfie serve: 启动常驻生成服务"""
+    import signal
+    from app.config import SERVER_HOST, SERVER_PORT, SERVER_SOCKET, SERVER_MAX_CONCURRENCY
+    from app.server import WorkerServer
+
+    parser = argparse.ArgumentParser(
+        prog="jimeng-selfie serve",
+        description="常驻生成服务：共享连接池、限流、熔断与缓存，通过本地 HTTP 或 Unix socket 接收请求"
+    )
+    parser.add_argument("--host", default=SERVER_HOST, help="监听地址（默认 %(default)s）")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="监听端口（默认 %(default)s）")
+    parser.add_argument("--socket", default=SERVER_SOCKET or None, help="改为监听 Unix socket 路径")
+    parser.add_argument(
+        "--concurrency", type=int, default=SERVER_MAX_CONCURRENCY,
+        help="同时执行的生成请求数（默认 %(default)s）"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        server = WorkerServer(
+            host=args.host, port=args.port, unix_socket=args.socket, max_concurrency=args.concurrency
+        )
+    except OSError as e:
+        print(f"[-] 无法启动生成服务: {e}", file=sys.stderr)
+        sys.exit(1)
+    if not server.client.api_key:
+        print("[!] 警告: 未配置 ARK_API_KEY，生成请求将失败", file=sys.stderr)
+
+    # SIGTERM 与 Ctrl+C 一样正常退出
+    def _terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    print(f"生成服务已启动: {server.address}（并发 {server.max_concurrency}）", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n生成服务已停止")
+    finally:
+        server.shutdown()
+
+
+def _parse_time(value: str) -> float:
+    """解析时间参数: 相对时长（30m / 12h / 7d，表示多久以前）或日期（2024-01-31 / 2024-01-31T08:00）"""
+    import time
+    from datetime import datetime
+
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if value[-1:] in units and value[:-1].replace(".", "", 1).isdigit():
+        return time.time() - float(value[:-1]) * units[value[-1]]
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的时间: {value}")
+
+
+def _manifest(argv: List[str]):
+    """jimeng-selfie manifest: 查询图片清单"""
+    import json
+    from datetime import datetime
+    from app.manifest import Manifest
+
+    parser = argparse.ArgumentParser(
+        prog="jimeng-selfie manifest",
+        description="按风格、平台、种子、提示词与时间查询已生成的图片",
+        epilog="示例: jimeng-selfie manifest --style 咖啡厅自拍 --platform x --since 7d"
+    )
+    parser.add_argument("--style", help="拍照风格")
+    parser.add_argument("--platform", help="目标平台")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    parser.add_argument("--prompt", help="完整提示词（精确匹配）")
+    parser.add_argument("--prefix", help="文件名前缀")
+    parser.add_argument("--since", type=_parse_time, help="起始时间（7d / 12h / 2024-01-31）")
+    parser.add_argument("--until", type=_parse_time, help="截止时间")
+    parser.add_argument("--limit", type=int, help="最多返回条数")
+    parser.add_argument("--count", action="store_true", help="只输出记录数")
+    parser.add_argument("--json", action="store_true", help="每条记录输出一行 JSON")
+    parser.add_argument("--db", help="清单数据库路径（默认使用 MANIFEST_DB_PATH）")
+    parser.add_argument("--import", dest="import_dir", metavar="DIR", help="导入目录中已有的图片（按文件名解析）")
+    parser.add_argument("--prune", action="store_true", help="删除文件已不存在的记录")
+    args = parser.parse_args(argv)
+
+    manifest = Manifest(args.db)
+    if args.import_dir or args.prune:
+        if args.import_dir:
+            print(f"已导入 {manifest.import_files(args.import_dir)} 张图片")
+        if args.prune:
+            print(f"已删除 {manifest.prune()} 条失效记录")
+        return
+
+    filters = dict(
+        style=args.style, platform=args.platform, seed=args.seed, prompt=args.prompt,
+        prefix=args.prefix, since=args.since, until=args.until
+    )
+    if args.count:
+        print(manifest.count(**filters))
+        return
+
+    for row in manifest.query(**filters, limit=args.limit):
+        if args.json:
+            print(json.dumps(row, ensure_ascii=False))
+        else:
+            created = datetime.fromtimestamp(row["created_at"]).strftime("%Y-%m-%d %H:%M")
+            print(f"{created}  {row['style'] or '-'}  {row['platform'] or '-'}  {row['path']}")
+
+
+def _migrate_output(argv: List[str]):
+    """jimeng-selfie migrate-output: 将已有图片移动到新的输出目录布局"""
+    from app.config import OUTPUT_DIR, OUTPUT_LAYOUT, MANIFEST_DB_PATH
+    from app.storage import OUTPUT_LAYOUTS, migrate_layout
+
+    parser = argparse.ArgumentParser(
+        prog="jimeng-selfie migrate-output",
+        description="按 date（YYYY/MM/DD）或 hash（文件名哈希前两位）布局重新存放输出目录中的图片"
+    )
+    parser.add_argument("--layout", choices=OUTPUT_LAYOUTS, default=OUTPUT_LAYOUT,
+                        help="目标布局（默认 OUTPUT_LAYOUT: %(default)s）")
+    parser.add_argument("--output", "-o", default=OUTPUT_DIR, help="输出目录（默认 %(default)s）")
+    parser.add_argument("--db", default=MANIFEST_DB_PATH, help="同步更新的图片清单数据库（不存在时跳过）")
+    parser.add_argument("--dry-run", action="store_true", help="只显示移动方案，不实际移动")
+    args = parser.parse_args(argv)
+
+    report = migrate_layout(args.output, args.layout, dry_run=args.dry_run)
+    moves = report["moved"]
+    if args.dry_run:
+        for source, target in moves:
+            print(f"{source} -> {target}")
+    elif moves:
+        # 同步更新清单与近重复索引中的路径
+        if os.path.exists(args.db):
+            from app.manifest import Manifest
+
+            print(f"图片清单已更新 {Manifest(args.db).relocate(moves)} 条记录")
+        from app.dedup import DuplicateIndex
+
+        index = DuplicateIndex(args.output)
+        if os.path.exists(index.index_path):
+            print(f"近重复索引已更新 {index.relocate(moves)} 条记录")
+
+    action = "将移动" if args.dry_run else "已移动"
+    print(f"{action} {len(moves)} 张图片，{report['skipped']} 张已在目标位置，{len(report['conflicts'])} 张因目标已存在跳过")
+    for path in report["conflicts"]:
+        print(f"  [!] 目标已存在: {path}")
+
+
+def _reject_options(parser: argparse.ArgumentParser, mode: str, **options):
+    """mode 下不生效的选项被指定时报错退出（选项名取关键字参数名）"""
+    given = [f"--{name}" for name, value in options.items() if value]
+    if given:
+        parser.error(f"{mode} 模式不支持 {', '.join(given)}")
+
+
 def main():
     """CLI 入口"""
+    # 子命令
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        _serve(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "manifest":
+        _manifest(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate-output":
+        _migrate_output(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(
         description="虚拟实体",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -247,6 +487,12 @@ def main():
   %(prog)s                    # 交互式界面
   %(prog)s --prompt "..."     # 直接生成
   %(prog)s --list-styles      # 显示风格列表
+  %(prog)s --character 西娅 --scene cafe_alone   # 按角色档案生成场景图
+  %(prog)s --jobs jobs.jsonl  # 批量任务文件（- 表示标准输入），逐行输出 JSON 结果
+  %(prog)s serve              # 常驻生成服务（详见 %(prog)s serve --help）
+  %(prog)s manifest --style 咖啡厅自拍 --since 7d   # 查询图片清单（需启用 MANIFEST_ENABLED）
+  %(prog)s migrate-output --layout date        # 已有图片按日期子目录重新存放
+  %(prog)s --prompt "..." --server   # 通过常驻服务生成
         """
     )
 
@@ -274,10 +520,67 @@ def main():
         action="store_true",
         help="显示所有风格列表"
     )
+    parser.add_argument(
+        "--character", "-c",
+        help="角色名（使用角色档案中的提示词与参考图，配合 --scene）"
+    )
+    parser.add_argument(
+        "--scene",
+        help="角色场景代码（如 cafe_alone、front_view）"
+    )
+    parser.add_argument(
+        "--list-scenes",
+        action="store_true",
+        help="显示角色档案与可用场景"
+    )
     parser.add_argument(
         "--output", "-o",
         help="输出目录"
     )
+    parser.add_argument(
+        "--server",
+        metavar="ADDR",
+        nargs="?",
+        const="",
+        help="通过常驻服务生成（unix:<路径> 或 host:port，默认按 SERVER_* 配置）"
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="FILE",
+        help="批量任务 JSONL 文件（- 表示标准输入），每行包含 prompt/style/platform/seed/size/references"
+    )
+    parser.add_argument(
+        "--parallel", "-j",
+        type=int,
+        help="批量任务并发数（默认使用 BATCH_MAX_WORKERS）"
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help="批量任务按 生成/下载/后处理 分阶段执行（-j 为生成阶段线程数）"
+    )
+    parser.add_argument(
+        "--renditions",
+        action="store_true",
+        help="为生成的图片输出各平台发布版本（直接生成时只输出 --platform 对应的版本）"
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="检查新图片是否与输出目录中已有图片视觉上近重复（感知哈希）"
+    )
+    parser.add_argument(
+        "--queue",
+        metavar="DB",
+        nargs="?",
+        const="",
+        help="批量任务经持久化队列执行，中断后重新运行可续跑（默认使用 QUEUE_DB_PATH）"
+    )
+    parser.add_argument(
+        "--results",
+        metavar="FILE",
+        help="批量任务结果输出文件（默认标准输出）"
+    )
 
     args = parser.parse_args()
 
@@ -291,12 +594,56 @@ def main():
             print(f"  - {style}")
         return
 
+    # 角色档案与场景列表
+    if args.list_scenes:
+        from app.profiles import get_profile_library
+
+        library = get_profile_library()
+        for name in library.names():
+            profile = library.get(name)
+            print(f"{name}（参考图 {len(profile.references)} 张）:")
+            for scene in profile.scenes:
+                print(f"  - {scene}: {profile.scenes[scene].get('description', '')}")
+        return
+
+    # 批量任务模式
+    if args.jobs:
+        if args.jobs != "-" and not os.path.isfile(args.jobs):
+            parser.error(f"任务文件不存在: {args.jobs}")
+        if args.parallel is not None and args.parallel < 1:
+            parser.error("--parallel 必须大于 0")
+        _reject_options(parser, "--jobs", server=args.server is not None)
+        if args.queue is not None:
+            _reject_options(parser, "--queue", pipeline=args.pipeline, renditions=args.renditions, dedup=args.dedup)
+        sys.exit(_run_jobs_file(args))
+
+    # 角色场景模式
+    if args.character:
+        _reject_options(parser, "--character", renditions=args.renditions, dedup=args.dedup,
+                        server=args.server is not None)
+        if not args.scene:
+            parser.error("--character 需要配合 --scene 使用")
+        from app.jimeng_api import JimengAPIClient
+
+        print(f"角色: {args.character}  场景: {args.scene}")
+        print("正在生成...")
+        with JimengAPIClient() as client:
+            if args.output:
+                client.output_dir = args.output
+                os.makedirs(client.output_dir, exist_ok=True)
+            result = client.generate_character(args.character, args.scene, args.style, args.platform)
+
+        if result["success"]:
+            print(f"[+] 成功: {result.get('local_path') or result['url']}")
+        else:
+            print(f"[-] 失败: {result.get('error')}")
+        return
+
     # 直接生成模式
     if args.prompt:
-        client = JimengAPIClient()
-        if args.output:
-            client.output_dir = args.output
-
+        if args.server is not None:
+            # 图片由服务端保存，输出目录与近重复检查以服务端配置为准
+            _reject_options(parser, "--server", output=args.output, dedup=args.dedup)
         if args.selfie:
             strategy = SelfieStrategy()
             style = args.style or strategy.select_style(args.platform)
@@ -308,9 +655,40 @@ def main():
         print(f"提示词: {prompt}")
         print("正在生成...")
 
-        result = client.generate(prompt, filename_prefix="cli_gen")
+        if args.server is not None:
+            from app.server import ServerClient
+
+            try:
+                result = ServerClient(args.server or None).generate(prompt, filename_prefix="cli_gen")
+            except ConnectionError as e:
+                result = {"success": False, "error": str(e)}
+        else:
+            from app.jimeng_api import JimengAPIClient
+
+            with JimengAPIClient() as client:
+                if args.output:
+                    client.output_dir = args.output
+                    os.makedirs(client.output_dir, exist_ok=True)
+                dedup = _open_dedup_index(client.output_dir) if args.dedup else None
+                metadata = {"style": style, "platform": args.platform} if args.selfie else None
+                result = client.generate(prompt, filename_prefix="cli_gen", metadata=metadata)
+                if dedup is not None and result["success"]:
+                    dedup.process(result)
+
         if result["success"]:
             print(f"[+] 成功: {result.get('local_path') or result['url']}")
+            for path in result.get("duplicates", []):
+                print(f"    [!] 与已有图片近重复: {path}")
+            if args.renditions and result.get("local_path"):
+                from app.renditions import RenditionProcessor
+
+                try:
+                    with RenditionProcessor([args.platform], max_workers=1) as renditions:
+                        renditions.process(result)
+                except Exception as e:
+                    print(f"[-] {args.platform} 版本生成失败: {e}")
+                for path in result.get("renditions", {}).get(args.platform, []):
+                    print(f"    {args.platform} 版本: {path}")
         else:
             print(f"[-] 失败: {result.get('error')}")
 
@@ -5,10 +5,15 @@
 1. 环境变量
 2. ~/.jimeng-selfie/config.env 配置文件
 3. 默认值
+
+配置文件解析结果会被缓存，仅在文件修改后重新读取；
+需要在运行中感知配置变化时使用 get_settings()。
 """
 import os
+import sys
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Dict, Any, Tuple, Union, Callable
 
 
 def _get_config_dir() -> Path:
@@ -20,29 +25,61 @@ def _get_config_dir() -> Path:
     return Path.home() / ".jimeng-selfie"
 
 
-def _load_config_file() -> dict:
-    """从配置文件加载配置"""
+# 配置文件解析缓存: 文件签名（路径、修改时间、大小）不变时直接复用解析结果
+_file_cache_lock = threading.Lock()
+_file_cache: Dict[str, Any] = {"signature": None, "values": {}}
+
+
+def _config_file_signature(config_file: Path) -> Tuple[str, Optional[int], Optional[int]]:
+    """配置文件签名（文件不存在时修改时间与大小为 None）"""
+    try:
+        stat = config_file.stat()
+    except OSError:
+        return str(config_file), None, None
+    return str(config_file), stat.st_mtime_ns, stat.st_size
+
+
+def _parse_config_file(config_file: Path) -> Dict[str, str]:
+    """解析 KEY=VALUE 格式的配置文件"""
     config = {}
+    try:
+        with open(config_file, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                # 跳过空行和注释
+                if not line or line.startswith("#"):
+                    continue
+                # 解析 KEY=VALUE
+                if "=" in line:
+                    key, _, value = line.partition("=")
+                    key = key.strip()
+                    value = value.strip().strip('"').strip("'")
+                    config[key] = value
+    except Exception as e:
+        print(f"[WARN] 无法加载配置文件 {config_file}: {e}")
+    return config
+
+
+def _load_config_file() -> Dict[str, str]:
+    """
+    从配置文件加载配置
+
+    解析结果按文件签名缓存，文件未修改时不会重复读取；
+    返回的字典在多次调用间共享，调用方不应修改。
+    """
     config_file = _get_config_dir() / "config.env"
+    signature = _config_file_signature(config_file)
 
-    if config_file.exists():
-        try:
-            with open(config_file, "r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    # 跳过空行和注释
-                    if not line or line.startswith("#"):
-                        continue
-                    # 解析 KEY=VALUE
-                    if "=" in line:
-                        key, _, value = line.partition("=")
-                        key = key.strip()
-                        value = value.strip().strip('"').strip("'")
-                        config[key] = value
-        except Exception as e:
-            print(f"[WARN] 无法加载配置文件 {config_file}: {e}")
+    with _file_cache_lock:
+        if _file_cache["signature"] == signature:
+            return _file_cache["values"]
 
-    return config
+    values = _parse_config_file(config_file) if signature[1] is not None else {}
+
+    with _file_cache_lock:
+        _file_cache["signature"] = signature
+        _file_cache["values"] = values
+    return values
 
 
 def _get_config(key: str, default: str = "") -> str:
@@ -57,10 +94,35 @@ def _get_config(key: str, default: str = "") -> str:
     return config.get(key, default)
 
 
-# API 配置
-ARK_API_KEY = _get_config("ARK_API_KEY", "")
-ARK_API_URL = _get_config("ARK_API_URL", "https://ark.cn-beijing.volces.com/api/v3/images/generations")
-MODEL_NAME = _get_config("MODEL_NAME", "doubao-seedream-4-0-250828")
+def _get_number(key: str, default: Union[int, float], cast: Callable[[str], Union[int, float]]) -> Union[int, float]:
+    """
+    获取数值配置
+
+    值无法转换为数字时打印警告（指明配置项）并使用默认值，
+    避免一个写错的配置项导致所有命令（包括 --help）在导入时失败。
+    """
+    value = _get_config(key, "")
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"[WARN] 配置项 {key}={value!r} 不是有效的数字，使用默认值 {default}", file=sys.stderr)
+        return default
+
+
+def _get_int(key: str, default: int) -> int:
+    """获取整数配置（无效值回退到默认值）"""
+    return _get_number(key, default, int)
+
+
+def _get_float(key: str, default: float) -> float:
+    """获取浮点数配置（无效值回退到默认值）"""
+    return _get_number(key, float(default), float)
+
+
+DEFAULT_API_URL = "https://ark.cn-beijing.volces.com/api/v3/images/generations"
+DEFAULT_MODEL_NAME = "doubao-seedream-4-0-250828"
 
 
 def _get_output_dir() -> str:
@@ -83,15 +145,187 @@ def _get_reference_dir() -> str:
     return str(Path(__file__).parent.parent / "reference_images")
 
 
+class Settings:
+    """
+    运行时可变的配置快照
+
+    只读对象，由 get_settings() 创建；配置文件或相关环境变量变化后，
+    get_settings() 返回新的实例，长时间运行的进程据此感知 Key/URL 的修改。
+    """
+
+    # 影响 Settings 的环境变量（任一变化都会重新构建）
+    ENV_KEYS = ("JIMENG_CONFIG_DIR", "ARK_API_KEY", "ARK_API_URL", "MODEL_NAME", "OUTPUT_DIR", "REFERENCE_DIR")
+
+    __slots__ = ("api_key", "api_url", "model_name", "output_dir", "reference_dir")
+
+    def __init__(self, api_key: str, api_url: str, model_name: str, output_dir: str, reference_dir: str):
+        self.api_key = api_key
+        self.api_url = api_url
+        self.model_name = model_name
+        self.output_dir = output_dir
+        self.reference_dir = reference_dir
+
+    @classmethod
+    def load(cls) -> "Settings":
+        """按当前环境变量与配置文件构建"""
+        return cls(
+            api_key=_get_config("ARK_API_KEY", ""),
+            api_url=_get_config("ARK_API_URL", DEFAULT_API_URL),
+            model_name=_get_config("MODEL_NAME", DEFAULT_MODEL_NAME),
+            output_dir=_get_output_dir(),
+            reference_dir=_get_reference_dir(),
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, Settings):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self) -> str:
+        masked = f"{self.api_key[:4]}***" if self.api_key else ""
+        return (
+            f"Settings(api_key={masked!r}, api_url={self.api_url!r}, model_name={self.model_name!r}, "
+            f"output_dir={self.output_dir!r}, reference_dir={self.reference_dir!r})"
+        )
+
+
+_settings_cache: Dict[str, Any] = {"key": None, "settings": None}
+
+
+def get_settings() -> Settings:
+    """
+    获取当前配置
+
+    每次调用只检查配置文件签名（一次 stat）与相关环境变量，
+    均未变化时返回缓存的 Settings，否则重新解析并构建。
+    """
+    cache_key = (
+        _config_file_signature(_get_config_dir() / "config.env"),
+        tuple(os.environ.get(name, "") for name in Settings.ENV_KEYS),
+    )
+    with _file_cache_lock:
+        if _settings_cache["key"] == cache_key:
+            return _settings_cache["settings"]
+
+    settings = Settings.load()
+    with _file_cache_lock:
+        _settings_cache["key"] = cache_key
+        _settings_cache["settings"] = settings
+    return settings
+
+
+_initial_settings = get_settings()
+
+# API 配置
+ARK_API_KEY = _initial_settings.api_key
+ARK_API_URL = _initial_settings.api_url
+MODEL_NAME = _initial_settings.model_name
+
 # 输出目录
-OUTPUT_DIR = _get_output_dir()
-REFERENCE_DIR = _get_reference_dir()
+OUTPUT_DIR = _initial_settings.output_dir
+REFERENCE_DIR = _initial_settings.reference_dir
 
 # 默认参数
+# 输出目录布局: flat（默认，全部在一层）/ date（YYYY/MM/DD 子目录）/ hash（文件名哈希前两位，256 个子目录）
+OUTPUT_LAYOUT = _get_config("OUTPUT_LAYOUT", "flat")
+
 DEFAULT_SIZE = "2048x2048"
 DEFAULT_WATERMARK = False
 DEFAULT_TIMEOUT = 60
 
+# HTTP 连接池配置
+HTTP_POOL_CONNECTIONS = _get_int("HTTP_POOL_CONNECTIONS", 4)   # 缓存的主机连接池数量
+HTTP_POOL_MAXSIZE = _get_int("HTTP_POOL_MAXSIZE", 16)          # 每个主机的最大连接数
+
+# 超时配置（秒）：连接超时 / 读取间隔超时 / 阶段总时长（含重试，0 表示不限）
+GENERATE_CONNECT_TIMEOUT = _get_float("GENERATE_CONNECT_TIMEOUT", 10)
+GENERATE_READ_TIMEOUT = _get_float("GENERATE_READ_TIMEOUT", DEFAULT_TIMEOUT)
+GENERATE_TOTAL_TIMEOUT = _get_float("GENERATE_TOTAL_TIMEOUT", 0)
+DOWNLOAD_CONNECT_TIMEOUT = _get_float("DOWNLOAD_CONNECT_TIMEOUT", 5)
+DOWNLOAD_READ_TIMEOUT = _get_float("DOWNLOAD_READ_TIMEOUT", 30)
+DOWNLOAD_TOTAL_TIMEOUT = _get_float("DOWNLOAD_TOTAL_TIMEOUT", 120)
+
+# 单个任务（重试 + 生成 + 下载）的截止时间（秒，0 表示不限）
+JOB_DEADLINE = _get_float("JOB_DEADLINE", 0)
+
+# asyncio 接口（ThreadedJimengAPIClient）线程池大小，即同时进行的请求上限
+ASYNC_MAX_CONCURRENCY = _get_int("ASYNC_MAX_CONCURRENCY", 16)
+
+# 图片下载分块大小（字节）
+DOWNLOAD_CHUNK_SIZE = _get_int("DOWNLOAD_CHUNK_SIZE", 64 * 1024)
+
+# 响应格式: url / b64_json / auto（按实测耗时自动选择）
+RESPONSE_FORMAT = _get_config("RESPONSE_FORMAT", "url")
+
+# 重试策略
+RETRY_MAX_ATTEMPTS = _get_int("RETRY_MAX_ATTEMPTS", 3)       # 最大尝试次数（含首次）
+RETRY_BASE_DELAY = _get_float("RETRY_BASE_DELAY", 1.0)       # 退避基准（秒）
+RETRY_MAX_DELAY = _get_float("RETRY_MAX_DELAY", 30)          # 单次等待上限（秒）
+RETRY_MAX_TOTAL = _get_float("RETRY_MAX_TOTAL", 180)         # 总耗时上限（秒）
+
+# 客户端限流（令牌桶，QPS 为 0 表示不限流）
+RATE_LIMIT_QPS = _get_float("RATE_LIMIT_QPS", 0)
+RATE_LIMIT_BURST = _get_float("RATE_LIMIT_BURST", 0)          # 0 表示等于 QPS
+RATE_LIMIT_SHARED = _get_config("RATE_LIMIT_SHARED", "true").lower() in ("1", "true", "yes")
+RATE_LIMIT_STATE_DIR = _get_config("RATE_LIMIT_STATE_DIR", str(_get_config_dir() / "ratelimit"))
+
+# 熔断器
+BREAKER_FAILURE_THRESHOLD = _get_int("BREAKER_FAILURE_THRESHOLD", 5)   # 连续失败次数
+BREAKER_RECOVERY_TIMEOUT = _get_float("BREAKER_RECOVERY_TIMEOUT", 30)  # 冷却时长（秒）
+
+# 结果缓存（仅缓存显式指定种子的请求）
+CACHE_ENABLED = _get_config("CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+CACHE_DIR = _get_config("CACHE_DIR", str(_get_config_dir() / "cache"))
+CACHE_MAX_BYTES = _get_int("CACHE_MAX_BYTES", 2 * 1024 ** 3)            # 默认 2 GiB
+CACHE_MAX_AGE = _get_float("CACHE_MAX_AGE_DAYS", 30) * 24 * 3600            # 秒
+
+# 批量生成默认线程数
+BATCH_MAX_WORKERS = _get_int("BATCH_MAX_WORKERS", 4)
+
+# 分阶段流水线（生成 -> 下载 -> 后处理）各阶段线程数与阶段间队列长度
+PIPELINE_GENERATE_WORKERS = _get_int("PIPELINE_GENERATE_WORKERS", 4)
+PIPELINE_DOWNLOAD_WORKERS = _get_int("PIPELINE_DOWNLOAD_WORKERS", 8)
+PIPELINE_POSTPROCESS_WORKERS = _get_int("PIPELINE_POSTPROCESS_WORKERS", 2)
+PIPELINE_QUEUE_SIZE = _get_int("PIPELINE_QUEUE_SIZE", 16)
+
+# 平台版本（后处理）: 并行进程数（0 表示 CPU 核数），生成的平台列表（逗号分隔，空表示全部）
+RENDITION_WORKERS = _get_int("RENDITION_WORKERS", 0)
+RENDITION_PLATFORMS = [p.strip() for p in _get_config("RENDITION_PLATFORMS", "").split(",") if p.strip()]
+
+# 近重复检测（感知哈希）
+DEDUP_HASH = _get_config("DEDUP_HASH", "phash")                                     # phash / dhash
+DEDUP_MAX_DISTANCE = _get_int("DEDUP_MAX_DISTANCE", 10)                   # 64 位哈希的汉明距离阈值
+DEDUP_RECENT_DAYS = _get_float("DEDUP_RECENT_DAYS", 0)                    # 只与最近 N 天的图片比较，0 表示全部
+DEDUP_INDEX_PATH = _get_config("DEDUP_INDEX_PATH", "")                              # 默认为输出目录下的 .dedup_index.jsonl
+
+# 参考图索引: 缩略图最长边（像素）
+REFERENCE_THUMBNAIL_SIZE = _get_int("REFERENCE_THUMBNAIL_SIZE", 256)
+
+# 本地参考图预处理: 缩小到最长边上限并重新编码为 data URI，结果按内容哈希缓存
+REFERENCE_MAX_SIDE = _get_int("REFERENCE_MAX_SIDE", 1024)
+REFERENCE_JPEG_QUALITY = _get_int("REFERENCE_JPEG_QUALITY", 85)
+REFERENCE_CACHE_DIR = _get_config("REFERENCE_CACHE_DIR", str(_get_config_dir() / "references"))
+REFERENCE_MEMORY_CACHE = _get_int("REFERENCE_MEMORY_CACHE", 32)                # 内存中保留的 data URI 数
+
+# 角色档案目录（<角色名>.json，见 app/profiles.py）
+CHARACTER_PROFILE_DIR = _get_config("CHARACTER_PROFILE_DIR", str(_get_config_dir() / "characters"))
+
+# 图片清单数据库（记录每张已保存图片的提示词、风格、平台、种子等信息）
+MANIFEST_ENABLED = _get_config("MANIFEST_ENABLED", "false").lower() in ("1", "true", "yes")
+MANIFEST_DB_PATH = _get_config("MANIFEST_DB_PATH", str(_get_config_dir() / "manifest.sqlite3"))
+
+# 持久化任务队列
+QUEUE_DB_PATH = _get_config("QUEUE_DB_PATH", str(_get_config_dir() / "queue.sqlite3"))
+QUEUE_LEASE_SECONDS = _get_float("QUEUE_LEASE_SECONDS", 900)              # 任务租约（秒），超时视为执行者已退出
+QUEUE_MAX_DOWNLOAD_ATTEMPTS = _get_int("QUEUE_MAX_DOWNLOAD_ATTEMPTS", 3)   # 已生成任务的最大下载尝试次数
+
+# 常驻服务（jimeng-selfie serve）
+SERVER_HOST = _get_config("SERVER_HOST", "127.0.0.1")
+SERVER_PORT = _get_int("SERVER_PORT", 8765)
+SERVER_SOCKET = _get_config("SERVER_SOCKET", "")                                   # 设置后改用 Unix socket
+SERVER_MAX_CONCURRENCY = _get_int("SERVER_MAX_CONCURRENCY", 8)           # 同时执行的生成请求数
+SERVER_QUEUE_TIMEOUT = _get_float("SERVER_QUEUE_TIMEOUT", 300)           # 排队等待上限（秒），超时返回 503
+
 # 自拍风格定义
 SELFIE_STYLES = [
     "镜面自拍", "举高自拍", "侧脸自拍", "遮脸自拍",
@@ -113,3 +347,10 @@ PLATFORM_STRATEGY = {
     "xiaohongshu": {"selfie_ratio": 0.7},  # 小红书
     "private": {"selfie_ratio": 1.0},  # 私聊（飞书/Telegram）
 }
+
+# 各平台发布版本: 裁剪比例（宽, 高；None 表示保持原比例）、最大尺寸、格式与质量
+PLATFORM_RENDITIONS = {
+    "x": {"aspect": (4, 5), "max_width": 1080, "max_height": 1350, "format": "JPEG", "quality": 85},
+    "xiaohongshu": {"aspect": (3, 4), "max_width": 1242, "max_height": 1656, "format": "JPEG", "quality": 90},
+    "private": {"aspect": None, "max_width": 1280, "max_height": 1280, "format": "WEBP", "quality": 80},
+}
@@ -0,0 +1,502 @@
+"""
+近重复检测
+为输出目录中的图片计算感知哈希（pHash/dHash），用 BK 树按汉明距离查找视觉上几乎相同的图片
+"""
+import os
+import json
+import math
+import time
+import threading
+import contextlib
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple, Union
+
+try:
+    import fcntl
+except ImportError:  # Windows 下仅在进程内互斥
+    fcntl = None
+
+from PIL import Image
+
+from .config import OUTPUT_DIR, DEDUP_HASH, DEDUP_MAX_DISTANCE, DEDUP_RECENT_DAYS, DEDUP_INDEX_PATH
+from .storage import atomic_write_chunks
+
+_LANCZOS = getattr(Image, "Resampling", Image).LANCZOS
+
+# 参与索引的图片扩展名
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# 扫描时跳过的子目录（派生文件与原图必然相似）
+_SKIP_DIRS = ("renditions",)
+
+# pHash: 32x32 灰度图的二维 DCT，取左上角 8x8 低频系数
+_DCT_SIZE = 32
+_DCT_KEEP = 8
+_DCT_TABLE = [
+    [math.cos(math.pi * (2 * x + 1) * u / (2 * _DCT_SIZE)) for x in range(_DCT_SIZE)]
+    for u in range(_DCT_KEEP)
+]
+
+
+def hamming(a: int, b: int) -> int:
+    """两个哈希之间的汉明距离"""
+    return bin(a ^ b).count("1")
+
+
+def _to_int(bits: List[bool]) -> int:
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    差值哈希: 缩小为 9x8 灰度图，逐行比较相邻像素的明暗
+
+    返回:
+        64 位整数哈希
+    """
+    pixels = image.convert("L").resize((9, 8), _LANCZOS).tobytes()
+    return _to_int([pixels[row * 9 + col + 1] > pixels[row * 9 + col] for row in range(8) for col in range(8)])
+
+
+def phash(image: Image.Image) -> int:
+    """
+    感知哈希: 缩小为 32x32 灰度图做 DCT，低频系数与其中位数比较
+
+    对缩放、重新压缩、轻微亮度调整不敏感。
+
+    返回:
+        64 位整数哈希
+    """
+    pixels = image.convert("L").resize((_DCT_SIZE, _DCT_SIZE), _LANCZOS).tobytes()
+    size = _DCT_SIZE
+
+    # 可分离的二维 DCT: 先对每行求低频系数，再对列求
+    rows = [
+        [sum(pixels[y * size + x] * basis[x] for x in range(size)) for basis in _DCT_TABLE]
+        for y in range(size)
+    ]
+    coefficients = [
+        sum(rows[y][u] * basis[y] for y in range(size))
+        for basis in _DCT_TABLE
+        for u in range(_DCT_KEEP)
+    ]
+
+    # 直流分量只反映整体亮度，不参与中位数
+    ac = sorted(coefficients[1:])
+    median = (ac[len(ac) // 2 - 1] + ac[len(ac) // 2]) / 2 if len(ac) % 2 == 0 else ac[len(ac) // 2]
+    return _to_int([c > median for c in coefficients])
+
+
+HASH_FUNCTIONS: Dict[str, Callable[[Image.Image], int]] = {"phash": phash, "dhash": dhash}
+
+
+def image_hash(path: str, algorithm: str = "phash") -> int:
+    """计算图片文件的感知哈希"""
+    with Image.open(path) as image:
+        return HASH_FUNCTIONS[algorithm](image)
+
+
+class BKTree:
+    """
+    BK 树（汉明距离度量）
+
+    按与父节点的距离分支，查询时利用三角不等式剪掉不可能命中的子树，
+    小阈值查询只访问很少的节点，十万级哈希也能快速查找。
+    """
+
+    def __init__(self):
+        # 节点: [哈希, 值列表, {距离: 子节点}]
+        self._root: Optional[list] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, key: int, value: Any):
+        """插入哈希及其关联值"""
+        self._size += 1
+        if self._root is None:
+            self._root = [key, [value], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [value], {}]
+                return
+            node = child
+
+    def remove(self, key: int, value: Any) -> bool:
+        """删除哈希关联的值（节点保留，用于维持树结构）"""
+        node = self._root
+        while node is not None:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                if value in node[1]:
+                    node[1].remove(value)
+                    self._size -= 1
+                    return True
+                return False
+            node = node[2].get(distance)
+        return False
+
+    def search(self, key: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """
+        查找汉明距离不超过 max_distance 的所有值
+
+        返回:
+            (距离, 值) 列表，按距离升序
+        """
+        if self._root is None:
+            return []
+
+        matches = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                matches.extend((distance, value) for value in node[1])
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in node[2].items() if low <= d <= high)
+
+        matches.sort(key=lambda m: m[0])
+        return matches
+
+
+class DuplicateIndex:
+    """
+    输出目录的近重复索引
+
+    每张图片的哈希以 JSON 行追加到索引文件（默认为输出目录下的 .dedup_index.jsonl），
+    启动时读入内存构建 BK 树；refresh() 只为新增或修改过的文件计算哈希。
+    读取、追加与压缩索引文件时持有文件锁，多个进程可共用同一索引。
+    可直接作为 GenerationPipeline 的后处理函数，新图片落盘后即时检查并加入索引:
+
+        index = DuplicateIndex()
+        index.refresh()
+        if index.find("output/new.jpg", since=time.time() - 7 * 86400):
+            ...
+    """
+
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        index_path: Optional[str] = None,
+        algorithm: Optional[str] = None,
+        max_distance: Optional[int] = None,
+        recent_days: Optional[float] = None
+    ):
+        """
+        参数:
+            output_dir: 图片目录（默认 OUTPUT_DIR）
+            index_path: 索引文件路径（默认 DEDUP_INDEX_PATH）
+            algorithm: 哈希算法 phash / dhash（默认 DEDUP_HASH）
+            max_distance: 判定为近重复的汉明距离上限（默认 DEDUP_MAX_DISTANCE）
+            recent_days: 后处理检查时只比较最近 N 天的图片，0 表示全部（默认 DEDUP_RECENT_DAYS）
+        """
+        self.output_dir = os.path.abspath(output_dir or OUTPUT_DIR)
+        self.index_path = index_path or DEDUP_INDEX_PATH or os.path.join(self.output_dir, ".dedup_index.jsonl")
+        self.algorithm = algorithm or DEDUP_HASH
+        if self.algorithm not in HASH_FUNCTIONS:
+            raise ValueError(f"不支持的哈希算法: {self.algorithm}")
+        self.max_distance = DEDUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.recent_days = DEDUP_RECENT_DAYS if recent_days is None else recent_days
+
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._tree = BKTree()
+        self._stale_lines = 0
+        self._loaded = False
+        self._file_lock_depth = 0
+
+    @property
+    def __name__(self) -> str:
+        return "dedup"
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def _key(self, path: str) -> str:
+        """索引中的路径: 输出目录内的文件记相对路径，目录整体移动后索引仍有效"""
+        path = os.path.abspath(path)
+        relative = os.path.relpath(path, self.output_dir)
+        return path if relative.startswith(os.pardir) else relative
+
+    def _path(self, key: str) -> str:
+        return key if os.path.isabs(key) else os.path.join(self.output_dir, key)
+
+    @contextlib.contextmanager
+    def _file_lock(self) -> Iterator[None]:
+        """
+        跨进程互斥访问索引文件（锁定旁边的 .lock 文件：压缩会替换索引文件本身）
+
+        可重入：已持有时直接执行（flock 对同一进程再次打开的文件也会阻塞）。
+        """
+        with self._lock:
+            if fcntl is None or self._file_lock_depth:
+                self._file_lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._file_lock_depth -= 1
+                return
+            os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+            fd = os.open(self.index_path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                self._file_lock_depth = 1
+                yield
+            finally:
+                self._file_lock_depth = 0
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        with self._file_lock():
+            self._read_index()
+
+    def _read_index(self):
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if record.get("removed"):
+                    self._discard(record["path"])
+                    self._stale_lines += 1
+                    continue
+                hash_value = int(record[self.algorithm], 16)
+            except (ValueError, KeyError, TypeError):
+                # 损坏的行或其他算法的记录
+                self._stale_lines += 1
+                continue
+            self._insert(record["path"], hash_value, record.get("mtime", 0), record.get("size", 0))
+
+    def _insert(self, key: str, hash_value: int, mtime: float, size: int):
+        old = self._entries.get(key)
+        if old is not None:
+            self._tree.remove(old["hash"], key)
+            self._stale_lines += 1
+        self._entries[key] = {"hash": hash_value, "mtime": mtime, "size": size}
+        self._tree.add(hash_value, key)
+
+    def _discard(self, key: str):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._tree.remove(old["hash"], key)
+            self._stale_lines += 1
+
+    def _record(self, key: str) -> str:
+        entry = self._entries[key]
+        return json.dumps({
+            "path": key, "mtime": entry["mtime"], "size": entry["size"],
+            self.algorithm: f"{entry['hash']:016x}",
+        }, ensure_ascii=False) + "\n"
+
+    def _append(self, keys: List[str], removed: Optional[List[str]] = None):
+        # 删除以标记记录追加，压缩时才真正去掉
+        lines = [json.dumps({"path": key, "removed": True}, ensure_ascii=False) + "\n" for key in removed or []]
+        lines += [self._record(key) for key in keys]
+        if not lines:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        with self._file_lock(), open(self.index_path, "a", encoding="utf-8") as f:
+            f.write("".join(lines))
+
+    def compact(self):
+        """重写索引文件，去掉已删除或被覆盖的记录"""
+        with self._lock, self._file_lock():
+            # 重新读取索引文件，其他进程追加的记录不会在重写时丢失
+            self._entries, self._tree, self._stale_lines = {}, BKTree(), 0
+            self._read_index()
+            self._loaded = True
+            data = "".join(self._record(key) for key in self._entries).encode("utf-8")
+            atomic_write_chunks(self.index_path, [data])
+            self._stale_lines = 0
+
+    def _hash_file(self, path: str) -> Tuple[int, float, int]:
+        stat = os.stat(path)
+        return image_hash(path, self.algorithm), stat.st_mtime, stat.st_size
+
+    def add(self, path: str) -> int:
+        """
+        将图片加入索引（文件未变化时直接返回已有哈希）
+
+        返回:
+            图片的哈希
+        """
+        key = self._key(path)
+        stat = os.stat(path)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is not None and (entry["mtime"], entry["size"]) == (stat.st_mtime, stat.st_size):
+                return entry["hash"]
+
+        # 计算哈希较慢，不持有锁
+        hash_value, mtime, size = self._hash_file(path)
+        with self._lock:
+            self._insert(key, hash_value, mtime, size)
+            self._append([key])
+        return hash_value
+
+    def relocate(self, moves: List[Tuple[str, str]]) -> int:
+        """
+        文件移动后更新索引路径（沿用已有哈希，不重新读取图片）
+
+        参数:
+            moves: [(原路径, 新路径), ...]
+
+        返回:
+            更新的记录数
+        """
+        with self._lock:
+            self._load()
+            moved, removed = [], []
+            for source, target in moves:
+                old_key, new_key = self._key(source), self._key(target)
+                entry = self._entries.get(old_key)
+                if entry is None:
+                    continue
+                self._discard(old_key)
+                self._insert(new_key, entry["hash"], entry["mtime"], entry["size"])
+                moved.append(new_key)
+                removed.append(old_key)
+            self._append(moved, removed)
+            return len(moved)
+
+    def _iter_images(self) -> Iterator[os.DirEntry]:
+        pending = [self.output_dir]
+        while pending:
+            try:
+                with os.scandir(pending.pop()) as entries:
+                    for entry in entries:
+                        if entry.name.startswith("."):
+                            continue  # 索引文件与下载中的临时文件
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in _SKIP_DIRS:
+                                pending.append(entry.path)
+                        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                            yield entry
+            except FileNotFoundError:
+                continue
+
+    def refresh(self) -> Dict[str, int]:
+        """
+        与输出目录同步: 为新增或修改过的图片计算哈希，移除已删除的图片
+
+        返回:
+            {"added": 新增/更新数, "removed": 移除数, "failed": 无法读取的图片数, "total": 索引中的图片数}
+        """
+        with self._lock:
+            self._load()
+            known = {key: (entry["mtime"], entry["size"]) for key, entry in self._entries.items()}
+
+        seen = set()
+        changed: List[Tuple[str, int, float, int]] = []
+        failed = 0
+        for entry in self._iter_images():
+            key = self._key(entry.path)
+            seen.add(key)
+            stat = entry.stat()
+            if known.get(key) == (stat.st_mtime, stat.st_size):
+                continue
+            try:
+                changed.append((key, *self._hash_file(entry.path)))
+            except (OSError, ValueError, Image.DecompressionBombError):
+                failed += 1
+
+        # 读取、修改与重写索引期间一直持有文件锁，扫描期间其他进程追加的记录不会丢失
+        with self._lock, self._file_lock():
+            self._entries, self._tree, self._stale_lines = {}, BKTree(), 0
+            self._read_index()
+            # 只移除扫描开始时已知的记录：扫描之后其他进程新加入的图片不在 seen 中
+            removed = [key for key in self._entries if key in known and not os.path.isabs(key) and key not in seen]
+            for key in removed:
+                self._discard(key)
+            for key, hash_value, mtime, size in changed:
+                self._insert(key, hash_value, mtime, size)
+
+            # 先追加再压缩：压缩会按索引文件重建内存中的记录
+            self._append([key for key, *_ in changed], removed)
+            if self._stale_lines > len(self._entries):
+                self.compact()
+            return {"added": len(changed), "removed": len(removed), "failed": failed, "total": len(self._entries)}
+
+    def find(
+        self,
+        target: Union[str, int],
+        max_distance: Optional[int] = None,
+        since: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        查找近重复图片
+
+        参数:
+            target: 图片路径或哈希值（路径本身不会出现在结果中）
+            max_distance: 汉明距离上限（默认 self.max_distance）
+            since: 只返回修改时间不早于该时间戳的图片
+
+        返回:
+            [{"path": 图片路径, "distance": 汉明距离, "mtime": 修改时间}, ...]，按距离升序
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        exclude = None
+        if isinstance(target, str):
+            exclude = self._key(target)
+            with self._lock:
+                self._load()
+                entry = self._entries.get(exclude)
+            target = entry["hash"] if entry is not None else image_hash(target, self.algorithm)
+
+        with self._lock:
+            self._load()
+            matches = []
+            for distance, key in self._tree.search(target, max_distance):
+                entry = self._entries[key]
+                if key == exclude or (since is not None and entry["mtime"] < since):
+                    continue
+                matches.append({"path": self._path(key), "distance": distance, "mtime": entry["mtime"]})
+        return matches
+
+    def is_duplicate(self, path: str, max_distance: Optional[int] = None, since: Optional[float] = None) -> bool:
+        """图片是否与索引中的其他图片近重复"""
+        return bool(self.find(path, max_distance, since))
+
+    def process(self, result: Dict[str, Any]):
+        """
+        生成结果后处理: 检查新图片是否与近期图片近重复，并加入索引
+
+        每张图片的近重复列表写入 image["duplicates"]，
+        有近重复时 result["duplicates"] 为所有近重复图片路径。
+        """
+        since = time.time() - self.recent_days * 86400 if self.recent_days else None
+        duplicates: List[str] = []
+        for image in result.get("images") or []:
+            path = image.get("local_path")
+            if not path:
+                continue
+            self.add(path)
+            image["duplicates"] = [m["path"] for m in self.find(path, since=since)]
+            duplicates.extend(p for p in image["duplicates"] if p not in duplicates)
+        if duplicates:
+            result["duplicates"] = duplicates
+
+    __call__ = process
@@ -4,28 +4,132 @@
 """
 import requests
 import os
+import json
 import time
+import queue
 import random
-from typing import Optional, List, Dict, Any
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple, Set, Callable, Union
 
 from .config import (
     ARK_API_KEY, ARK_API_URL, MODEL_NAME,
-    DEFAULT_SIZE, DEFAULT_WATERMARK, DEFAULT_TIMEOUT, OUTPUT_DIR
+    DEFAULT_SIZE, DEFAULT_WATERMARK, OUTPUT_DIR, OUTPUT_LAYOUT,
+    BATCH_MAX_WORKERS, DOWNLOAD_CHUNK_SIZE, RESPONSE_FORMAT,
+    GENERATE_CONNECT_TIMEOUT, GENERATE_READ_TIMEOUT, GENERATE_TOTAL_TIMEOUT,
+    DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT, DOWNLOAD_TOTAL_TIMEOUT,
+    JOB_DEADLINE, get_settings
 )
+from .session import PooledSession
+from .storage import atomic_write_chunks, iter_b64_decoded, link_or_copy, build_output_path, is_safe_prefix
+from .response_format import ResponseFormatSelector
+from .retry import RetryPolicy
+from .ratelimit import TokenBucket, create_rate_limiter
+from .breaker import CircuitBreaker, CircuitOpenError
+from .timeouts import Deadline, DeadlineExceeded, Timeouts, iter_within
+from .cache import ResultCache, CACHE_DEFAULT, CACHE_BYPASS, CACHE_MODES, create_result_cache
+from .manifest import Manifest, create_manifest
+from .references import ReferencePreparer
 
 
 class JimengAPIClient:
-    """即梦图片生成 API 客户端"""
+    """
+    即梦图片生成 API 客户端
 
-    def __init__(self, api_key: Optional[str] = None):
+    内部复用带连接池的 HTTP 会话，使用完毕后调用 close()，
+    或以上下文管理器方式使用：
+
+        with JimengAPIClient() as client:
+            client.generate("...")
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        pool_size: Optional[int] = None,
+        response_format: Optional[str] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        rate_limiter: Optional[TokenBucket] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        result_cache: Optional[ResultCache] = None,
+        manifest: Optional[Manifest] = None
+    ):
+        self._explicit_api_key = bool(api_key)
         self.api_key = api_key or ARK_API_KEY
         self.api_url = ARK_API_URL
         self.model = MODEL_NAME
         self.output_dir = OUTPUT_DIR
+        self.output_layout = OUTPUT_LAYOUT
+        self.download_chunk_size = DOWNLOAD_CHUNK_SIZE
+
+        # 分阶段超时与默认任务截止时间
+        self.generate_timeouts = Timeouts(
+            GENERATE_CONNECT_TIMEOUT, GENERATE_READ_TIMEOUT, GENERATE_TOTAL_TIMEOUT
+        )
+        self.download_timeouts = Timeouts(
+            DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT, DOWNLOAD_TOTAL_TIMEOUT
+        )
+        self.job_deadline = JOB_DEADLINE
+
+        # url / b64_json / auto
+        self.format_selector = ResponseFormatSelector(response_format or RESPONSE_FORMAT)
+
+        # 生成请求与图片下载共用的重试策略
+        self.retry_policy = retry_policy or RetryPolicy()
+
+        # 生成请求限流（同一 API Key 的进程共享配额，未配置时为 None）
+        self.rate_limiter = rate_limiter or create_rate_limiter(self.api_key)
+
+        # 生成接口熔断器（持续失败时快速失败）
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+        # 指定种子请求的结果缓存（未启用时为 None）
+        self.result_cache = result_cache or create_result_cache()
+
+        # 已保存图片的清单数据库（未启用时为 None）
+        self.manifest = manifest or create_manifest()
+
+        # 本地参考图预处理（缩小、编码为 data URI 并缓存）
+        self.reference_preparer = ReferencePreparer()
+
+        # API 与图片 CDN 共用一个连接池会话
+        self.session = PooledSession(pool_maxsize=pool_size)
 
         # 确保输出目录存在
         os.makedirs(self.output_dir, exist_ok=True)
 
+    def reload_settings(self) -> bool:
+        """
+        重新读取配置文件与环境变量中的 API Key、接口地址和模型
+
+        配置未变化时只做一次文件 stat，适合长时间运行的进程在每个任务前调用。
+        构造时显式传入的 api_key 不会被覆盖。
+
+        返回:
+            配置是否有变化
+        """
+        settings = get_settings()
+        api_key = self.api_key if self._explicit_api_key else settings.api_key
+        changed = (api_key, settings.api_url, settings.model_name) != (self.api_key, self.api_url, self.model)
+        self.api_key = api_key
+        self.api_url = settings.api_url
+        self.model = settings.model_name
+        return changed
+
+    def pool_stats(self) -> Dict[str, Dict[str, Any]]:
+        """连接池统计（按主机统计新建/复用连接数）"""
+        return self.session.stats()
+
+    def close(self):
+        """关闭连接池"""
+        self.session.close()
+
+    def __enter__(self) -> "JimengAPIClient":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
     def _build_headers(self) -> Dict[str, str]:
         """构建请求头"""
         return {
@@ -40,23 +144,34 @@ class JimengAPIClient:
         watermark: bool = DEFAULT_WATERMARK,
         reference_images: Optional[List[str]] = None,
         n: int = 1,
-        seed: Optional[int] = None
+        seed: Optional[int] = None,
+        stream: bool = False,
+        response_format: str = "url"
     ) -> Dict[str, Any]:
         """构建请求体"""
         payload = {
             "model": self.model,
             "prompt": prompt.replace("\n", " ").strip(),  # 必须单行
-            "response_format": "url",
+            "response_format": response_format,
             "size": size,
             "watermark": watermark,
             "n": n
         }
 
-        # 添加参考图（图生图模式）
+        # 添加参考图（图生图模式），本地文件转为缩小后的 data URI
         if reference_images:
-            payload["image"] = reference_images
+            payload["image"] = self.reference_preparer.prepare_all(reference_images)
             payload["sequential_image_generation"] = "disabled"
 
+        # 多图生成：一次请求返回 n 张图片
+        if n > 1:
+            payload["sequential_image_generation"] = "auto"
+            payload["sequential_image_generation_options"] = {"max_images": n}
+
+        # 流式响应：每张图片完成即推送
+        if stream:
+            payload["stream"] = True
+
         # 添加随机种子（可复现）
         if seed is not None:
             payload["seed"] = seed
@@ -65,6 +180,119 @@ class JimengAPIClient:
 
         return payload
 
+    def make_deadline(self, deadline: Any = None) -> Deadline:
+        """任务截止时间（从调用时开始计时）：显式指定优先，其次使用客户端默认值"""
+        if deadline is None and self.job_deadline:
+            deadline = self.job_deadline
+        return Deadline.coerce(deadline)
+
+    def _post_generation(
+        self,
+        payload: Dict[str, Any],
+        stream: bool = False,
+        deadline: Optional[Deadline] = None
+    ) -> requests.Response:
+        """
+        发送生成请求
+
+        每次尝试前经过熔断器检查并取得限流令牌，失败按重试策略重试。
+        超时、连接错误与 5xx 响应计为熔断器失败。
+        所有尝试与等待都不会越过本阶段的截止时间。
+        """
+        stage_deadline = self.generate_timeouts.stage_deadline(deadline)
+
+        def send() -> requests.Response:
+            stage_deadline.check("生成请求")
+            self.circuit_breaker.before_request()
+            try:
+                if self.rate_limiter is not None:
+                    if not self.rate_limiter.acquire(timeout=stage_deadline.remaining()):
+                        raise DeadlineExceeded("等待限流令牌超出截止时间")
+                headers = self._build_headers()
+                timeout = self.generate_timeouts.for_request(stage_deadline)
+            except BaseException:
+                # 请求未发出，归还半开状态的探测名额
+                self.circuit_breaker.release_probe()
+                raise
+
+            try:
+                response = self.session.post(
+                    self.api_url,
+                    headers=headers,
+                    json=payload,
+                    timeout=timeout,
+                    stream=stream
+                )
+            except Exception:
+                self.circuit_breaker.record_failure()
+                raise
+
+            if response.status_code >= 500:
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+            return response
+
+        return self.retry_policy.call(send, deadline=stage_deadline)
+
+    @staticmethod
+    def _new_result(prompt: str) -> Dict[str, Any]:
+        """创建初始结果字典"""
+        return {
+            "success": False,
+            "url": None,
+            "local_path": None,
+            "prompt": prompt,
+            "seed": None,
+            "images": [],
+            "cached": False,
+            "error": None
+        }
+
+    @staticmethod
+    def _make_image(item: Dict[str, Any], seed: Optional[int]) -> Dict[str, Any]:
+        """由响应中的单张图片数据构建图片信息"""
+        image = {
+            "url": item.get("url"),
+            "local_path": None,
+            "seed": item.get("seed", seed),
+            "size": item.get("size")
+        }
+        # b64_json 模式下图片数据随响应返回，保存到文件后移除
+        if item.get("b64_json"):
+            image["b64_json"] = item["b64_json"]
+        return image
+
+    @classmethod
+    def _parse_images(cls, data: Dict[str, Any], seed: Optional[int]) -> List[Dict[str, Any]]:
+        """从响应中提取所有图片（跳过失败项）"""
+        return [
+            cls._make_image(item, seed)
+            for item in data.get("data") or []
+            if item.get("url") or item.get("b64_json")
+        ]
+
+    @classmethod
+    def _parse_stream_event(cls, event: Dict[str, Any], seed: Optional[int]) -> List[Dict[str, Any]]:
+        """
+        从流式事件中提取图片
+
+        兼容两种事件格式:
+            {"created": ..., "data": [{"url": ...}]}
+            {"type": "image_generation.partial_succeeded", "url": ..., "size": ...}
+        """
+        if "data" in event:
+            return cls._parse_images(event, seed)
+        if event.get("url") or event.get("b64_json"):
+            return [cls._make_image(event, seed)]
+        return []
+
+    @staticmethod
+    def _format_api_error(response: requests.Response) -> str:
+        """格式化非 200 响应的错误信息"""
+        error_data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+        return f"API 请求失败 ({response.status_code}): {error_data.get('error', {}).get('message', response.text)}"
+
     def generate(
         self,
         prompt: str,
@@ -72,7 +300,12 @@ class JimengAPIClient:
         watermark: bool = DEFAULT_WATERMARK,
         reference_images: Optional[List[str]] = None,
         save_to_file: bool = True,
-        filename_prefix: str = "jimeng"
+        filename_prefix: str = "jimeng",
+        seed: Optional[int] = None,
+        n: int = 1,
+        deadline: Any = None,
+        cache_mode: str = CACHE_DEFAULT,
+        metadata: Optional[Dict[str, Any]] = None
     ) -> Dict[str, Any]:
         """
         生成图片
@@ -84,93 +317,674 @@ class JimengAPIClient:
             reference_images: 参考图 URL 列表（最多10张）
             save_to_file: 是否保存到文件
             filename_prefix: 文件名前缀
+            seed: 随机种子（不指定则随机生成）
+            n: 单次请求生成的图片数量（最多15张）
+            deadline: 任务截止时间（秒数或 Deadline），涵盖重试、生成与下载
+            cache_mode: 结果缓存模式（仅对指定 seed 且保存文件的请求生效）
+                        default 命中直接返回 / refresh 重新生成并覆盖 / bypass 不读写缓存
+            metadata: 写入图片清单的附加信息（如 style、platform）
 
         返回:
             {
                 "success": bool,
-                "url": str,          # 图片 URL
-                "local_path": str,   # 本地保存路径
+                "url": str,          # 第一张图片 URL（b64_json 模式下为 None）
+                "local_path": str,   # 第一张图片本地保存路径
                 "prompt": str,       # 使用的提示词
                 "seed": int,         # 随机种子
+                "images": list,      # 所有图片 [{"url", "local_path", "seed", "size"}]
+                "cached": bool,      # 是否来自结果缓存
                 "error": str         # 错误信息（如果有）
             }
         """
-        result = {
-            "success": False,
-            "url": None,
-            "local_path": None,
-            "prompt": prompt,
-            "seed": None,
-            "error": None
-        }
+        result, pending = self.request(
+            prompt, size, watermark, reference_images, save_to_file,
+            filename_prefix, seed, n, deadline, cache_mode, metadata
+        )
+        if pending is not None:
+            self.download(result, pending)
+        return result
+
+    def request(
+        self,
+        prompt: str,
+        size: str = DEFAULT_SIZE,
+        watermark: bool = DEFAULT_WATERMARK,
+        reference_images: Optional[List[str]] = None,
+        save_to_file: bool = True,
+        filename_prefix: str = "jimeng",
+        seed: Optional[int] = None,
+        n: int = 1,
+        deadline: Any = None,
+        cache_mode: str = CACHE_DEFAULT,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, Any], Optional[Dict[str, Any]]]:
+        """
+        分阶段生成的第一步：检查参数、查结果缓存并调用生成接口，不下载图片
+
+        依次调用 request() 与 download() 的效果与 generate() 相同，
+        二者可在不同线程中执行（见 GenerationPipeline）。
+
+        参数:
+            (同 generate)
+
+        返回:
+            (生成结果, 下载上下文)；失败、命中结果缓存或无需保存时下载上下文为 None，
+            此时生成结果即最终结果
+        """
+        result = self._new_result(prompt)
+        if not self._check_request(result, cache_mode, filename_prefix):
+            return result, None
+
+        try:
+            pending = self._request_generation(
+                result, prompt, size, watermark, reference_images, save_to_file,
+                filename_prefix, seed, n, self.make_deadline(deadline), cache_mode, metadata
+            )
+        except Exception as e:
+            result["error"] = self._describe_error(e)
+            return result, None
+        return result, pending
+
+    def download(self, result: Dict[str, Any], pending: Dict[str, Any]) -> bool:
+        """
+        分阶段生成的第二步：保存 request() 返回的图片，全部保存后写入结果缓存与图片清单
+
+        local_path 已存在的图片不重复下载，下载失败后可用同一结果再次调用。
 
+        参数:
+            result: request() 返回的生成结果（原地填充 local_path）
+            pending: request() 返回的下载上下文
+
+        返回:
+            是否全部保存完成（出错时错误信息写入 result["error"]）
+        """
+        missing = [
+            image for image in result["images"]
+            if not (image.get("local_path") and os.path.exists(image["local_path"]))
+        ]
+        try:
+            if missing:
+                self._save_images(missing, pending["prefix"], pending["deadline"])
+            if not all(image.get("local_path") for image in result["images"]):
+                result["error"] = "图片下载失败"
+                return False
+            self._complete_generation(result, pending)
+        except Exception as e:
+            result["error"] = self._describe_error(e)
+            return False
+        return True
+
+    def failed_result(self, prompt: str, error: Union[str, Exception]) -> Dict[str, Any]:
+        """构造失败的生成结果（error 为异常时转换为错误信息）"""
+        result = self._new_result(prompt)
+        result["error"] = error if isinstance(error, str) else self._describe_error(error)
+        return result
+
+    def _check_request(
+        self,
+        result: Dict[str, Any],
+        cache_mode: str = CACHE_DEFAULT,
+        filename_prefix: str = "jimeng"
+    ) -> bool:
+        """检查 API Key、缓存模式与文件名前缀，不满足时写入 result["error"] 并返回 False"""
         if not self.api_key:
             result["error"] = "未配置 API Key，请设置 ARK_API_KEY 环境变量"
+            return False
+
+        if cache_mode not in CACHE_MODES:
+            result["error"] = f"无效的缓存模式: {cache_mode}"
+            return False
+
+        # 前缀来自调用方（如常驻服务的请求体），不允许借此写到输出目录之外
+        if not is_safe_prefix(filename_prefix):
+            result["error"] = f"无效的文件名前缀: {filename_prefix!r}"
+            return False
+        return True
+
+    def _request_generation(
+        self,
+        result: Dict[str, Any],
+        prompt: str,
+        size: str,
+        watermark: bool,
+        reference_images: Optional[List[str]],
+        save_to_file: bool,
+        filename_prefix: str,
+        seed: Optional[int],
+        n: int,
+        deadline: Deadline,
+        cache_mode: str,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        生成的第一阶段：查结果缓存并调用生成接口，结果写入 result
+
+        返回:
+            仍需保存图片时返回保存上下文
+            {"prefix", "deadline", "response_format", "started", "cache_key", "size", "metadata"}，
+            否则（失败、缓存命中或无需保存）返回 None
+
+        异常:
+            请求过程中的异常原样抛出，由调用方转换为错误信息
+        """
+        # 构建请求
+        response_format = self.format_selector.choose(save_to_file)
+        payload = self._build_payload(
+            prompt, size, watermark, reference_images,
+            n=n, seed=seed, response_format=response_format
+        )
+        result["seed"] = payload.get("seed")
+
+        cache_key, hit = self._lookup_cache(
+            result, payload, seed, save_to_file, cache_mode, filename_prefix, size, metadata
+        )
+        if hit:
+            return None
+
+        started = time.monotonic()
+
+        # 发送请求（重试时沿用同一请求体，保证种子不变）
+        response = self._post_generation(payload, deadline=deadline)
+
+        # 检查响应
+        if response.status_code != 200:
+            result["error"] = self._format_api_error(response)
+            return None
+
+        data = response.json()
+
+        # 获取图片 URL
+        images = self._parse_images(data, result["seed"])
+        if not images:
+            result["error"] = "API 返回数据格式异常"
+            return None
+
+        result["images"] = images
+        result["url"] = images[0]["url"]
+        result["success"] = True
+
+        if not save_to_file:
+            return None
+        return {
+            "prefix": filename_prefix,
+            "deadline": deadline,
+            "response_format": response_format,
+            "started": started,
+            "cache_key": cache_key,
+            "size": size,
+            "metadata": metadata,
+        }
+
+    def _lookup_cache(
+        self,
+        result: Dict[str, Any],
+        payload: Dict[str, Any],
+        seed: Optional[int],
+        save_to_file: bool,
+        cache_mode: str,
+        filename_prefix: str,
+        size: Optional[str],
+        metadata: Optional[Dict[str, Any]]
+    ) -> Tuple[Optional[str], bool]:
+        """
+        指定种子的请求结果可复现，生成前先查结果缓存（命中时写入 result 并记录清单）
+
+        返回:
+            (缓存键，不使用缓存时为 None；是否命中)
+        """
+        if (self.result_cache is None or seed is None
+                or not save_to_file or cache_mode == CACHE_BYPASS):
+            return None, False
+        cache_key = self.result_cache.make_key(payload)
+        if cache_mode == CACHE_DEFAULT and self._load_cached(result, cache_key, filename_prefix):
+            self.record_manifest(result, size, filename_prefix, metadata)
+            return cache_key, True
+        return cache_key, False
+
+    def _complete_generation(self, result: Dict[str, Any], pending: Dict[str, Any]):
+        """图片保存后：填充 local_path，记录响应格式耗时，写入结果缓存与图片清单"""
+        images = result["images"]
+        result["local_path"] = images[0]["local_path"]
+        # 恢复执行的下载（started 为 None）不计入响应格式耗时
+        if pending["started"] is not None:
+            self.format_selector.record(
+                pending["response_format"], (time.monotonic() - pending["started"]) / len(images)
+            )
+        if pending["cache_key"] is not None:
+            self._store_cached(pending["cache_key"], images)
+        self.record_manifest(result, pending["size"], pending["prefix"], pending["metadata"])
+
+    def record_manifest(
+        self,
+        result: Dict[str, Any],
+        size: Optional[str] = None,
+        filename_prefix: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ):
+        """将已保存的图片写入图片清单（未启用时忽略），失败不影响生成结果"""
+        if self.manifest is None or not result.get("success"):
+            return
+        try:
+            self.manifest.record(result, size=size, model=self.model, prefix=filename_prefix, metadata=metadata)
+        except Exception as e:
+            print(f"[WARN] 写入图片清单失败: {e}")
+
+    def _describe_error(self, error: Exception) -> str:
+        """将生成过程中的异常转换为错误信息"""
+        if isinstance(error, CircuitOpenError):
+            return f"接口暂不可用: {str(error)}"
+        if isinstance(error, DeadlineExceeded):
+            return f"任务超时: {str(error)}"
+        if isinstance(error, requests.exceptions.Timeout):
+            return (
+                f"请求超时（连接 {self.generate_timeouts.connect} 秒 / "
+                f"读取 {self.generate_timeouts.read} 秒）"
+            )
+        if isinstance(error, requests.exceptions.RequestException):
+            return f"网络请求错误: {str(error)}"
+        return f"未知错误: {str(error)}"
+
+    def generate_stream(
+        self,
+        prompt: str,
+        size: str = DEFAULT_SIZE,
+        watermark: bool = DEFAULT_WATERMARK,
+        reference_images: Optional[List[str]] = None,
+        save_to_file: bool = True,
+        filename_prefix: str = "jimeng",
+        seed: Optional[int] = None,
+        n: int = 1,
+        on_image: Optional[Callable[[Dict[str, Any]], None]] = None,
+        deadline: Any = None,
+        cache_mode: str = CACHE_DEFAULT,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """
+        以流式响应生成图片
+
+        每收到一张图片的 URL 就立即开始下载并调用 on_image，
+        无需等待同一请求中的其他图片生成完毕。保存后与 generate() 一样
+        写入结果缓存与图片清单。
+
+        参数:
+            (同 generate)
+            on_image: 每张图片到达时的回调，参数为图片信息
+                      {"index", "url", "seed", "size", "local_path"}
+                      （回调时 local_path 尚未填充；命中结果缓存时已填充）
+
+        返回:
+            与 generate() 相同格式的生成结果
+        """
+        result = self._new_result(prompt)
+        if not self._check_request(result, cache_mode, filename_prefix):
             return result
 
+        executor = None
+        downloads = []
+        stream_error = None
+
         try:
-            # 构建请求
-            payload = self._build_payload(prompt, size, watermark, reference_images)
+            job_deadline = self.make_deadline(deadline)
+            response_format = self.format_selector.choose(save_to_file)
+            payload = self._build_payload(
+                prompt, size, watermark, reference_images, n=n, seed=seed, stream=True,
+                response_format=response_format
+            )
             result["seed"] = payload.get("seed")
 
-            # 发送请求
-            response = requests.post(
-                self.api_url,
-                headers=self._build_headers(),
-                json=payload,
-                timeout=DEFAULT_TIMEOUT
+            cache_key, hit = self._lookup_cache(
+                result, payload, seed, save_to_file, cache_mode, filename_prefix, size, metadata
             )
-
-            # 检查响应
-            if response.status_code != 200:
-                error_data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
-                result["error"] = f"API 请求失败 ({response.status_code}): {error_data.get('error', {}).get('message', response.text)}"
+            if hit:
+                if on_image is not None:
+                    for index, image in enumerate(result["images"]):
+                        on_image({**image, "index": index})
                 return result
 
-            data = response.json()
+            started = time.monotonic()
+            stage_deadline = self.generate_timeouts.stage_deadline(job_deadline)
+            response = self._post_generation(payload, stream=True, deadline=stage_deadline)
 
-            # 获取图片 URL
-            if "data" in data and len(data["data"]) > 0:
-                result["url"] = data["data"][0].get("url")
-                result["success"] = True
+            try:
+                if response.status_code != 200:
+                    result["error"] = self._format_api_error(response)
+                    return result
 
-                # 下载并保存图片
-                if save_to_file and result["url"]:
-                    result["local_path"] = self._download_image(
-                        result["url"],
-                        filename_prefix,
-                        result["seed"]
+                if save_to_file:
+                    workers = min(max(n, 1), self.session.pool_maxsize)
+                    executor = ThreadPoolExecutor(
+                        max_workers=workers, thread_name_prefix="jimeng-download"
                     )
+
+                lines = iter_within(
+                    response.iter_lines(decode_unicode=True), stage_deadline, "流式生成"
+                )
+                for event in iter_sse_events(lines):
+                    if event.get("error"):
+                        stream_error = event["error"].get("message", str(event["error"]))
+                        continue
+
+                    for image in self._parse_stream_event(event, result["seed"]):
+                        image["index"] = len(result["images"])
+                        result["images"].append(image)
+
+                        # 立即开始下载，不等待其他图片
+                        if executor is not None:
+                            future = executor.submit(
+                                self._save_image,
+                                image,
+                                filename_prefix,
+                                image["index"] if n > 1 else None,
+                                job_deadline
+                            )
+                            downloads.append((image, future))
+
+                        if on_image is not None:
+                            on_image(image)
+            finally:
+                response.close()
+
+            for image, future in downloads:
+                image["local_path"] = future.result()
+
+            if result["images"]:
+                result["url"] = result["images"][0]["url"]
+                result["success"] = True
+                if save_to_file:
+                    self._complete_generation(result, {
+                        "prefix": filename_prefix,
+                        "response_format": response_format,
+                        "started": started,
+                        "cache_key": cache_key,
+                        "size": size,
+                        "metadata": metadata,
+                    })
+            elif stream_error:
+                result["error"] = f"API 流式生成失败: {stream_error}"
             else:
                 result["error"] = "API 返回数据格式异常"
 
-        except requests.exceptions.Timeout:
-            result["error"] = f"请求超时（{DEFAULT_TIMEOUT}秒）"
-        except requests.exceptions.RequestException as e:
-            result["error"] = f"网络请求错误: {str(e)}"
         except Exception as e:
-            result["error"] = f"未知错误: {str(e)}"
+            result["error"] = self._describe_error(e)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
 
         return result
 
+    def _load_cached(self, result: Dict[str, Any], key: str, prefix: str) -> bool:
+        """从结果缓存填充 result，命中返回 True"""
+        try:
+            cached = self.result_cache.get(key)
+            if not cached:
+                return False
+
+            images = []
+            for index, item in enumerate(cached):
+                target = self._build_filepath(prefix, item["seed"], index if len(cached) > 1 else None)
+                link_or_copy(item["cache_path"], target)
+                images.append({
+                    "url": item["url"],
+                    "local_path": target,
+                    "seed": item["seed"],
+                    "size": item["size"]
+                })
+        except OSError as e:
+            # 缓存文件在读取过程中被淘汰等情况，按未命中处理
+            print(f"[WARN] 读取结果缓存失败: {e}")
+            return False
+
+        result.update(
+            success=True,
+            url=images[0]["url"],
+            local_path=images[0]["local_path"],
+            images=images,
+            cached=True
+        )
+        return True
+
+    def _store_cached(self, key: str, images: List[Dict[str, Any]]):
+        """写入结果缓存，失败不影响生成结果"""
+        try:
+            self.result_cache.put(key, images)
+        except Exception as e:
+            print(f"[WARN] 写入结果缓存失败: {e}")
+
+    def _run_job(self, job: Dict[str, Any], submitted: float) -> Dict[str, Any]:
+        """
+        执行单个批量任务，异常（包括参数错误）不会向外传播
+
+        参数:
+            job: generate() 的关键字参数
+            submitted: 提交时刻（time.monotonic()），deadline 从此时开始计时（含排队时间）
+        """
+        try:
+            deadline = job.get("deadline")
+            if deadline and not isinstance(deadline, Deadline):
+                deadline = Deadline(deadline)
+                deadline.expires_at -= time.monotonic() - submitted
+                job = {**job, "deadline": deadline}
+            return self.generate(**job)
+        except Exception as e:
+            result = self._new_result(job.get("prompt", ""))
+            result["error"] = f"任务执行失败: {str(e)}"
+            return result
+
+    def iter_batch(
+        self,
+        jobs: Iterable[Dict[str, Any]],
+        max_workers: Optional[int] = None
+    ) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        并发执行批量生成，按完成顺序逐个返回
+
+        任务由后台线程边读取边提交（同时执行的任务不超过 max_workers 的两倍），
+        jobs 可以是逐行读取标准输入的迭代器：读到一个任务就开始执行，
+        结果在完成时立即返回，不必等待全部任务读取完毕。
+
+        参数:
+            jobs: 任务迭代器，每项为 generate() 的关键字参数，如
+                  {"prompt": "...", "seed": 42, "filename_prefix": "v1"}
+                  其中 deadline 从读取到该任务时开始计时（含排队时间）
+            max_workers: 并发线程数
+
+        返回:
+            (任务序号, 生成结果) 迭代器
+        """
+        workers = max_workers or BATCH_MAX_WORKERS
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jimeng-batch")
+        done: "queue.Queue[Tuple[Optional[int], Any]]" = queue.Queue()
+        slots = threading.Semaphore(workers * 2)
+        stop = threading.Event()
+        running: Set[Future] = set()
+        running_lock = threading.Lock()
+        feed_error: List[BaseException] = []
+
+        def finished(future: Future, index: int):
+            with running_lock:
+                running.discard(future)
+            slots.release()
+            if not future.cancelled():
+                done.put((index, future.result()))
+
+        def feed():
+            count = 0
+            try:
+                for index, job in enumerate(jobs):
+                    while not slots.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    future = executor.submit(self._run_job, job, time.monotonic())
+                    with running_lock:
+                        running.add(future)
+                    future.add_done_callback(lambda f, i=index: finished(f, i))
+                    count += 1
+            except BaseException as e:
+                feed_error.append(e)
+            finally:
+                done.put((None, count))
+
+        feeder = threading.Thread(target=feed, name="jimeng-batch-feed", daemon=True)
+        feeder.start()
+        try:
+            total = None
+            received = 0
+            while total is None or received < total:
+                index, value = done.get()
+                if index is None:
+                    total = value
+                    continue
+                received += 1
+                yield index, value
+            if feed_error and not stop.is_set():
+                raise feed_error[0]
+        finally:
+            # 迭代提前结束时停止读取并取消尚未开始的任务
+            stop.set()
+            with running_lock:
+                pending = list(running)
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def generate_batch(
+        self,
+        jobs: Iterable[Dict[str, Any]],
+        max_workers: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        并发执行批量生成
+
+        单个任务失败只体现在其结果的 error 字段中，不影响其他任务。
+
+        参数:
+            jobs: 任务列表（格式同 iter_batch）
+            max_workers: 并发线程数
+
+        返回:
+            与 jobs 顺序一致的生成结果列表
+        """
+        jobs = list(jobs)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(jobs)
+        for index, result in self.iter_batch(jobs, max_workers):
+            results[index] = result
+        return results
+
+    def save_images(
+        self,
+        images: List[Dict[str, Any]],
+        filename_prefix: str = "jimeng",
+        deadline: Any = None
+    ) -> List[Optional[str]]:
+        """
+        保存 generate(save_to_file=False) 返回的图片
+
+        用于将生成与下载分开执行（例如生成结果先持久化，稍后再下载），
+        下载不会重新调用生成接口。
+
+        参数:
+            images: 生成结果中的图片列表（b64_json 数据写入后从对应项中移除）
+            filename_prefix: 文件名前缀
+            deadline: 截止时间（秒数或 Deadline）
+
+        返回:
+            与 images 顺序一致的本地路径列表（保存失败的项为 None）
+        """
+        if not images:
+            return []
+        self._save_images(images, filename_prefix, self.make_deadline(deadline))
+        return [image.get("local_path") for image in images]
+
+    def _save_images(
+        self,
+        images: List[Dict[str, Any]],
+        prefix: str,
+        deadline: Optional[Deadline] = None
+    ):
+        """并行保存多张图片，结果写回各项的 local_path"""
+        if len(images) == 1:
+            images[0]["local_path"] = self._save_image(images[0], prefix, deadline=deadline)
+            return
+
+        workers = min(len(images), self.session.pool_maxsize)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jimeng-download") as executor:
+            futures = {
+                executor.submit(self._save_image, image, prefix, index, deadline): image
+                for index, image in enumerate(images)
+            }
+            for future in as_completed(futures):
+                futures[future]["local_path"] = future.result()
+
+    def _save_image(
+        self,
+        image: Dict[str, Any],
+        prefix: str,
+        index: Optional[int] = None,
+        deadline: Optional[Deadline] = None
+    ) -> Optional[str]:
+        """保存单张图片：b64_json 数据直接解码写入，否则从 URL 下载"""
+        b64_data = image.pop("b64_json", None)
+        if b64_data:
+            return self._write_b64_image(b64_data, prefix, image["seed"], index)
+        return self._download_image(image["url"], prefix, image["seed"], index, deadline)
+
+    def _build_filepath(
+        self,
+        prefix: str,
+        seed: Optional[int] = None,
+        index: Optional[int] = None
+    ) -> str:
+        """生成输出文件路径（按 output_layout 分子目录，文件名唯一）"""
+        return build_output_path(self.output_dir, prefix, seed, index, self.output_layout)
+
+    def _write_b64_image(
+        self,
+        data: str,
+        prefix: str = "jimeng",
+        seed: Optional[int] = None,
+        index: Optional[int] = None
+    ) -> Optional[str]:
+        """将 Base64 图片数据分段解码写入本地文件"""
+        try:
+            filepath = self._build_filepath(prefix, seed, index)
+            atomic_write_chunks(filepath, iter_b64_decoded(data, self.download_chunk_size))
+            return filepath
+        except Exception as e:
+            print(f"保存图片失败: {e}")
+
+        return None
+
     def _download_image(
         self,
         url: str,
         prefix: str = "jimeng",
-        seed: Optional[int] = None
+        seed: Optional[int] = None,
+        index: Optional[int] = None,
+        deadline: Optional[Deadline] = None
     ) -> Optional[str]:
-        """下载图片到本地"""
+        """下载图片到本地（index 用于区分同一请求中的多张图片）"""
         try:
-            timestamp = int(time.time())
-            seed_suffix = f"_{seed}" if seed else ""
-            filename = f"{prefix}{seed_suffix}_{timestamp}.jpg"
-            filepath = os.path.join(self.output_dir, filename)
-
-            response = requests.get(url, timeout=30)
-            if response.status_code == 200:
-                with open(filepath, "wb") as f:
-                    f.write(response.content)
-                return filepath
+            filepath = self._build_filepath(prefix, seed, index)
+            stage_deadline = self.download_timeouts.stage_deadline(deadline)
+
+            # 分块流式写入，内存占用与图片大小无关
+            response = self.retry_policy.call(
+                lambda: self.session.get(
+                    url,
+                    timeout=self.download_timeouts.for_request(stage_deadline),
+                    stream=True
+                ),
+                deadline=stage_deadline
+            )
+            try:
+                if response.status_code == 200:
+                    chunks = response.iter_content(chunk_size=self.download_chunk_size)
+                    atomic_write_chunks(filepath, iter_within(chunks, stage_deadline, "图片下载"))
+                    return filepath
+            finally:
+                response.close()
         except Exception as e:
             print(f"下载图片失败: {e}")
 
@@ -207,12 +1021,99 @@ class JimengAPIClient:
         return self.generate(
             prompt=full_prompt,
             reference_images=reference_images,
-            filename_prefix=f"selfie_{style.replace(' ', '_')}"
+            filename_prefix=f"selfie_{style.replace(' ', '_')}",
+            metadata={"style": style, "platform": platform}
         )
 
+    def generate_character(
+        self,
+        character: str,
+        scene: str,
+        style: Optional[str] = None,
+        platform: Optional[str] = None,
+        use_references: bool = True,
+        **kwargs: Any
+    ) -> Dict[str, Any]:
+        """
+        生成角色场景图（提示词与参考图来自预先加载的角色档案）
+
+        参数:
+            character: 角色名
+            scene: 场景代码（如 cafe_alone、front_view）
+            style: 拍照风格（可选）
+            platform: 目标平台（记录到清单）
+            use_references: 是否携带角色的参考图
+            **kwargs: 其余参数同 generate()
+
+        返回:
+            生成结果；角色或场景不存在时 success 为 False
+        """
+        from .profiles import get_profile_library
+
+        try:
+            request = get_profile_library().request(character, scene, style, platform, use_references)
+        except ValueError as e:
+            result = self._new_result("")
+            result["error"] = str(e)
+            return result
+        return self.generate(**request, **kwargs)
+
+
+def _parse_sse_data(raw: str) -> Optional[Dict[str, Any]]:
+    """解析单个 SSE 事件的数据，无效时返回 None"""
+    try:
+        event = json.loads(raw)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
+
+
+def iter_sse_events(lines: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """
+    逐行解析 SSE（Server-Sent Events）流
+
+    每个事件的 data: 行拼接后按 JSON 解析，遇到 data: [DONE] 结束。
+    无法解析为 JSON 的事件会被跳过。
+    """
+    buffer: List[str] = []
+
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.rstrip("\r")
+
+        # 空行表示一个事件结束
+        if not line:
+            if buffer:
+                event = _parse_sse_data("\n".join(buffer))
+                buffer.clear()
+                if event is not None:
+                    yield event
+            continue
+
+        if not line.startswith("data:"):
+            continue  # 忽略 event:/id:/注释等字段
+
+        data = line[5:].lstrip()
+        if data == "[DONE]":
+            break
+
+        # 兼容事件之间没有空行分隔的流
+        if buffer:
+            event = _parse_sse_data("\n".join(buffer))
+            if event is not None:
+                buffer.clear()
+                yield event
+        buffer.append(data)
+
+    if buffer:
+        event = _parse_sse_data("\n".join(buffer))
+        if event is not None:
+            yield event
+
 
 # 便捷函数
 def generate_image(prompt: str, **kwargs) -> Dict[str, Any]:
     """快速生成图片的便捷函数"""
-    client = JimengAPIClient()
-    return client.generate(prompt, **kwargs)
+    with JimengAPIClient() as client:
+        return client.generate(prompt, **kwargs)
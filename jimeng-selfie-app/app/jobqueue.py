@@ -0,0 +1,460 @@
+"""
+持久化任务队列
+基于 SQLite 记录每个生成任务的状态，进程退出后重新启动可从中断处继续
+"""
+import os
+import json
+import time
+import socket
+import sqlite3
+import hashlib
+import threading
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, Dict, Any, Callable, Iterator, Tuple
+
+from .config import (
+    QUEUE_DB_PATH, QUEUE_LEASE_SECONDS, QUEUE_MAX_DOWNLOAD_ATTEMPTS, BATCH_MAX_WORKERS
+)
+
+# 任务状态
+QUEUED = "queued"          # 等待生成
+RUNNING = "running"        # 正在调用生成接口
+GENERATED = "generated"    # 已生成（已计费），等待下载
+SUCCEEDED = "succeeded"    # 图片已保存
+FAILED = "failed"          # 生成失败或下载多次失败
+STATUSES = (QUEUED, RUNNING, GENERATED, SUCCEEDED, FAILED)
+
+# 由队列控制、不允许出现在任务参数中的 generate() 参数
+_RESERVED_PARAMS = ("save_to_file",)
+
+# 生成后与图片信息一起持久化的下载上下文字段（见 JimengAPIClient.request）
+_DOWNLOAD_CONTEXT = ("prefix", "response_format", "cache_key", "size", "metadata")
+
+
+class JobQueue:
+    """
+    持久化任务队列
+
+    - 幂等: 每个任务有唯一键（默认取参数的哈希），重复提交不会产生新任务
+    - 租约: 执行者领取任务时获得限时租约，进程崩溃后租约过期（或本机进程
+            已不存在）时任务可被重新领取
+    - 不重复计费: 生成接口返回后先把图片信息写入数据库（generated），再下载；
+                  generated 状态的任务恢复时只重新下载，不会再次调用生成接口
+    - 重试: 生成失败的任务按重试策略退避后重新排队，尝试次数用尽才标记失败；
+            执行中抛出异常只将该任务标记失败，不影响其他任务
+    """
+
+    def __init__(
+        self,
+        db_path: Optional[str] = None,
+        lease_seconds: Optional[float] = None,
+        max_download_attempts: Optional[int] = None,
+        retry_policy=None
+    ):
+        """
+        参数:
+            db_path: 数据库文件路径
+            lease_seconds: 任务租约时长（秒），应大于单个任务的最长执行时间
+            max_download_attempts: 已生成任务的最大下载尝试次数
+            retry_policy: 生成失败时的 RetryPolicy（最大尝试次数与退避时长）
+        """
+        self.db_path = db_path or QUEUE_DB_PATH
+        self.lease_seconds = lease_seconds if lease_seconds is not None else QUEUE_LEASE_SECONDS
+        self.max_download_attempts = max(
+            1, max_download_attempts if max_download_attempts is not None else QUEUE_MAX_DOWNLOAD_ATTEMPTS
+        )
+        if retry_policy is None:
+            from .retry import RetryPolicy  # 延迟导入：jobs/server 导入本模块时不加载 requests
+            retry_policy = RetryPolicy()
+        self.retry_policy = retry_policy
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT NOT NULL UNIQUE,
+                    params TEXT NOT NULL,
+                    meta TEXT,
+                    status TEXT NOT NULL,
+                    generate_attempts INTEGER NOT NULL DEFAULT 0,
+                    download_attempts INTEGER NOT NULL DEFAULT 0,
+                    images TEXT,
+                    result TEXT,
+                    error TEXT,
+                    lease_owner TEXT,
+                    lease_until REAL,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status, id)")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """开启写事务（BEGIN IMMEDIATE，多进程间互斥），退出时提交并关闭"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @staticmethod
+    def make_key(params: Dict[str, Any]) -> str:
+        """由任务内容计算幂等键"""
+        raw = json.dumps(params, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _owner() -> str:
+        """当前执行者标识（主机:进程:线程）"""
+        return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+    @staticmethod
+    def _owner_alive(owner: str) -> bool:
+        """租约持有者是否可能仍在运行（无法判断时视为仍在运行）"""
+        host, _, rest = owner.partition(":")
+        pid_text = rest.partition(":")[0]
+        if host != socket.gethostname() or not pid_text.isdigit() or os.name == "nt":
+            return True
+        pid = int(pid_text)
+        if pid == os.getpid():
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+    @staticmethod
+    def _row_to_job(row: sqlite3.Row) -> Dict[str, Any]:
+        job = dict(row)
+        for field in ("params", "meta", "images", "result"):
+            job[field] = json.loads(job[field]) if job[field] is not None else None
+        return job
+
+    def submit(
+        self,
+        params: Dict[str, Any],
+        key: Optional[str] = None,
+        meta: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """
+        提交任务（幂等）
+
+        参数:
+            params: generate() 的关键字参数（需可 JSON 序列化，不含 save_to_file）
+            key: 幂等键（默认取 params 的哈希）；已存在时不重复提交
+            meta: 随任务保存的附加信息（如来源行号）
+
+        返回:
+            任务键
+
+        异常:
+            ValueError: 缺少 prompt 或包含队列保留参数
+        """
+        if not params.get("prompt"):
+            raise ValueError("任务缺少 prompt")
+        reserved = [name for name in _RESERVED_PARAMS if name in params]
+        if reserved:
+            raise ValueError(f"任务参数不能包含: {', '.join(reserved)}")
+
+        key = key or self.make_key(params)
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO jobs (key, params, meta, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(params, ensure_ascii=False),
+                 json.dumps(meta, ensure_ascii=False) if meta is not None else None, QUEUED, now, now)
+            )
+        return key
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """读取任务记录，不存在时返回 None"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE key = ?", (key,)).fetchone()
+        finally:
+            conn.close()
+        return self._row_to_job(row) if row is not None else None
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        finally:
+            conn.close()
+        counts = {status: 0 for status in STATUSES}
+        counts.update(dict(rows))
+        return counts
+
+    def release_stale(self) -> int:
+        """
+        释放本机已退出进程持有的租约，使其任务可立即被重新领取
+
+        返回:
+            释放的任务数
+        """
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT key, lease_owner FROM jobs WHERE status IN (?, ?) AND lease_owner IS NOT NULL",
+                (RUNNING, GENERATED)
+            ).fetchall()
+            stale = [key for key, owner in rows if not self._owner_alive(owner)]
+            for key in stale:
+                conn.execute("UPDATE jobs SET lease_until = 0 WHERE key = ?", (key,))
+        return len(stale)
+
+    def claim(self) -> Optional[Dict[str, Any]]:
+        """
+        领取一个可执行的任务
+
+        已生成待下载的任务优先（无需再次计费），其次是排队中（已过重试等待时间）
+        或租约已过期的任务。
+
+        返回:
+            任务记录（含 lease_owner），没有可执行任务时返回 None
+        """
+        now = time.time()
+        owner = self._owner()
+        with self._transaction() as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute(
+                """
+                SELECT * FROM jobs
+                WHERE status IN (?, ?, ?) AND (lease_until IS NULL OR lease_until < ?)
+                ORDER BY CASE status WHEN ? THEN 0 ELSE 1 END, id
+                LIMIT 1
+                """,
+                (QUEUED, RUNNING, GENERATED, now, GENERATED)
+            ).fetchone()
+            if row is None:
+                return None
+
+            # 租约过期的 running 任务无法确认是否已生成，只能重新生成
+            status = GENERATED if row["status"] == GENERATED else RUNNING
+            attempts_column = "download_attempts" if status == GENERATED else "generate_attempts"
+            conn.execute(
+                f"UPDATE jobs SET status = ?, {attempts_column} = {attempts_column} + 1, "
+                "lease_owner = ?, lease_until = ?, updated_at = ? WHERE key = ?",
+                (status, owner, now + self.lease_seconds, now, row["key"])
+            )
+            job = self._row_to_job(row)
+
+        job.update(status=status, lease_owner=owner)
+        job[attempts_column] += 1
+        return job
+
+    def _next_retry_in(self) -> Optional[float]:
+        """距最早一个等待重试的任务可领取还有多久（秒），没有等待重试的任务时返回 None"""
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            row = conn.execute(
+                "SELECT MIN(lease_until) FROM jobs WHERE status = ? AND lease_until IS NOT NULL",
+                (QUEUED,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    def _update(self, key: str, owner: str, **fields) -> bool:
+        """
+        在仍持有租约时更新任务
+
+        返回:
+            是否更新成功（租约已被其他执行者接管时为 False）
+        """
+        for field in ("images", "result"):
+            if field in fields and fields[field] is not None:
+                fields[field] = json.dumps(fields[field], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE key = ? AND lease_owner = ?",
+                (*fields.values(), key, owner)
+            )
+            return cursor.rowcount == 1
+
+    def process(self, client, job: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行已领取的任务
+
+        通过客户端的分阶段接口生成与下载（结果缓存、响应格式选择与任务截止时间照常生效），
+        两个阶段之间把图片信息与下载上下文写入数据库。
+
+        参数:
+            client: JimengAPIClient 实例
+            job: claim() 返回的任务记录
+
+        返回:
+            执行后的任务记录
+        """
+        key, owner = job["key"], job["lease_owner"]
+        params = job["params"]
+        download_attempts = job["download_attempts"]
+
+        if job["images"] is None:
+            result, pending = client.request(**params)
+            if not result["success"]:
+                attempts = job["generate_attempts"]
+                if attempts < self.retry_policy.max_attempts:
+                    # 生成失败不计费：退避后重新排队（lease_until 为最早可领取时间）
+                    self._update(key, owner, status=QUEUED, error=result["error"], lease_owner=None,
+                                 lease_until=time.time() + self.retry_policy.compute_delay(attempts))
+                else:
+                    self._update(key, owner, status=FAILED, result=result, error=result["error"],
+                                 lease_owner=None, lease_until=None)
+                return self.get(key)
+
+            if pending is None:
+                # 命中结果缓存，图片已在本地
+                self._update(key, owner, status=SUCCEEDED, images=result["images"], result=result,
+                             error=None, lease_owner=None, lease_until=None)
+                return self.get(key)
+
+            # 先持久化生成结果再下载：此后进程退出也只会重新下载，不会再次生成
+            summary = {
+                "prompt": result["prompt"],
+                "seed": result["seed"],
+                "download": {name: pending[name] for name in _DOWNLOAD_CONTEXT},
+            }
+            if not self._update(key, owner, status=GENERATED, images=result["images"], result=summary,
+                                download_attempts=1):
+                return self.get(key)
+            download_attempts = 1
+        else:
+            result, pending = self._resume(client, job)
+
+        # 下载失败的图片保留 b64_json 数据，供下次重试
+        b64_data = [image.get("b64_json") for image in result["images"]]
+        if client.download(result, pending):
+            self._update(key, owner, status=SUCCEEDED, images=result["images"], result=result, error=None,
+                         lease_owner=None, lease_until=None)
+        else:
+            for image, data in zip(result["images"], b64_data):
+                if data and not image.get("local_path"):
+                    image["b64_json"] = data
+            exhausted = download_attempts >= self.max_download_attempts
+            self._update(
+                key, owner,
+                status=FAILED if exhausted else GENERATED,
+                images=result["images"],
+                error=f"{result['error']}（图片已生成，重试只会重新下载）",
+                lease_owner=None,
+                lease_until=None
+            )
+        return self.get(key)
+
+    @staticmethod
+    def _resume(client, job: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """由已生成任务的记录重建生成结果与下载上下文（截止时间重新计时）"""
+        params = job["params"]
+        summary = job["result"] or {}
+        images = [dict(image) for image in job["images"]]
+        result = {
+            "success": True,
+            "url": images[0]["url"] if images else None,
+            "local_path": None,
+            "prompt": summary.get("prompt", params["prompt"]),
+            "seed": summary.get("seed"),
+            "images": images,
+            "cached": False,
+            "error": None,
+        }
+        context = summary.get("download") or {
+            "prefix": params.get("filename_prefix", "jimeng"),
+            "response_format": None,
+            "cache_key": None,
+            "size": params.get("size"),
+            "metadata": params.get("metadata"),
+        }
+        pending = {**context, "deadline": client.make_deadline(params.get("deadline")), "started": None}
+        return result, pending
+
+    def run(
+        self,
+        client,
+        max_workers: Optional[int] = None,
+        on_result: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, int]:
+        """
+        执行队列中所有可执行的任务，直到没有可领取的任务为止
+
+        参数:
+            client: JimengAPIClient 实例（所有线程共用）
+            max_workers: 并发线程数
+            on_result: 每个任务执行后的回调，参数为任务记录（含等待重试的任务）
+
+        返回:
+            各状态的任务数
+        """
+        self.release_stale()
+        workers = max_workers or BATCH_MAX_WORKERS
+
+        def work():
+            while True:
+                job = self.claim()
+                if job is None:
+                    # 还有等待重试的任务时等到可领取，否则结束
+                    wait = self._next_retry_in()
+                    if wait is None:
+                        return
+                    time.sleep(wait)
+                    continue
+                try:
+                    record = self.process(client, job)
+                except Exception as e:
+                    # 单个任务出错只标记该任务失败，其他任务继续执行
+                    print(f"[WARN] 任务 {job['key']} 执行失败: {e}")
+                    self._update(job["key"], job["lease_owner"], status=FAILED, error=f"任务执行异常: {e}",
+                                 lease_owner=None, lease_until=None)
+                    record = self.get(job["key"])
+                if on_result is not None:
+                    on_result(record)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jimeng-queue") as executor:
+            futures = [executor.submit(work) for _ in range(workers)]
+            for future in futures:
+                future.result()
+
+        return self.counts()
+
+    def retry_failed(self) -> int:
+        """
+        重新排队失败的任务（已生成的任务只重新下载）
+
+        返回:
+            重新排队的任务数
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            downloads = conn.execute(
+                "UPDATE jobs SET status = ?, download_attempts = 0, error = NULL, updated_at = ? "
+                "WHERE status = ? AND images IS NOT NULL",
+                (GENERATED, now, FAILED)
+            ).rowcount
+            generations = conn.execute(
+                "UPDATE jobs SET status = ?, generate_attempts = 0, error = NULL, result = NULL, "
+                "lease_until = NULL, updated_at = ? "
+                "WHERE status = ? AND images IS NULL",
+                (QUEUED, now, FAILED)
+            ).rowcount
+        return downloads + generations
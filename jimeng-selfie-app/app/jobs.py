@@ -0,0 +1,311 @@
+"""
+批量任务文件
+读取 JSONL 任务（每行一个任务），通过同一个客户端并发生成，并逐行输出 JSONL 结果
+"""
+import sys
+import json
+import threading
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple, TextIO
+
+from .config import OTHER_STYLES
+from .strategy import SelfieStrategy
+from .storage import is_safe_prefix
+from .jobqueue import SUCCEEDED, FAILED
+
+# 任务行中直接传给 generate() 的字段及其类型要求: 字段 -> (检查函数, 说明)
+_PASSTHROUGH_FIELDS = {
+    "seed": (lambda v: isinstance(v, int) and not isinstance(v, bool), "整数"),
+    "size": (lambda v: isinstance(v, str), "字符串"),
+    "n": (lambda v: isinstance(v, int) and not isinstance(v, bool), "整数"),
+    "watermark": (lambda v: isinstance(v, bool), "布尔值"),
+    "deadline": (lambda v: isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0, "正数"),
+    "cache_mode": (lambda v: isinstance(v, str), "字符串"),
+    "filename_prefix": (lambda v: isinstance(v, str) and is_safe_prefix(v), "不含路径的字符串"),
+}
+
+
+class JobError(ValueError):
+    """任务行格式错误"""
+
+
+def parse_job(data: Dict[str, Any], strategy: SelfieStrategy) -> Tuple[Dict[str, Any], Optional[str]]:
+    """
+    将任务行转换为 generate() 的关键字参数
+
+    任务字段:
+        prompt:     提示词（指定 style 或 selfie 时作为角色描述），未指定 character 时必填
+        character:  角色名（使用角色档案中预先生成的提示词与参考图，需同时指定 scene）
+        scene:      角色场景代码（如 cafe_alone）
+        selfie:     是否按平台策略选择风格并补全提示词
+        style:      拍照风格（自拍或他拍风格名）
+        platform:   目标平台（private/x/xiaohongshu），影响随机风格
+        references: 参考图 URL 列表
+        seed / size / n / watermark / deadline / cache_mode / filename_prefix: 同 generate()
+
+    返回:
+        (generate() 参数, 使用的风格；未使用风格时为 None)
+
+    异常:
+        JobError: 缺少提示词、角色或场景不存在，或字段类型错误
+    """
+    if not isinstance(data, dict):
+        raise JobError("任务必须是 JSON 对象")
+
+    if data.get("character") is not None:
+        return _parse_character_job(data)
+
+    prompt = data.get("prompt")
+    if not isinstance(prompt, str) or not prompt.strip():
+        raise JobError("缺少 prompt")
+
+    references = data.get("references")
+    if references is not None and (
+        not isinstance(references, list) or not all(isinstance(r, str) for r in references)
+    ):
+        raise JobError("references 必须是字符串列表")
+
+    style = data.get("style")
+    if style is None and data.get("selfie"):
+        style = strategy.select_style(data.get("platform", "private"))
+    if style is not None:
+        prompt = strategy.build_full_prompt(prompt, style, is_selfie=style not in OTHER_STYLES)
+
+    job: Dict[str, Any] = {"prompt": prompt, "filename_prefix": "batch"}
+    if references:
+        job["reference_images"] = references
+    # 风格与平台随图片写入清单
+    metadata = {k: v for k, v in (("style", style), ("platform", data.get("platform"))) if v is not None}
+    if metadata:
+        job["metadata"] = metadata
+    _copy_passthrough(data, job)
+    return job, style
+
+
+def _parse_character_job(data: Dict[str, Any]) -> Tuple[Dict[str, Any], Optional[str]]:
+    """角色场景任务: 提示词与参考图来自角色档案，任务中的 references 覆盖档案参考图"""
+    from .profiles import get_profile_library
+
+    style = data.get("style")
+    references = data.get("references")
+    if references is not None and (
+        not isinstance(references, list) or not all(isinstance(r, str) for r in references)
+    ):
+        raise JobError("references 必须是字符串列表")
+    try:
+        job = get_profile_library().request(
+            data["character"], data.get("scene") or "", style, data.get("platform"),
+            use_references=references is None
+        )
+    except ValueError as e:
+        raise JobError(str(e))
+    if references:
+        job["reference_images"] = references
+    _copy_passthrough(data, job)
+    return job, style
+
+
+def _copy_passthrough(data: Dict[str, Any], job: Dict[str, Any]):
+    """
+    检查并复制透传字段
+
+    异常:
+        JobError: 字段类型错误
+    """
+    for field, (valid, expected) in _PASSTHROUGH_FIELDS.items():
+        value = data.get(field)
+        if value is None:
+            continue
+        if not valid(value):
+            raise JobError(f"{field} 必须是{expected}")
+        job[field] = value
+
+
+def read_jobs(
+    lines: Iterable[str],
+    strategy: Optional[SelfieStrategy] = None
+) -> Iterator[Tuple[int, Dict[str, Any], Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    解析 JSONL 任务
+
+    空行与 # 开头的行被忽略。
+
+    返回:
+        (行号, 原始任务, generate() 参数, 风格) 迭代器；
+        格式错误时 generate() 参数为 None，风格位置为错误信息
+    """
+    strategy = strategy or SelfieStrategy()
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        data: Any = None
+        try:
+            data = json.loads(line)
+            job, style = parse_job(data, strategy)
+        except ValueError as e:
+            yield line_no, data if isinstance(data, dict) else {}, None, f"第 {line_no} 行无效: {e}"
+            continue
+        yield line_no, data, job, style
+
+
+def format_result(
+    line_no: int,
+    data: Dict[str, Any],
+    result: Dict[str, Any],
+    style: Optional[str] = None
+) -> Dict[str, Any]:
+    """构造一行输出结果（保留任务中的 id 便于调用方关联）"""
+    return {
+        "id": data.get("id"),
+        "line": line_no,
+        "success": result.get("success", False),
+        "prompt": result.get("prompt"),
+        "style": style,
+        "seed": result.get("seed"),
+        "url": result.get("url"),
+        "local_path": result.get("local_path"),
+        "images": [image.get("local_path") or image.get("url") for image in result.get("images") or []],
+        "cached": result.get("cached", False),
+        "renditions": result.get("renditions"),
+        "duplicates": result.get("duplicates", []),
+        "error": result.get("error"),
+    }
+
+
+class _ResultWriter:
+    """线程安全地逐行写出 JSON 结果并统计成功/失败数"""
+
+    def __init__(self, out: TextIO):
+        self.out = out
+        self.lock = threading.Lock()
+        self.stats = {"total": 0, "succeeded": 0, "failed": 0}
+
+    def emit(self, record: Dict[str, Any]):
+        with self.lock:
+            self.out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.out.flush()
+            self.stats["total"] += 1
+            self.stats["succeeded" if record["success"] else "failed"] += 1
+
+
+def run_jobs(
+    client,
+    lines: Iterable[str],
+    out: TextIO = sys.stdout,
+    max_workers: Optional[int] = None,
+    pipeline=None
+) -> Dict[str, int]:
+    """
+    执行批量任务文件
+
+    所有任务共用一个客户端（连接池、限流、熔断与缓存）。任务逐行解析并提交，
+    读到一行即开始执行（lines 可以是标准输入），每个任务完成后立即向 out
+    写出一行 JSON 结果并刷新。
+
+    参数:
+        client: JimengAPIClient 实例
+        lines: JSONL 任务行
+        out: 结果输出流
+        max_workers: 并发数（默认 BATCH_MAX_WORKERS）
+        pipeline: 指定 GenerationPipeline 时按阶段执行（忽略 max_workers）
+
+    返回:
+        {"total": 任务数, "succeeded": 成功数, "failed": 失败数}
+    """
+    writer = _ResultWriter(out)
+    pending: List[Tuple[int, Dict[str, Any], Optional[str]]] = []
+
+    def iter_valid_jobs() -> Iterator[Dict[str, Any]]:
+        # 在提交线程中执行：格式错误的行直接输出错误结果，其余按读取顺序编号提交
+        for line_no, data, job, style in read_jobs(lines):
+            if job is None:
+                writer.emit(format_result(line_no, data, {"error": style}))
+                continue
+            pending.append((line_no, data, style))
+            yield job
+
+    jobs = iter_valid_jobs()
+    results = pipeline.run(jobs) if pipeline is not None else client.iter_batch(jobs, max_workers)
+    for index, result in results:
+        line_no, data, style = pending[index]
+        writer.emit(format_result(line_no, data, result, style))
+
+    return writer.stats
+
+
+def run_jobs_queued(
+    queue,
+    client,
+    lines: Iterable[str],
+    out: TextIO = sys.stdout,
+    max_workers: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    通过持久化队列执行批量任务文件
+
+    任务以行内 id（没有时取整行内容的哈希）为幂等键提交到队列，
+    中断后用同一文件重新运行时，已完成的任务直接输出记录的结果，
+    已生成但未下载完的任务只重新下载。与前面的行幂等键相同的任务行
+    不会执行，输出一行错误结果。其他进程正在执行（持有租约）的任务
+    输出一行未完成的结果（计为失败），待其完成后重新运行即可取得结果。
+
+    参数:
+        queue: JobQueue 实例
+        client: JimengAPIClient 实例
+        lines: JSONL 任务行
+        out: 结果输出流
+        max_workers: 并发数
+
+    返回:
+        {"total": 任务数, "succeeded": 成功数, "failed": 失败数}
+    """
+    writer = _ResultWriter(out)
+    lock = threading.Lock()
+    submitted: Dict[str, Tuple[int, Dict[str, Any]]] = {}
+    first_lines: Dict[str, int] = {}
+
+    def emit_job(job: Dict[str, Any]):
+        if job["status"] not in (SUCCEEDED, FAILED):
+            return
+        with lock:
+            entry = submitted.pop(job["key"], None)
+        if entry is None:
+            return  # 队列中其他来源的任务
+        line_no, data = entry
+        result = {**(job["result"] or {}), "error": job["error"]}
+        writer.emit(format_result(line_no, data, result, (job["meta"] or {}).get("style")))
+
+    for line_no, data, job, style in read_jobs(lines):
+        if job is None:
+            writer.emit(format_result(line_no, data, {"error": style}))
+            continue
+        # 幂等键取自原始任务行：随机选择的风格不影响续跑（实际使用的风格记录在 meta 中）
+        key = str(data["id"]) if data.get("id") is not None else queue.make_key(data)
+        if key in first_lines:
+            error = f"第 {line_no} 行无效: 与第 {first_lines[key]} 行的任务重复（id 或内容相同）"
+            writer.emit(format_result(line_no, data, {"error": error}))
+            continue
+        first_lines[key] = line_no
+        key = queue.submit(job, key=key, meta={"style": style})
+        submitted[key] = (line_no, data)
+
+    # 上次运行已完成的任务直接输出记录的结果
+    for key in list(submitted):
+        emit_job(queue.get(key))
+
+    queue.run(client, max_workers, on_result=emit_job)
+
+    # 仍未结束的任务由其他执行者持有租约；期间已完成的直接输出结果
+    leased = 0
+    for key in list(submitted):
+        job = queue.get(key)
+        if job["status"] in (SUCCEEDED, FAILED):
+            emit_job(job)
+            continue
+        line_no, data = submitted.pop(key)
+        error = f"任务正由其他执行者处理（{job['status']}），完成后重新运行同一任务文件可获取结果"
+        writer.emit(format_result(line_no, data, {"error": error}, (job["meta"] or {}).get("style")))
+        leased += 1
+    if leased:
+        print(f"[WARN] {leased} 个任务正由其他执行者处理，结果未包含在本次输出中", file=sys.stderr)
+    return writer.stats
@@ -0,0 +1,299 @@
+"""
+图片清单数据库
+每张保存到本地的图片对应一行记录（提示词、风格、平台、种子、URL、尺寸、模型），
+按风格、平台、种子、时间和提示词查询时走索引，不需要扫描目录、解析文件名
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import contextlib
+from typing import Optional, List, Dict, Any, Iterator, Tuple
+
+from .config import MANIFEST_ENABLED, MANIFEST_DB_PATH
+from .storage import parse_output_filename
+
+# 查询时可用的排序字段
+_ORDER_FIELDS = ("created_at", "seed", "id")
+
+
+def prompt_hash(prompt: str) -> str:
+    """提示词哈希（首尾空白不影响结果）"""
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()[:32]
+
+
+class Manifest:
+    """
+    图片清单（SQLite）
+
+        manifest = Manifest()
+        for row in manifest.query(style="咖啡厅自拍", platform="x", since=time.time() - 7 * 86400):
+            print(row["path"])
+    """
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        参数:
+            db_path: 数据库文件路径（默认 MANIFEST_DB_PATH）
+        """
+        self.db_path = db_path or MANIFEST_DB_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS images (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL UNIQUE,
+                    prompt TEXT,
+                    prompt_hash TEXT,
+                    style TEXT,
+                    platform TEXT,
+                    seed INTEGER,
+                    url TEXT,
+                    size TEXT,
+                    model TEXT,
+                    prefix TEXT,
+                    cached INTEGER NOT NULL DEFAULT 0,
+                    metadata TEXT,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            for name, columns in (
+                ("style", "style, platform, created_at"),
+                ("platform", "platform, created_at"),
+                ("seed", "seed"),
+                ("created_at", "created_at"),
+                ("prompt_hash", "prompt_hash"),
+            ):
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_images_{name} ON images({columns})")
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """开启写事务，退出时提交并关闭"""
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    @contextlib.contextmanager
+    def _reader(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        record = dict(row)
+        record["cached"] = bool(record["cached"])
+        record["metadata"] = json.loads(record["metadata"]) if record["metadata"] else {}
+        return record
+
+    def record(
+        self,
+        result: Dict[str, Any],
+        size: Optional[str] = None,
+        model: Optional[str] = None,
+        prefix: Optional[str] = None,
+        metadata: Optional[Dict[str, Any]] = None
+    ) -> int:
+        """
+        记录生成结果中已保存的图片（同一路径再次写入时覆盖）
+
+        参数:
+            result: generate() 返回的结果
+            size: 请求的图片尺寸（图片项自带尺寸时优先使用）
+            model: 模型名称
+            prefix: 文件名前缀
+            metadata: 附加信息，其中 style、platform 单独成列
+
+        返回:
+            写入的记录数
+        """
+        metadata = dict(metadata or {})
+        style = metadata.pop("style", None)
+        platform = metadata.pop("platform", None)
+        prompt = result.get("prompt") or ""
+        now = time.time()
+
+        rows = [
+            (
+                os.path.abspath(image["local_path"]), prompt, prompt_hash(prompt), style, platform,
+                image.get("seed", result.get("seed")), image.get("url"), image.get("size") or size,
+                model, prefix, int(bool(result.get("cached"))),
+                json.dumps(metadata, ensure_ascii=False) if metadata else None, now
+            )
+            for image in result.get("images") or []
+            if image.get("local_path")
+        ]
+        if not rows:
+            return 0
+
+        with self._transaction() as conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO images
+                    (path, prompt, prompt_hash, style, platform, seed, url, size, model, prefix,
+                     cached, metadata, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+        return len(rows)
+
+    @staticmethod
+    def _where(
+        style: Optional[str] = None,
+        platform: Optional[str] = None,
+        seed: Optional[int] = None,
+        prompt: Optional[str] = None,
+        prefix: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None
+    ) -> Tuple[str, List[Any]]:
+        clauses: List[str] = []
+        params: List[Any] = []
+        for column, value in (("style", style), ("platform", platform), ("seed", seed), ("prefix", prefix)):
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        if prompt is not None:
+            clauses.append("prompt_hash = ?")
+            params.append(prompt_hash(prompt))
+        if since is not None:
+            clauses.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("created_at < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def query(
+        self,
+        style: Optional[str] = None,
+        platform: Optional[str] = None,
+        seed: Optional[int] = None,
+        prompt: Optional[str] = None,
+        prefix: Optional[str] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        order_by: str = "created_at",
+        descending: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        查询图片记录（各条件之间为“且”）
+
+        参数:
+            style / platform / seed / prefix: 精确匹配
+            prompt: 提示词（按哈希精确匹配）
+            since / until: 记录时间范围（时间戳，含起点不含终点）
+            limit / offset: 分页
+            order_by: 排序字段 created_at / seed / id
+            descending: 是否倒序（默认最新在前）
+
+        返回:
+            记录列表，每项包含 path、prompt、style、platform、seed、url、size、model、
+            prefix、cached、metadata、created_at
+        """
+        if order_by not in _ORDER_FIELDS:
+            raise ValueError(f"不支持的排序字段: {order_by}")
+        where, params = self._where(style, platform, seed, prompt, prefix, since, until)
+        sql = f"SELECT * FROM images{where} ORDER BY {order_by} {'DESC' if descending else 'ASC'}, id"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._reader() as conn:
+            return [self._row_to_dict(row) for row in conn.execute(sql, params)]
+
+    def count(self, **filters: Any) -> int:
+        """满足条件的记录数（条件同 query）"""
+        where, params = self._where(**filters)
+        with self._reader() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM images{where}", params).fetchone()[0]
+
+    def get(self, path: str) -> Optional[Dict[str, Any]]:
+        """按文件路径获取记录"""
+        with self._reader() as conn:
+            row = conn.execute("SELECT * FROM images WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return self._row_to_dict(row) if row is not None else None
+
+    def remove(self, path: str) -> bool:
+        """删除记录"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM images WHERE path = ?", (os.path.abspath(path),))
+        return cursor.rowcount > 0
+
+    def prune(self) -> int:
+        """删除文件已不存在的记录，返回删除数"""
+        with self._reader() as conn:
+            paths = [row[0] for row in conn.execute("SELECT path FROM images")]
+        missing = [(path,) for path in paths if not os.path.exists(path)]
+        if missing:
+            with self._transaction() as conn:
+                conn.executemany("DELETE FROM images WHERE path = ?", missing)
+        return len(missing)
+
+    def relocate(self, moves: List[Tuple[str, str]]) -> int:
+        """
+        文件移动后更新记录路径
+
+        参数:
+            moves: [(原路径, 新路径), ...]
+
+        返回:
+            更新的记录数
+        """
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "UPDATE images SET path = ? WHERE path = ?",
+                [(os.path.abspath(target), os.path.abspath(source)) for source, target in moves]
+            )
+            return conn.total_changes - before
+
+    def import_files(self, directory: str) -> int:
+        """
+        导入清单建立之前保存的图片
+
+        前缀、种子与时间从文件名解析，提示词等信息无法恢复；已有记录的文件跳过。
+
+        返回:
+            新增的记录数
+        """
+        rows = []
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if not d.startswith(".") and d != "renditions"]
+            for name in files:
+                parsed = parse_output_filename(name)
+                if parsed is None:
+                    continue
+                path = os.path.abspath(os.path.join(root, name))
+                rows.append((path, parsed["prefix"], parsed["seed"], float(parsed["timestamp"])))
+
+        with self._transaction() as conn:
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO images (path, prefix, seed, created_at) VALUES (?, ?, ?, ?)", rows
+            )
+            return conn.total_changes - before
+
+
+def create_manifest() -> Optional[Manifest]:
+    """按配置创建图片清单（MANIFEST_ENABLED 关闭时返回 None）"""
+    if not MANIFEST_ENABLED:
+        return None
+    return Manifest()
@@ -0,0 +1,329 @@
+"""
+分阶段生成流水线
+生成 -> 下载 -> 后处理，各阶段有独立的线程数，阶段之间通过有界队列衔接
+"""
+import time
+import queue
+import inspect
+import threading
+from concurrent.futures import Future
+from typing import Optional, List, Dict, Any, Callable, Iterable, Iterator, Tuple
+
+from .config import (
+    PIPELINE_GENERATE_WORKERS, PIPELINE_DOWNLOAD_WORKERS,
+    PIPELINE_POSTPROCESS_WORKERS, PIPELINE_QUEUE_SIZE
+)
+
+# 通知工作线程退出
+_STOP = object()
+
+
+class Stage:
+    """
+    流水线阶段
+
+    固定数量的工作线程从有界队列取出任务交给 handler 处理。
+    队列满时 put() 阻塞，上游阶段因此自动放慢（背压）。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[Any], None],
+        workers: int,
+        queue_size: int,
+        on_error: Optional[Callable[[Any, Exception], None]] = None
+    ):
+        """
+        参数:
+            name: 阶段名称
+            handler: 处理函数，负责把任务交给下一阶段或结束任务
+            workers: 工作线程数
+            queue_size: 输入队列长度上限
+            on_error: handler 抛出异常时的回调 (任务, 异常)
+        """
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue: "queue.Queue[Any]" = queue.Queue(maxsize=max(1, queue_size))
+        self.on_error = on_error
+
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+        self._busy = 0
+        self._processed = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.monotonic()
+
+    def start(self):
+        """启动工作线程"""
+        self._started_at = time.monotonic()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"jimeng-{self.name}-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, item: Any):
+        """提交任务（队列满时阻塞）"""
+        self.queue.put(item)
+
+    def stop(self):
+        """处理完队列中的任务后停止所有工作线程"""
+        for _ in self._threads:
+            self.queue.put(_STOP)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+
+            with self._lock:
+                self._busy += 1
+            started = time.monotonic()
+            failed = False
+            try:
+                self.handler(item)
+            except Exception as e:
+                failed = True
+                if self.on_error is not None:
+                    self.on_error(item, e)
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    self._processed += 1
+                    self._failed += int(failed)
+                    self._busy_seconds += time.monotonic() - started
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        阶段指标
+
+        返回:
+            {
+                "workers": 工作线程数,
+                "busy": 正在处理的任务数,
+                "queue_depth": 排队中的任务数,
+                "queue_size": 队列长度上限,
+                "processed": 已处理任务数,
+                "failed": 处理异常的任务数,
+                "throughput": 每秒处理的任务数（自启动起平均）,
+                "avg_seconds": 单个任务平均处理时长
+            }
+        """
+        with self._lock:
+            elapsed = max(time.monotonic() - self._started_at, 1e-9)
+            return {
+                "workers": self.workers,
+                "busy": self._busy,
+                "queue_depth": self.queue.qsize(),
+                "queue_size": self.queue.maxsize,
+                "processed": self._processed,
+                "failed": self._failed,
+                "throughput": self._processed / elapsed,
+                "avg_seconds": self._busy_seconds / self._processed if self._processed else None,
+            }
+
+
+class _PipelineItem:
+    """在阶段之间传递的任务"""
+
+    __slots__ = ("future", "args", "result", "pending")
+
+    def __init__(self, future: Future, args: Dict[str, Any]):
+        self.future = future
+        self.args = args
+        self.result: Optional[Dict[str, Any]] = None
+        self.pending: Optional[Dict[str, Any]] = None
+
+
+class GenerationPipeline:
+    """
+    分阶段生成流水线
+
+    - generate:    调用生成接口（查缓存、限流、熔断、重试）
+    - download:    下载/写入图片，写入结果缓存
+    - postprocess: 依次执行后处理函数 fn(result)（如生成各平台版本）
+
+    生成线程拿到图片地址后立即处理下一个任务，CDN 下载较慢时不会占用生成并发；
+    下载队列满时生成阶段阻塞，内存中的待下载任务数有上限。
+    单个任务的结果与 generate() 相同，后处理出错记录在 result["postprocess_errors"]。
+
+        with GenerationPipeline(client) as pipeline:
+            for index, result in pipeline.run(jobs):
+                ...
+    """
+
+    def __init__(
+        self,
+        client,
+        generate_workers: Optional[int] = None,
+        download_workers: Optional[int] = None,
+        postprocess_workers: Optional[int] = None,
+        queue_size: Optional[int] = None,
+        postprocessors: Optional[List[Callable[[Dict[str, Any]], None]]] = None
+    ):
+        """
+        参数:
+            client: JimengAPIClient 实例
+            generate_workers: 生成阶段线程数
+            download_workers: 下载阶段线程数
+            postprocess_workers: 后处理阶段线程数
+            queue_size: 各阶段输入队列长度上限
+            postprocessors: 后处理函数列表，参数为生成结果（可修改）
+        """
+        self.client = client
+        self.postprocessors: List[Callable[[Dict[str, Any]], None]] = list(postprocessors or [])
+        queue_size = queue_size or PIPELINE_QUEUE_SIZE
+
+        self.stages = {
+            "generate": Stage(
+                "generate", self._generate, generate_workers or PIPELINE_GENERATE_WORKERS,
+                queue_size, self._fail
+            ),
+            "download": Stage(
+                "download", self._download, download_workers or PIPELINE_DOWNLOAD_WORKERS,
+                queue_size, self._fail
+            ),
+            "postprocess": Stage(
+                "postprocess", self._postprocess, postprocess_workers or PIPELINE_POSTPROCESS_WORKERS,
+                queue_size, self._fail
+            ),
+        }
+        self._closed = False
+        self._signature = inspect.signature(client.request)
+        for stage in self.stages.values():
+            stage.start()
+
+    def add_postprocessor(self, func: Callable[[Dict[str, Any]], None]):
+        """追加后处理函数"""
+        self.postprocessors.append(func)
+
+    def submit(self, job: Dict[str, Any]) -> Future:
+        """
+        提交任务（生成队列满时阻塞）
+
+        参数:
+            job: generate() 的关键字参数，deadline 从提交时开始计时
+
+        返回:
+            结果为生成结果字典的 Future
+        """
+        if self._closed:
+            raise RuntimeError("流水线已关闭")
+
+        future: Future = Future()
+        try:
+            bound = self._signature.bind(**job)
+            bound.apply_defaults()
+            args = dict(bound.arguments)
+            args["deadline"] = self.client.make_deadline(args["deadline"])
+        except TypeError as e:
+            # 参数错误只结束该任务
+            future.set_result(self.client.failed_result(job.get("prompt", ""), f"任务参数错误: {e}"))
+            return future
+
+        self.stages["generate"].put(_PipelineItem(future, args))
+        return future
+
+    def run(self, jobs: Iterable[Dict[str, Any]]) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """
+        执行一批任务，按完成顺序逐个返回
+
+        任务由后台线程逐个提交，提交受背压限制，结果可边生成边消费。
+
+        返回:
+            (任务序号, 生成结果) 迭代器
+        """
+        done: "queue.Queue[Tuple[Optional[int], Any]]" = queue.Queue()
+        feed_error: List[BaseException] = []
+
+        def feed():
+            count = 0
+            try:
+                for index, job in enumerate(jobs):
+                    future = self.submit(job)
+                    future.add_done_callback(lambda f, i=index: done.put((i, f.result())))
+                    count += 1
+            except BaseException as e:
+                feed_error.append(e)
+            finally:
+                done.put((None, count))
+
+        feeder = threading.Thread(target=feed, name="jimeng-pipeline-feed", daemon=True)
+        feeder.start()
+
+        total = None
+        received = 0
+        while total is None or received < total:
+            index, value = done.get()
+            if index is None:
+                total = value
+                continue
+            received += 1
+            yield index, value
+
+        feeder.join()
+        if feed_error:
+            raise feed_error[0]
+
+    def _finish(self, item: _PipelineItem):
+        if not item.future.done():
+            item.future.set_result(item.result)
+
+    def _fail(self, item: _PipelineItem, error: Exception):
+        """阶段处理异常：结束该任务并记录错误"""
+        failed = self.client.failed_result(item.args.get("prompt", ""), error)
+        if item.result is None:
+            item.result = failed
+        else:
+            item.result["error"] = failed["error"]
+        self._finish(item)
+
+    def _generate(self, item: _PipelineItem):
+        item.result, item.pending = self.client.request(**item.args)
+        if item.pending is not None:
+            self.stages["download"].put(item)
+        elif item.result["success"] and item.result["local_path"]:
+            # 命中结果缓存，直接后处理
+            self.stages["postprocess"].put(item)
+        else:
+            self._finish(item)
+
+    def _download(self, item: _PipelineItem):
+        if self.client.download(item.result, item.pending):
+            self.stages["postprocess"].put(item)
+        else:
+            self._finish(item)
+
+    def _postprocess(self, item: _PipelineItem):
+        for func in self.postprocessors:
+            try:
+                func(item.result)
+            except Exception as e:
+                name = getattr(func, "__name__", repr(func))
+                item.result.setdefault("postprocess_errors", []).append(f"{name}: {e}")
+        self._finish(item)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """各阶段指标（见 Stage.stats）"""
+        return {name: stage.stats() for name, stage in self.stages.items()}
+
+    def close(self):
+        """等待已提交的任务全部完成后停止各阶段"""
+        if self._closed:
+            return
+        self._closed = True
+        # 按顺序停止：上游停止后不会再向下游提交
+        for stage in self.stages.values():
+            stage.stop()
+
+    def __enter__(self) -> "GenerationPipeline":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,564 @@
+"""
+角色档案
+每个角色由外貌描述、场景模板与参考图组成。档案只加载一次，加载时为每个
+场景 × 风格组合预先拼好提示词，并从参考图索引中绑定角色的参考图，
+生成某个角色的场景图只需一次字典查找加一次 API 调用。
+
+档案文件为 CHARACTER_PROFILE_DIR 下的 <角色名>.json:
+
+    {
+        "name": "西娅",
+        "appearance": "一位25岁的亚洲女性，鹅蛋脸……",
+        "references": ["西娅_*"],
+        "scenes": {"office_desk": {"clothing": "……"}, "rooftop": {"description": "……"}}
+    }
+
+scenes 中与内置场景同名的字段覆盖内置值，新的场景代码作为自定义场景加入；
+references 为参考图目录中的文件名通配符（默认 <角色名>_* 与 <角色名>.*）。
+"""
+import os
+import json
+import fnmatch
+import threading
+from typing import Optional, List, Dict, Any, Tuple
+
+from .config import CHARACTER_PROFILE_DIR, REFERENCE_DIR, SELFIE_STYLES, OTHER_STYLES
+from .strategy import SelfieStrategy
+
+# 单次请求最多携带的参考图数
+MAX_REFERENCE_IMAGES = 10
+
+# 场景字段在提示词中的顺序与标签
+SCENE_FIELDS = (
+    ("description", "场景"),
+    ("clothing", "服装"),
+    ("pose", "姿态"),
+    ("expression", "表情"),
+    ("environment", "环境"),
+    ("lighting", "光线"),
+    ("mood", "氛围"),
+    ("special", "要求"),
+)
+
+# 内置场景模板（场景代码 -> 字段）
+SCENES: Dict[str, Dict[str, str]] = {
+    # === 工作 ===
+    "office_desk": {
+        "description": "开放式办公室，工位上堆着文件和办公用品",
+        "clothing": "白色衬衫，黑色西装外套，戴细框眼镜",
+        "pose": "低头看文件或电脑屏幕，手扶额头，专注但略带疲惫",
+        "expression": "自然的皱眉，不狰狞，专注工作状态",
+        "environment": "桌面有咖啡杯、便利贴、散落的笔，键盘有灰尘",
+        "lighting": "头顶日光灯，屏幕反光，非完美光线",
+    },
+    "office_window": {
+        "description": "办公室落地窗前，窗外是城市天际线",
+        "clothing": "解开一颗扣子的衬衫，脱掉外套搭在椅背上",
+        "pose": "双手抱胸，望向窗外，侧身站立",
+        "expression": "发呆走神，眼神空洞，嘴巴微张",
+        "environment": "玻璃上有轻微污渍，窗框有灰尘",
+        "lighting": "下午阳光斜射，脸部有明暗对比",
+    },
+    "meeting": {
+        "description": "会议室，投影仪投出模糊的图表",
+        "clothing": "正式西装套装，笔记本摊开",
+        "pose": "坐在会议椅上，手托下巴，做笔记",
+        "expression": "认真听讲，偶尔点头，微倦但不狰狞",
+        "environment": "桌面有水杯和笔，椅子皮革有磨损痕迹",
+        "lighting": "投影仪蓝光+日光灯混合，色温不均",
+    },
+    "pantry": {
+        "description": "公司茶水间，咖啡机、微波炉",
+        "clothing": "脱掉外套，只穿衬衫，袖子卷起",
+        "pose": "靠在柜台边，手里拿着咖啡杯",
+        "expression": "放松，嘴角自然下垂，发呆",
+        "environment": "台面有咖啡渍，水槽有未洗的杯子",
+        "lighting": "日光灯，有阴影",
+    },
+    # === 餐饮 ===
+    "cafe_alone": {
+        "description": "街角咖啡店，靠窗位置，窗外是行人",
+        "clothing": "米色针织开衫，白色内搭",
+        "pose": "双手捧着咖啡杯，低头看手机或发呆",
+        "expression": "无聊发呆，眼神涣散，嘴巴自然闭合",
+        "environment": "桌面有咖啡渍，杯垫有水痕，窗玻璃有反光",
+        "lighting": "午后阳光透过玻璃，有斑驳光影",
+    },
+    "cafe_work": {
+        "description": "咖啡店角落，笔记本电脑，咖啡杯",
+        "clothing": "休闲通勤装，针织衫+阔腿裤",
+        "pose": "低头打字，一只手托腮",
+        "expression": "专注但疲惫，眉头微皱，自然不狰狞",
+        "environment": "桌面杂乱，有笔记本、手机、耳机线缠绕",
+        "lighting": "室内灯光+窗外自然光混合",
+    },
+    "restaurant_solo": {
+        "description": "中档餐厅，一人桌，对面是空椅子",
+        "clothing": "简约连衣裙，小外套",
+        "pose": "正在吃饭，筷子或叉子送到嘴边",
+        "expression": "自然的咀嚼表情，不刻意，放松",
+        "environment": "桌上有餐巾纸团，盘子有酱汁痕迹",
+        "lighting": "暖色调室内灯光，有阴影",
+    },
+    "bar": {
+        "description": "昏暗的酒吧，霓虹灯光",
+        "clothing": "黑色小礼服，高跟鞋",
+        "pose": "坐在吧台边，手持鸡尾酒杯",
+        "expression": "微醺，眼神迷离，嘴角微微上扬",
+        "environment": "吧台有水渍，背景有人影晃动",
+        "lighting": "昏暗霓虹，脸部有彩色反光",
+    },
+    # === 居家 ===
+    "home_morning": {
+        "description": "卧室，乱糟糟的被子，床头柜有闹钟和手机",
+        "clothing": "丝绸睡衣，头发微乱，素颜或淡妆",
+        "pose": "坐在床边，揉眼睛，打哈欠",
+        "expression": "刚睡醒，眼睛半睁，迷茫",
+        "environment": "床头有书本、眼镜、发圈，被子没叠好",
+        "lighting": "早晨阳光透过窗帘，有灰尘飘浮",
+    },
+    "home_sofa": {
+        "description": "客厅沙发，电视亮着，茶几上有零食",
+        "clothing": "宽松T恤，运动短裤，光脚",
+        "pose": "蜷缩在沙发角落，抱着抱枕",
+        "expression": "看着电视，嘴角自然的表情，不刻意",
+        "environment": "茶几上有零食袋、遥控器、水杯，沙发有褶皱",
+        "lighting": "电视蓝光+台灯暖光混合",
+    },
+    "home_kitchen": {
+        "description": "厨房，灶台上有锅，台面有食材",
+        "clothing": "家居服，头发扎起",
+        "pose": "在切菜或搅拌，动作自然",
+        "expression": "专注但不紧张，嘴角放松",
+        "environment": "台面有面粉或酱汁痕迹，水槽有碗",
+        "lighting": "厨房顶灯，窗户有自然光",
+    },
+    "home_bathroom": {
+        "description": "浴室，镜子前，洗漱台上有护肤品",
+        "clothing": "浴袍，头发湿漉漉，脸上可能有面膜",
+        "pose": "对着镜子，正在护肤或化妆",
+        "expression": "认真端详自己，微皱眉或放松",
+        "environment": "镜面有水珠，台面有护肤品瓶子，毛巾有褶皱",
+        "lighting": "浴室顶灯，侧光",
+    },
+    # === 户外 ===
+    "street_walking": {
+        "description": "城市商业区街道，人行道",
+        "clothing": "驼色风衣，牛仔裤，运动鞋",
+        "pose": "自然行走，一只脚刚迈出，手臂自然摆动",
+        "expression": "看手机或望向前方，不看向镜头，走神状态",
+        "environment": "地面有污渍和落叶，背景有行人、车辆",
+        "lighting": "自然日光，有阴影",
+    },
+    "subway": {
+        "description": "地铁站台，有等车的乘客",
+        "clothing": "通勤装，背着帆布包",
+        "pose": "站着看手机，或靠着柱子",
+        "expression": "无聊，目光呆滞，等车的无奈",
+        "environment": "地面有黑色污渍，墙上有广告，有垃圾桶",
+        "lighting": "日光灯，有阴影",
+    },
+    "supermarket": {
+        "description": "超市货架间，推着购物车",
+        "clothing": "休闲装，运动鞋，扎马尾",
+        "pose": "推着购物车，伸手拿货架上的商品",
+        "expression": "认真挑选，微皱眉，对比商品",
+        "environment": "货架有商品，地面有污渍，购物车有灰尘",
+        "lighting": "超市日光灯，明亮但有阴影",
+    },
+    "park": {
+        "description": "城市公园，长椅，有树荫",
+        "clothing": "休闲连衣裙，平底鞋",
+        "pose": "坐在长椅上，翘着二郎腿，看手机",
+        "expression": "放松，偶尔抬头看周围",
+        "environment": "长椅有划痕，地面有落叶和尘土",
+        "lighting": "树荫下的斑驳阳光",
+    },
+    "beach": {
+        "description": "沙滩，海浪，远处有人",
+        "clothing": "沙滩长裙或泳衣外搭罩衫，太阳镜",
+        "pose": "赤脚站在沙滩上，裙摆被风吹起",
+        "expression": "望向大海，微眯眼（阳光刺眼）",
+        "environment": "沙滩有脚印，海水有泡沫",
+        "lighting": "强烈阳光，有高光和阴影",
+    },
+    # === 社交 ===
+    "gallery": {
+        "description": "艺术画廊，墙上挂着画",
+        "clothing": "文艺风格，衬衫+长裙",
+        "pose": "站在画作前，微微侧身观赏",
+        "expression": "认真看画，若有所思",
+        "environment": "地面有磨损痕迹，画框有灰尘",
+        "lighting": "画廊射灯，有明暗对比",
+    },
+    "cinema": {
+        "description": "电影院座位，屏幕亮着",
+        "clothing": "休闲装，手里拿着爆米花",
+        "pose": "坐在座位上，身体略微后仰",
+        "expression": "看电影，被剧情吸引或无聊",
+        "environment": "座位有磨损，地面有爆米花渣",
+        "lighting": "屏幕光线，昏暗环境",
+    },
+    "karaoke": {
+        "description": "KTV包厢，霓虹灯光，麦克风",
+        "clothing": "时尚休闲装，可能化了妆",
+        "pose": "坐在沙发上，拿着麦克风，或唱歌",
+        "expression": "投入唱歌，或疲惫地坐着",
+        "environment": "桌面有酒瓶、果盘，沙发有褶皱",
+        "lighting": "霓虹灯光，有阴影",
+    },
+    # === 运动 ===
+    "gym": {
+        "description": "健身房，器械区",
+        "clothing": "瑜伽裤，运动内衣，运动外套",
+        "pose": "在跑步机上，或做拉伸动作",
+        "expression": "专注或疲惫，额头有汗珠",
+        "environment": "器械有汗渍，地面有灰尘",
+        "lighting": "健身房日光灯，有阴影",
+    },
+    "yoga": {
+        "description": "瑜伽馆，瑜伽垫，镜子墙",
+        "clothing": "瑜伽服，扎马尾或散发",
+        "pose": "瑜伽姿势，如树式或下犬式",
+        "expression": "专注，呼吸均匀，闭眼或睁眼",
+        "environment": "瑜伽垫有褶皱，镜子有手印",
+        "lighting": "柔和自然光，有阴影",
+    },
+    "swimming": {
+        "description": "室内游泳馆，泳池边",
+        "clothing": "泳衣，泳帽，可能有泳镜",
+        "pose": "坐在泳池边，或站在水里",
+        "expression": "放松，可能有水珠在脸上",
+        "environment": "池边有水渍，瓷砖有磨损",
+        "lighting": "游泳馆灯光，水面反光",
+    },
+    # === 文化 ===
+    "bookstore": {
+        "description": "文艺书店，书架林立",
+        "clothing": "棉麻衬衫，长裙，平底鞋",
+        "pose": "站在书架前翻看书，或蹲在地上找书",
+        "expression": "认真看书，或若有所思",
+        "environment": "书架有灰尘，地面有书掉落，书页有折痕",
+        "lighting": "温暖的阅读灯光，有阴影",
+    },
+    "library": {
+        "description": "大学图书馆，自习区",
+        "clothing": "休闲装，可能戴着耳机",
+        "pose": "坐在桌前，摊开书本和笔记本",
+        "expression": "认真学习，偶尔发呆",
+        "environment": "桌面有书本、笔、水杯，椅子有磨损",
+        "lighting": "图书馆灯光，窗边有自然光",
+    },
+    # === 三视图 ===
+    "front_view": {
+        "description": "纯白色或浅灰色背景，无杂物",
+        "clothing": "白色短款紧身运动背心（露出腰部），黑色五分紧身裤，赤脚",
+        "pose": "正面站立，双手自然垂于身体两侧，双脚并拢",
+        "expression": "自然放松，直视镜头",
+        "environment": "纯白背景，便于抠图和建模参考",
+        "lighting": "均匀光线，无阴影",
+        "special": "全身可见，从头到脚完整，比例准确，适合3D建模参考，脸上无痣",
+    },
+    "side_view": {
+        "description": "纯白色或浅灰色背景，无杂物",
+        "clothing": "白色短款紧身运动背心（露出腰部），黑色五分紧身裤，赤脚",
+        "pose": "标准90度正侧面，身体完全侧对镜头，只能看到一只眼睛，看不到另一只眼睛，可以看到半个后脑勺，双手自然下垂",
+        "expression": "自然放松，平视前方",
+        "environment": "纯白背景，便于抠图和建模参考",
+        "lighting": "均匀光线，无阴影",
+        "special": "全身可见，标准90度正侧面，只能看到一只眼睛，适合3D建模参考，脸上无痣",
+    },
+    "back_view": {
+        "description": "纯白色或浅灰色背景，无杂物",
+        "clothing": "白色短款紧身运动背心（露出腰部），黑色五分紧身裤，赤脚",
+        "pose": "完全背对镜头站立，双手自然垂于身体两侧",
+        "expression": "头部自然正对前方",
+        "environment": "纯白背景，便于抠图和建模参考",
+        "lighting": "均匀光线，无阴影",
+        "special": "全身可见，背面轮廓清晰，适合3D建模参考，脸上无痣",
+    },
+}
+
+# 内置角色档案（档案目录中的同名文件覆盖内置值）
+BUILTIN_PROFILES: Dict[str, Dict[str, Any]] = {
+    "西娅": {
+        "name": "西娅",
+        "appearance": (
+            "一位25岁的亚洲女性，鹅蛋脸，杏眼双眼皮，深棕色瞳孔，及肩黑色长发，白皙肤色，"
+            "脸上完全没有痣，手臂上有几个小雀斑，膝盖有轻微疤痕，身高168cm，身材纤细匀称，气质优雅知性"
+        ),
+    },
+}
+
+
+def scene_fragment(scene: Dict[str, str]) -> str:
+    """将场景模板拼接为单行提示词片段（如 "场景：……，服装：……"）"""
+    return "，".join(f"{label}：{scene[field]}" for field, label in SCENE_FIELDS if scene.get(field))
+
+
+class CharacterProfile:
+    """
+    单个角色档案
+
+    prompts 在 compile() 时为每个 (场景, 风格) 组合生成，风格为 None 表示不加拍照风格；
+    references 在 bind_references() 时从参考图索引中选出。
+    """
+
+    def __init__(
+        self,
+        name: str,
+        appearance: str,
+        scenes: Optional[Dict[str, Dict[str, str]]] = None,
+        reference_patterns: Optional[List[str]] = None
+    ):
+        """
+        参数:
+            name: 角色名
+            appearance: 外貌描述（每个提示词都会包含）
+            scenes: 场景模板（默认内置场景）
+            reference_patterns: 参考图文件名通配符（默认 <角色名>_* 与 <角色名>.*）
+        """
+        self.name = name
+        self.appearance = " ".join(appearance.split())
+        self.scenes = scenes if scenes is not None else {code: dict(s) for code, s in SCENES.items()}
+        self.reference_patterns = reference_patterns or [f"{name}_*", f"{name}.*"]
+        self.references: List[Dict[str, Any]] = []
+        self._prompts: Dict[Tuple[str, Optional[str]], str] = {}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], name: Optional[str] = None) -> "CharacterProfile":
+        """
+        从档案数据创建（scenes 与内置场景合并）
+
+        异常:
+            ValueError: 缺少角色名或外貌描述，或字段类型错误
+        """
+        name = data.get("name") or name
+        appearance = data.get("appearance")
+        if not isinstance(name, str) or not name:
+            raise ValueError("角色档案缺少 name")
+        if not isinstance(appearance, str) or not appearance.strip():
+            raise ValueError(f"角色档案缺少 appearance: {name}")
+
+        overrides = data.get("scenes") or {}
+        references = data.get("references")
+        if not isinstance(overrides, dict) or not all(isinstance(s, dict) for s in overrides.values()):
+            raise ValueError(f"scenes 必须是 场景代码 -> 字段 的对象: {name}")
+        if references is not None and (
+            not isinstance(references, list) or not all(isinstance(r, str) for r in references)
+        ):
+            raise ValueError(f"references 必须是字符串列表: {name}")
+
+        scenes = {code: dict(scene) for code, scene in SCENES.items()}
+        for code, fields in overrides.items():
+            scenes.setdefault(code, {}).update(fields)
+        return cls(name, appearance, scenes, references)
+
+    def compile(self, strategy: Optional[SelfieStrategy] = None):
+        """为所有 场景 × 风格 组合预先生成提示词（格式与 SelfieStrategy.build_full_prompt 相同）"""
+        strategy = strategy or SelfieStrategy()
+        styles: List[Optional[str]] = [None, *SELFIE_STYLES, *OTHER_STYLES]
+        prompts = {}
+        for code, scene in self.scenes.items():
+            fragment = scene_fragment(scene)
+            for style in styles:
+                prompts[(code, style)] = strategy.build_full_prompt(
+                    self.appearance, style or "", fragment, is_selfie=style not in OTHER_STYLES
+                )
+        self._prompts = prompts
+
+    def bind_references(self, entries: List[Dict[str, Any]]):
+        """
+        从参考图索引记录中选出本角色的参考图
+
+        参数:
+            entries: ReferenceIndex.entries() 的返回值
+        """
+        matched = [
+            entry for entry in entries
+            if entry["format"] and any(fnmatch.fnmatch(entry["name"], p) for p in self.reference_patterns)
+        ]
+        self.references = matched[:MAX_REFERENCE_IMAGES]
+
+    @property
+    def reference_paths(self) -> List[str]:
+        """参考图路径列表"""
+        return [entry["path"] for entry in self.references]
+
+    def prompt(self, scene: str, style: Optional[str] = None) -> str:
+        """
+        获取预先生成的提示词
+
+        异常:
+            ValueError: 场景或风格不存在
+        """
+        if not self._prompts:
+            self.compile()
+        prompt = self._prompts.get((scene, style))
+        if prompt is not None:
+            return prompt
+        if scene not in self.scenes:
+            raise ValueError(f"未找到场景: {scene}，可用场景: {list(self.scenes)}")
+        raise ValueError(f"未知风格: {style}")
+
+    def request(
+        self,
+        scene: str,
+        style: Optional[str] = None,
+        platform: Optional[str] = None,
+        use_references: bool = True
+    ) -> Dict[str, Any]:
+        """
+        生成该角色场景图所需的 generate() 参数
+
+        返回:
+            {"prompt", "reference_images"（有参考图时）, "filename_prefix", "metadata"}
+        """
+        metadata = {"character": self.name, "scene": scene}
+        if style is not None:
+            metadata["style"] = style
+        if platform is not None:
+            metadata["platform"] = platform
+
+        kwargs: Dict[str, Any] = {
+            "prompt": self.prompt(scene, style),
+            "filename_prefix": f"{self.name}_{scene}",
+            "metadata": metadata,
+        }
+        if use_references and self.references:
+            kwargs["reference_images"] = self.reference_paths
+        return kwargs
+
+
+class ProfileLibrary:
+    """
+    角色档案库
+
+    首次访问时加载内置档案与档案目录中的 *.json，编译提示词并绑定参考图；
+    之后的查询直接使用内存中的结果，档案或参考图变化后调用 reload()。
+    """
+
+    def __init__(
+        self,
+        profile_dir: Optional[str] = None,
+        reference_dir: Optional[str] = None,
+        strategy: Optional[SelfieStrategy] = None
+    ):
+        """
+        参数:
+            profile_dir: 档案目录（默认 CHARACTER_PROFILE_DIR）
+            reference_dir: 参考图目录（默认 REFERENCE_DIR）
+            strategy: 拼接提示词使用的策略（默认新建 SelfieStrategy）
+        """
+        self.profile_dir = profile_dir or CHARACTER_PROFILE_DIR
+        self.reference_dir = reference_dir or REFERENCE_DIR
+        self.strategy = strategy or SelfieStrategy()
+
+        self._lock = threading.Lock()
+        self._profiles: Optional[Dict[str, CharacterProfile]] = None
+        self._index = None
+
+    @property
+    def index(self):
+        """参考图索引（首次使用时加载，避免启动时导入图像库）"""
+        if self._index is None:
+            from .references import ReferenceIndex
+            self._index = ReferenceIndex(self.reference_dir)
+        return self._index
+
+    def _read_profiles(self) -> Dict[str, Dict[str, Any]]:
+        """内置档案与档案目录中的档案数据（同名时目录中的优先）"""
+        data = {name: dict(profile) for name, profile in BUILTIN_PROFILES.items()}
+        try:
+            names = sorted(n for n in os.listdir(self.profile_dir) if n.endswith(".json"))
+        except FileNotFoundError:
+            names = []
+        for filename in names:
+            path = os.path.join(self.profile_dir, filename)
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    profile = json.load(f)
+                if not isinstance(profile, dict):
+                    raise ValueError("档案必须是 JSON 对象")
+            except (OSError, ValueError) as e:
+                print(f"[WARN] 无法加载角色档案 {path}: {e}")
+                continue
+            name = profile.get("name") or os.path.splitext(filename)[0]
+            data[name] = {**data.get(name, {}), **profile, "name": name}
+        return data
+
+    def _load(self) -> Dict[str, CharacterProfile]:
+        profiles = {}
+        for name, data in self._read_profiles().items():
+            try:
+                profile = CharacterProfile.from_dict(data, name)
+            except ValueError as e:
+                print(f"[WARN] 跳过角色档案: {e}")
+                continue
+            profile.compile(self.strategy)
+            profiles[name] = profile
+
+        try:
+            entries = self.index.entries()
+        except OSError as e:
+            print(f"[WARN] 无法读取参考图索引: {e}")
+            entries = []
+        for profile in profiles.values():
+            profile.bind_references(entries)
+        return profiles
+
+    def _ensure_loaded(self) -> Dict[str, CharacterProfile]:
+        with self._lock:
+            if self._profiles is None:
+                self._profiles = self._load()
+            return self._profiles
+
+    def reload(self):
+        """重新加载档案、编译提示词并绑定参考图"""
+        with self._lock:
+            self._profiles = self._load()
+
+    def names(self) -> List[str]:
+        """所有角色名"""
+        return list(self._ensure_loaded())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ensure_loaded()
+
+    def get(self, name: str) -> CharacterProfile:
+        """
+        获取角色档案
+
+        异常:
+            ValueError: 角色不存在
+        """
+        profiles = self._ensure_loaded()
+        profile = profiles.get(name)
+        if profile is None:
+            raise ValueError(f"未找到角色: {name}，可用角色: {list(profiles)}")
+        return profile
+
+    def request(
+        self,
+        name: str,
+        scene: str,
+        style: Optional[str] = None,
+        platform: Optional[str] = None,
+        use_references: bool = True
+    ) -> Dict[str, Any]:
+        """角色场景图的 generate() 参数（见 CharacterProfile.request）"""
+        return self.get(name).request(scene, style, platform, use_references)
+
+
+# 进程内共享的档案库
+_library: Optional[ProfileLibrary] = None
+_library_lock = threading.Lock()
+
+
+def get_profile_library() -> ProfileLibrary:
+    """进程内共享的角色档案库（首次调用时创建）"""
+    global _library
+    with _library_lock:
+        if _library is None:
+            _library = ProfileLibrary()
+        return _library
@@ -0,0 +1,155 @@
+"""
+客户端限流
+令牌桶算法，状态可保存在文件中供同一台机器上的多个进程共享
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Optional, Callable, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows 下仅支持进程内限流
+    fcntl = None
+
+from .config import (
+    RATE_LIMIT_QPS, RATE_LIMIT_BURST, RATE_LIMIT_SHARED, RATE_LIMIT_STATE_DIR
+)
+
+
+class TokenBucket:
+    """
+    令牌桶限流器
+
+    以 rate 个/秒的速度补充令牌，最多积累 burst 个。每次请求消耗一个令牌，
+    令牌不足时等待。指定 state_file 后，桶状态保存在文件中并通过文件锁
+    互斥访问，所有使用同一文件的线程和进程共享同一个配额。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[float] = None,
+        state_file: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        参数:
+            rate: 每秒补充的令牌数（即平均 QPS）
+            burst: 桶容量（允许的突发请求数，默认等于 rate 且至少为 1）
+            state_file: 共享状态文件路径（None 表示仅进程内共享）
+            clock: 时钟函数（跨进程共享时必须是墙上时钟）
+            sleep: 等待函数（便于测试替换）
+        """
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+
+        self.rate = float(rate)
+        self.burst = float(burst) if burst else max(1.0, self.rate)
+        self.state_file = state_file if fcntl is not None else None
+        self._clock = clock
+        self._sleep = sleep
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = clock()
+
+        if self.state_file:
+            os.makedirs(os.path.dirname(os.path.abspath(self.state_file)), exist_ok=True)
+
+    def _refill(self, tokens: float, updated: float, now: float) -> float:
+        """按经过的时间补充令牌"""
+        elapsed = max(0.0, now - updated)
+        return min(self.burst, tokens + elapsed * self.rate)
+
+    def _take(self, tokens: float, updated: float, count: float) -> Tuple[float, float, float]:
+        """
+        尝试取出令牌
+
+        返回:
+            (剩余令牌数, 状态更新时间, 需要等待的秒数；0 表示已取得)
+        """
+        now = self._clock()
+        available = self._refill(tokens, updated, now)
+        if available >= count:
+            return available - count, now, 0.0
+        return available, now, (count - available) / self.rate
+
+    def _take_shared(self, count: float) -> float:
+        """在文件锁保护下读写共享状态"""
+        fd = os.open(self.state_file, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            with os.fdopen(os.dup(fd), "r+") as f:
+                try:
+                    state = json.loads(f.read() or "{}")
+                    tokens = float(state["tokens"])
+                    updated = float(state["updated"])
+                except (ValueError, KeyError, TypeError):
+                    tokens, updated = self.burst, self._clock()
+
+                tokens, updated, wait = self._take(tokens, updated, count)
+
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps({"tokens": tokens, "updated": updated}))
+            return wait
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def try_acquire(self, count: float = 1) -> float:
+        """
+        尝试立即取得令牌
+
+        返回:
+            0 表示已取得；否则为大约还需等待的秒数（本次未消耗令牌）
+        """
+        with self._lock:
+            if self.state_file:
+                return self._take_shared(count)
+            self._tokens, self._updated, wait = self._take(self._tokens, self._updated, count)
+            return wait
+
+    def acquire(self, count: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        取得令牌，不足时阻塞等待
+
+        参数:
+            count: 需要的令牌数
+            timeout: 最长等待秒数（None 表示一直等待）
+
+        返回:
+            是否在超时前取得令牌
+        """
+        give_up_at = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(count)
+            if wait <= 0:
+                return True
+            if give_up_at is not None:
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            self._sleep(wait)
+
+
+def create_rate_limiter(api_key: str) -> Optional[TokenBucket]:
+    """
+    按配置创建限流器（RATE_LIMIT_QPS 为 0 时不限流）
+
+    同一 API Key 的所有进程共享一个状态文件，文件名取 Key 的哈希，不暴露 Key 本身。
+    """
+    if RATE_LIMIT_QPS <= 0:
+        return None
+
+    state_file = None
+    if RATE_LIMIT_SHARED:
+        key_hash = hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+        state_file = os.path.join(RATE_LIMIT_STATE_DIR, f"{key_hash}.json")
+
+    return TokenBucket(RATE_LIMIT_QPS, RATE_LIMIT_BURST or None, state_file)
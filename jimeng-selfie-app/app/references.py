@@ -0,0 +1,419 @@
+"""
+参考图索引与预处理
+- ReferenceIndex: 记录参考图的内容哈希、尺寸、格式与修改时间，并缓存缩略图，
+  列出或预览参考图时不需要解码原图
+- ReferencePreparer: 将本地参考图缩小、重新编码为 data URI，按内容哈希缓存，
+  同一参考图重复用于图生图时不再消耗 CPU 与上传流量
+"""
+import os
+import io
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Any, Tuple
+
+from PIL import Image, ImageOps
+
+from .config import (
+    REFERENCE_THUMBNAIL_SIZE, REFERENCE_MAX_SIDE, REFERENCE_JPEG_QUALITY,
+    REFERENCE_CACHE_DIR, REFERENCE_MEMORY_CACHE
+)
+from .storage import atomic_write_chunks
+
+_LANCZOS = getattr(Image, "Resampling", Image).LANCZOS
+
+# 支持的参考图格式
+REFERENCE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# 索引文件与缩略图目录（位于参考图目录内，以 . 开头不会被当作参考图；目录只读时改放缓存目录）
+INDEX_FILENAME = ".reference_index.json"
+THUMBNAIL_DIRNAME = ".thumbnails"
+
+# EXIF 方向标签
+_ORIENTATION = 0x0112
+
+# 原图可直接使用的格式
+_PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png"}
+
+# 可能包含拍摄设备、时间、地点等信息的元数据（带有时原图不能直接使用）
+_METADATA_INFO_KEYS = ("exif", "xmp", "XML:com.adobe.xmp", "photoshop", "comment")
+_METADATA_JPEG_MARKERS = ("APP1", "APP13", "COM")  # EXIF/XMP、IPTC、注释段
+
+# 处理结果缓存键版本（处理规则变化时递增，旧结果不再使用）
+_CACHE_VERSION = 2
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """分块计算文件内容的 SHA-256"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ReferenceIndex:
+    """
+    参考图索引
+
+    每个文件对应一条记录 {"name", "path", "sha256", "width", "height", "format", "mtime", "size", "thumbnail"}，
+    保存在参考图目录下的 .reference_index.json。refresh() 只重新读取修改时间或大小变化的文件；
+    缩略图按内容哈希命名，内容相同的参考图共用一张缩略图。
+    无法解码的文件仍会被列出，尺寸与格式为 None。
+
+    参考图目录不可写（如只读挂载）时，索引与缩略图改放到缓存目录下该参考图目录专属的子目录；
+    缓存目录也无法写入时只在内存中保留索引，列出参考图不受影响。
+    """
+
+    def __init__(
+        self,
+        reference_dir: str,
+        thumbnail_size: Optional[int] = None,
+        cache_dir: Optional[str] = None
+    ):
+        """
+        参数:
+            reference_dir: 参考图目录
+            thumbnail_size: 缩略图最长边（默认 REFERENCE_THUMBNAIL_SIZE）
+            cache_dir: 参考图目录不可写时使用的缓存目录（默认 REFERENCE_CACHE_DIR）
+        """
+        self.reference_dir = reference_dir
+        self.thumbnail_size = thumbnail_size or REFERENCE_THUMBNAIL_SIZE
+        directory_key = hashlib.sha1(os.path.abspath(reference_dir).encode("utf-8")).hexdigest()[:16]
+        self.fallback_dir = os.path.join(cache_dir or REFERENCE_CACHE_DIR, "index", directory_key)
+        self.index_path = os.path.join(reference_dir, INDEX_FILENAME)
+        self.thumbnail_dir = os.path.join(reference_dir, THUMBNAIL_DIRNAME)
+
+        self._lock = threading.RLock()
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._save_failed = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        if os.path.isdir(self.reference_dir) and not os.access(self.reference_dir, os.W_OK):
+            self.index_path = os.path.join(self.fallback_dir, INDEX_FILENAME)
+            self.thumbnail_dir = os.path.join(self.fallback_dir, THUMBNAIL_DIRNAME)
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("thumbnail_size") == self.thumbnail_size:
+                self._entries = {entry["name"]: entry for entry in data.get("entries", [])}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            # 没有索引或索引损坏时重新建立
+            self._entries = {}
+
+    def _save(self):
+        data = {"thumbnail_size": self.thumbnail_size, "entries": list(self._entries.values())}
+        try:
+            atomic_write_chunks(self.index_path, [json.dumps(data, ensure_ascii=False).encode("utf-8")])
+        except OSError as e:
+            # 索引只是加速用的缓存：无法写入时保留内存中的记录，只提示一次
+            if not self._save_failed:
+                print(f"[WARN] 无法保存参考图索引 {self.index_path}: {e}")
+            self._save_failed = True
+
+    def _thumbnail_path(self, sha256: str) -> str:
+        return os.path.join(self.thumbnail_dir, f"{sha256[:32]}.jpg")
+
+    def _make_thumbnail(self, image: Image.Image, target: str):
+        thumbnail = ImageOps.exif_transpose(image)
+        thumbnail.thumbnail((self.thumbnail_size, self.thumbnail_size), _LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.convert("RGB").save(buffer, "JPEG", quality=80)
+        atomic_write_chunks(target, [buffer.getvalue()])
+
+    def _read(self, path: str, stat: os.stat_result) -> Dict[str, Any]:
+        """读取单个文件的元数据，需要时生成缩略图"""
+        sha256 = file_sha256(path)
+        entry: Dict[str, Any] = {
+            "name": os.path.basename(path),
+            "sha256": sha256,
+            "width": None,
+            "height": None,
+            "format": None,
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "thumbnail": None,
+        }
+        thumbnail = self._thumbnail_path(sha256)
+        try:
+            with Image.open(path) as image:
+                entry.update(width=image.width, height=image.height, format=image.format)
+                if not os.path.exists(thumbnail):
+                    self._make_thumbnail(image, thumbnail)
+            entry["thumbnail"] = thumbnail
+        except (OSError, ValueError, Image.DecompressionBombError):
+            pass
+        return entry
+
+    def _public(self, entry: Dict[str, Any]) -> Dict[str, Any]:
+        return {**entry, "path": os.path.join(self.reference_dir, entry["name"])}
+
+    def refresh(self) -> bool:
+        """
+        与参考图目录同步（新增、修改、删除）
+
+        返回:
+            索引是否有变化
+        """
+        with self._lock:
+            self._load()
+            seen = set()
+            changed = False
+            try:
+                with os.scandir(self.reference_dir) as scanned:
+                    files = [
+                        entry for entry in scanned
+                        if not entry.name.startswith(".")
+                        and entry.name.lower().endswith(REFERENCE_EXTENSIONS)
+                        and entry.is_file()
+                    ]
+            except FileNotFoundError:
+                files = []
+
+            for file in files:
+                seen.add(file.name)
+                stat = file.stat()
+                known = self._entries.get(file.name)
+                if known is not None and (known["mtime"], known["size"]) == (stat.st_mtime, stat.st_size):
+                    continue
+                self._entries[file.name] = self._read(file.path, stat)
+                changed = True
+
+            for name in [name for name in self._entries if name not in seen]:
+                del self._entries[name]
+                changed = True
+
+            if changed:
+                self._save()
+                self._remove_unused_thumbnails()
+            return changed
+
+    def _remove_unused_thumbnails(self):
+        used = {os.path.basename(e["thumbnail"]) for e in self._entries.values() if e["thumbnail"]}
+        try:
+            names = os.listdir(self.thumbnail_dir)
+        except OSError:
+            return
+        for name in names:
+            if name not in used:
+                try:
+                    os.remove(os.path.join(self.thumbnail_dir, name))
+                except OSError:
+                    pass
+
+    def add(self, path: str) -> Dict[str, Any]:
+        """
+        将参考图目录中的文件加入索引（新增参考图后调用，无需重新扫描目录）
+
+        返回:
+            该文件的记录
+        """
+        with self._lock:
+            self._load()
+            entry = self._read(path, os.stat(path))
+            self._entries[entry["name"]] = entry
+            self._save()
+            return self._public(entry)
+
+    def entries(self, refresh: bool = True) -> List[Dict[str, Any]]:
+        """
+        所有参考图记录（按文件名排序）
+
+        参数:
+            refresh: 是否先与目录同步
+        """
+        with self._lock:
+            if refresh:
+                self.refresh()
+            else:
+                self._load()
+            return [self._public(self._entries[name]) for name in sorted(self._entries)]
+
+    def get(self, name_or_path: str, refresh: bool = True) -> Optional[Dict[str, Any]]:
+        """按文件名或路径获取记录，不存在时返回 None"""
+        with self._lock:
+            if refresh:
+                self.refresh()
+            entry = self._entries.get(os.path.basename(name_or_path))
+            return self._public(entry) if entry is not None else None
+
+    def find_by_hash(self, sha256: str) -> List[Dict[str, Any]]:
+        """内容哈希相同的参考图（用于发现重复添加的图片）"""
+        return [entry for entry in self.entries() if entry["sha256"] == sha256]
+
+    def thumbnail(self, name_or_path: str) -> Optional[str]:
+        """参考图缩略图路径（缩略图丢失时重新生成，无法解码时返回 None）"""
+        with self._lock:
+            entry = self._entries.get(os.path.basename(name_or_path))
+            if entry is None:
+                entry = self.get(name_or_path)
+            if entry is None or entry["thumbnail"] is None:
+                return None
+            if not os.path.exists(entry["thumbnail"]):
+                try:
+                    with Image.open(os.path.join(self.reference_dir, entry["name"])) as image:
+                        self._make_thumbnail(image, entry["thumbnail"])
+                except OSError:
+                    return None
+            return entry["thumbnail"]
+
+
+def _has_metadata(image: Image.Image) -> bool:
+    """图片是否带有 EXIF/XMP/IPTC/文本注释等元数据"""
+    if image.getexif() or any(key in image.info for key in _METADATA_INFO_KEYS):
+        return True
+    if getattr(image, "text", None):  # PNG 文本块
+        return True
+    return any(marker in _METADATA_JPEG_MARKERS for marker, _ in getattr(image, "applist", []))
+
+
+def prepare_reference(path: str, max_side: int, quality: int) -> Tuple[bytes, str]:
+    """
+    将参考图缩小到最长边不超过 max_side 并重新编码
+
+    有透明通道的图片编码为 PNG，其余编码为 JPEG；EXIF 方向应用到像素上，元数据丢弃。
+    原图已满足尺寸要求、不带元数据（EXIF/GPS 等不会随请求发出）且文件更小时直接使用原图。
+
+    返回:
+        (图片字节, MIME 类型)
+    """
+    with Image.open(path) as original:
+        source_format = original.format
+        source_size = original.size
+        upright = original.getexif().get(_ORIENTATION, 1) == 1
+        clean = not _has_metadata(original)
+
+        image = ImageOps.exif_transpose(original)
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), _LANCZOS)
+
+        buffer = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.convert("RGBA").save(buffer, "PNG", optimize=True)
+            mime = "image/png"
+        else:
+            image.convert("RGB").save(buffer, "JPEG", quality=quality, optimize=True)
+            mime = "image/jpeg"
+
+    data = buffer.getvalue()
+    if (source_format in _PASSTHROUGH_FORMATS and upright and clean and max(source_size) <= max_side
+            and os.path.getsize(path) <= len(data)):
+        with open(path, "rb") as f:
+            return f.read(), _PASSTHROUGH_FORMATS[source_format]
+    return data, mime
+
+
+class ReferencePreparer:
+    """
+    本地参考图预处理（带缓存）
+
+    URL 与 data URI 原样返回；本地文件缩小、重新编码后转为 data URI。
+    缓存分三层，均以内容哈希 + 处理参数为键:
+      - 文件路径、修改时间、大小 -> 内容哈希（未修改的文件不重新读取）
+      - 内存中最近使用的 data URI
+      - 磁盘上的处理结果（进程重启后无需重新解码）
+    """
+
+    def __init__(
+        self,
+        max_side: Optional[int] = None,
+        quality: Optional[int] = None,
+        cache_dir: Optional[str] = None,
+        memory_entries: Optional[int] = None
+    ):
+        """
+        参数:
+            max_side: 最长边上限（默认 REFERENCE_MAX_SIDE）
+            quality: JPEG 质量（默认 REFERENCE_JPEG_QUALITY）
+            cache_dir: 处理结果缓存目录（默认 REFERENCE_CACHE_DIR）
+            memory_entries: 内存中保留的 data URI 数（默认 REFERENCE_MEMORY_CACHE）
+        """
+        self.max_side = max_side or REFERENCE_MAX_SIDE
+        self.quality = quality or REFERENCE_JPEG_QUALITY
+        self.cache_dir = cache_dir or REFERENCE_CACHE_DIR
+        self.memory_entries = REFERENCE_MEMORY_CACHE if memory_entries is None else memory_entries
+
+        self._lock = threading.Lock()
+        self._hashes: Dict[str, Tuple[int, int, str]] = {}
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "prepared": 0}
+
+    @staticmethod
+    def is_local(reference: str) -> bool:
+        """是否为需要预处理的本地文件"""
+        return not reference.startswith(("http://", "https://", "data:")) and os.path.isfile(reference)
+
+    def _content_hash(self, path: str) -> str:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self._lock:
+            known = self._hashes.get(path)
+        if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        sha256 = file_sha256(path)
+        with self._lock:
+            self._hashes[path] = (stat.st_mtime_ns, stat.st_size, sha256)
+        return sha256
+
+    def _remember(self, key: str, uri: str):
+        with self._lock:
+            self._memory[key] = uri
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def prepare(self, reference: str) -> str:
+        """
+        预处理单个参考图
+
+        返回:
+            URL / data URI 原样返回，本地文件返回 data URI
+
+        异常:
+            OSError: 本地文件无法读取或不是有效图片
+        """
+        if not self.is_local(reference):
+            return reference
+
+        key = f"{self._content_hash(reference)[:32]}_{self.max_side}_q{self.quality}_v{_CACHE_VERSION}"
+        with self._lock:
+            uri = self._memory.get(key)
+            if uri is not None:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return uri
+
+        cache_path = os.path.join(self.cache_dir, key)
+        try:
+            with open(cache_path, "rb") as f:
+                data = f.read()
+            mime = "image/png" if data.startswith(b"\x89PNG") else "image/jpeg"
+            stat_name = "disk_hits"
+        except FileNotFoundError:
+            data, mime = prepare_reference(reference, self.max_side, self.quality)
+            try:
+                atomic_write_chunks(cache_path, [data])
+            except OSError as e:
+                print(f"[WARN] 写入参考图缓存失败: {e}")
+            stat_name = "prepared"
+
+        uri = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+        self._remember(key, uri)
+        with self._lock:
+            self._stats[stat_name] += 1
+        return uri
+
+    def prepare_all(self, references: List[str]) -> List[str]:
+        """按顺序预处理多个参考图"""
+        return [self.prepare(reference) for reference in references]
+
+    def stats(self) -> Dict[str, int]:
+        """缓存命中统计 {"memory_hits", "disk_hits", "prepared", "memory_entries"}"""
+        with self._lock:
+            return {**self._stats, "memory_entries": len(self._memory)}
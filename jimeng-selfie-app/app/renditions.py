@@ -0,0 +1,225 @@
+"""
+平台发布版本
+按平台要求裁剪比例、限制尺寸、转换格式并去除 EXIF，在进程池中并行处理
+"""
+import io
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Any, Tuple
+
+from PIL import Image, ImageOps
+
+from .config import PLATFORM_RENDITIONS, RENDITION_WORKERS, RENDITION_PLATFORMS
+from .storage import atomic_write_chunks
+
+# Pillow 9.1 起重采样滤镜移入 Image.Resampling
+_LANCZOS = getattr(Image, "Resampling", Image).LANCZOS
+
+# 输出格式对应的扩展名
+_EXTENSIONS = {"JPEG": ".jpg", "WEBP": ".webp", "PNG": ".png"}
+
+
+class RenditionSpec:
+    """单个平台版本的规格"""
+
+    def __init__(
+        self,
+        platform: str,
+        aspect: Optional[Tuple[int, int]] = None,
+        max_width: Optional[int] = None,
+        max_height: Optional[int] = None,
+        format: str = "JPEG",
+        quality: int = 85
+    ):
+        """
+        参数:
+            platform: 平台名称
+            aspect: 目标宽高比 (宽, 高)，None 表示保持原比例
+            max_width / max_height: 最大尺寸（像素，None 表示不限）
+            format: 输出格式 JPEG / WEBP / PNG
+            quality: 有损格式的质量（1-100）
+        """
+        format = format.upper()
+        if format not in _EXTENSIONS:
+            raise ValueError(f"不支持的输出格式: {format}")
+        self.platform = platform
+        self.aspect = tuple(aspect) if aspect else None
+        self.max_width = max_width
+        self.max_height = max_height
+        self.format = format
+        self.quality = quality
+
+    @classmethod
+    def for_platform(cls, platform: str) -> "RenditionSpec":
+        """
+        按 PLATFORM_RENDITIONS 配置创建
+
+        异常:
+            KeyError: 未配置该平台
+        """
+        return cls(platform, **PLATFORM_RENDITIONS[platform])
+
+    @property
+    def extension(self) -> str:
+        return _EXTENSIONS[self.format]
+
+    def __repr__(self) -> str:
+        return (
+            f"RenditionSpec({self.platform!r}, aspect={self.aspect}, "
+            f"max={self.max_width}x{self.max_height}, {self.format} q{self.quality})"
+        )
+
+
+def _crop_to_aspect(image: Image.Image, aspect: Tuple[int, int]) -> Image.Image:
+    """居中裁剪到目标宽高比"""
+    width, height = image.size
+    target_w, target_h = aspect
+    if width * target_h > height * target_w:
+        new_width = round(height * target_w / target_h)
+        left = (width - new_width) // 2
+        return image.crop((left, 0, left + new_width, height))
+    new_height = round(width * target_h / target_w)
+    top = (height - new_height) // 2
+    return image.crop((0, top, width, top + new_height))
+
+
+def render(source_path: str, spec: RenditionSpec, target_path: str) -> Dict[str, Any]:
+    """
+    生成单个平台版本（在子进程中执行，必须是模块级函数）
+
+    EXIF 方向先应用到像素上，输出文件不携带 EXIF、ICC 等元数据。
+
+    返回:
+        {"platform", "path", "width", "height", "bytes"}
+    """
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        if spec.aspect:
+            image = _crop_to_aspect(image, spec.aspect)
+        if spec.max_width or spec.max_height:
+            image.thumbnail(
+                (spec.max_width or image.width, spec.max_height or image.height), _LANCZOS
+            )
+
+        mode = "RGBA" if spec.format != "JPEG" and image.mode in ("RGBA", "LA", "P") else "RGB"
+        # 复制像素到新图像，丢弃所有元数据
+        clean = Image.new(mode, image.size)
+        clean.paste(image.convert(mode))
+
+    buffer = io.BytesIO()
+    options: Dict[str, Any] = {"optimize": True}
+    if spec.format in ("JPEG", "WEBP"):
+        options["quality"] = spec.quality
+    if spec.format == "JPEG":
+        options["progressive"] = True
+    clean.save(buffer, spec.format, **options)
+
+    data = buffer.getvalue()
+    atomic_write_chunks(target_path, [data])
+    return {
+        "platform": spec.platform,
+        "path": target_path,
+        "width": clean.width,
+        "height": clean.height,
+        "bytes": len(data),
+    }
+
+
+class RenditionProcessor:
+    """
+    平台版本处理器
+
+    CPU 密集的缩放与编码在进程池中执行，调用线程只等待结果，
+    可直接作为 GenerationPipeline 的后处理函数:
+
+        with RenditionProcessor() as renditions:
+            pipeline = GenerationPipeline(client, postprocessors=[renditions])
+
+    版本文件保存在原图所在目录的 renditions/<平台>/ 下，与原图同名。
+    """
+
+    def __init__(
+        self,
+        platforms: Optional[List[str]] = None,
+        max_workers: Optional[int] = None,
+        output_dir: Optional[str] = None
+    ):
+        """
+        参数:
+            platforms: 平台列表（默认 RENDITION_PLATFORMS，未配置时为全部平台）
+            max_workers: 进程数（默认 RENDITION_WORKERS，0 表示 CPU 核数）
+            output_dir: 版本文件根目录（默认原图目录下的 renditions）
+        """
+        platforms = platforms or RENDITION_PLATFORMS or list(PLATFORM_RENDITIONS)
+        self.specs = [RenditionSpec.for_platform(p) for p in platforms]
+        self.max_workers = max_workers or RENDITION_WORKERS or os.cpu_count() or 1
+        self.output_dir = output_dir
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def __name__(self) -> str:
+        # 供流水线记录后处理错误时使用
+        return "renditions"
+
+    def _pool(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # 使用 spawn，避免在持有锁的多线程进程中 fork
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _target_path(self, source_path: str, spec: RenditionSpec) -> str:
+        root = self.output_dir or os.path.join(os.path.dirname(source_path), "renditions")
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(root, spec.platform, stem + spec.extension)
+
+    def render_files(self, paths: List[str]) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        为多张图片生成所有平台版本
+
+        返回:
+            {原图路径: [版本信息, ...]}
+
+        异常:
+            任一版本生成失败时抛出对应异常
+        """
+        pool = self._pool()
+        futures = {
+            path: [pool.submit(render, path, spec, self._target_path(path, spec)) for spec in self.specs]
+            for path in paths
+        }
+        return {path: [f.result() for f in path_futures] for path, path_futures in futures.items()}
+
+    def process(self, result: Dict[str, Any]):
+        """
+        生成结果后处理: 为每张已保存的图片生成平台版本
+
+        每张图片的版本写入 image["renditions"]，汇总写入 result["renditions"]（平台 -> 路径列表）。
+        """
+        images = [image for image in result.get("images") or [] if image.get("local_path")]
+        if not images:
+            return
+
+        rendered = self.render_files([image["local_path"] for image in images])
+        summary: Dict[str, List[str]] = {spec.platform: [] for spec in self.specs}
+        for image in images:
+            image["renditions"] = rendered[image["local_path"]]
+            for info in image["renditions"]:
+                summary[info["platform"]].append(info["path"])
+        result["renditions"] = summary
+
+    __call__ = process
+
+    def close(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def __enter__(self) -> "RenditionProcessor":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
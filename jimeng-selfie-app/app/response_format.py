@@ -0,0 +1,83 @@
+"""
+响应格式选择
+根据实测耗时在 url 与 b64_json 两种响应格式之间自动切换
+"""
+import threading
+from typing import Dict, Optional
+
+RESPONSE_FORMATS = ("url", "b64_json")
+
+
+class ResponseFormatSelector:
+    """
+    响应格式选择器
+
+    - "url":      返回图片 URL，需要再从 CDN 下载一次
+    - "b64_json": 图片随响应返回，省去 CDN 往返，但响应体更大
+    - "auto":     分别记录两种格式的每张图片平均耗时（指数滑动平均），
+                  选择较快的一种，并定期试探另一种以跟随网络状况变化
+    """
+
+    def __init__(
+        self,
+        mode: str = "url",
+        smoothing: float = 0.3,
+        explore_every: int = 20
+    ):
+        """
+        参数:
+            mode: url / b64_json / auto
+            smoothing: 滑动平均系数（越大越偏重最近的样本）
+            explore_every: auto 模式下每隔多少次请求试探较慢的格式
+        """
+        if mode not in RESPONSE_FORMATS + ("auto",):
+            raise ValueError(f"无效的响应格式: {mode}")
+
+        self.mode = mode
+        self.smoothing = smoothing
+        self.explore_every = explore_every
+
+        self._latency: Dict[str, Optional[float]] = {f: None for f in RESPONSE_FORMATS}
+        self._choices = 0
+        self._lock = threading.Lock()
+
+    def choose(self, save_to_file: bool = True) -> str:
+        """选择本次请求使用的响应格式"""
+        if self.mode != "auto":
+            return self.mode
+
+        # 不保存文件时只需要 URL，url 格式的响应最小
+        if not save_to_file:
+            return "url"
+
+        with self._lock:
+            self._choices += 1
+
+            # 先为每种格式采集至少一个样本
+            for fmt in RESPONSE_FORMATS:
+                if self._latency[fmt] is None:
+                    return fmt
+
+            best = min(RESPONSE_FORMATS, key=lambda f: self._latency[f])
+            if self.explore_every and self._choices % self.explore_every == 0:
+                return next(f for f in RESPONSE_FORMATS if f != best)
+            return best
+
+    def record(self, fmt: str, seconds_per_image: float):
+        """记录一次请求（生成 + 保存）摊到每张图片的耗时"""
+        if fmt not in RESPONSE_FORMATS:
+            return
+
+        with self._lock:
+            previous = self._latency[fmt]
+            if previous is None:
+                self._latency[fmt] = seconds_per_image
+            else:
+                self._latency[fmt] = (
+                    self.smoothing * seconds_per_image + (1 - self.smoothing) * previous
+                )
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """各格式的平均耗时（秒/张），尚无样本为 None"""
+        with self._lock:
+            return dict(self._latency)
@@ -0,0 +1,149 @@
+"""
+请求重试策略
+指数退避 + 随机抖动，支持 Retry-After 响应头与总耗时上限
+"""
+import time
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Callable, Optional, FrozenSet
+
+import requests
+
+from .config import (
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_MAX_TOTAL
+)
+from .timeouts import Deadline
+
+# 可重试的 HTTP 状态码（限流与服务端临时错误）
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（秒数或 HTTP 日期），无效时返回 None"""
+    if not value:
+        return None
+
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """
+    重试策略
+
+    - 超时、连接错误以及 408/429/5xx 响应视为可重试，其余错误立即返回
+    - 第 k 次重试前等待 [0, min(max_delay, base_delay * 2^(k-1))] 之间的随机时长
+    - 响应带 Retry-After 时至少等待其指定的时长
+    - 所有尝试加等待的总耗时不超过 max_total_time
+    """
+
+    def __init__(
+        self,
+        max_attempts: Optional[int] = None,
+        base_delay: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        max_total_time: Optional[float] = None,
+        retry_statuses: FrozenSet[int] = RETRYABLE_STATUSES,
+        sleep: Callable[[float], None] = time.sleep
+    ):
+        """
+        参数:
+            max_attempts: 最大尝试次数（含首次请求，1 表示不重试）
+            base_delay: 退避基准时长（秒）
+            max_delay: 单次等待上限（秒）
+            max_total_time: 总耗时上限（秒）
+            retry_statuses: 可重试的 HTTP 状态码
+            sleep: 等待函数（便于测试替换）
+        """
+        self.max_attempts = max(1, max_attempts if max_attempts is not None else RETRY_MAX_ATTEMPTS)
+        self.base_delay = base_delay if base_delay is not None else RETRY_BASE_DELAY
+        self.max_delay = max_delay if max_delay is not None else RETRY_MAX_DELAY
+        self.max_total_time = max_total_time if max_total_time is not None else RETRY_MAX_TOTAL
+        self.retry_statuses = retry_statuses
+        self._sleep = sleep
+
+    def is_retryable_status(self, status_code: int) -> bool:
+        """状态码是否可重试"""
+        return status_code in self.retry_statuses
+
+    @staticmethod
+    def is_retryable_exception(exc: BaseException) -> bool:
+        """异常是否可重试（超时与连接错误）"""
+        return isinstance(exc, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
+
+    def compute_delay(self, retry_number: int, retry_after: Optional[float] = None) -> float:
+        """计算第 retry_number 次重试（从 1 开始）前的等待时长"""
+        ceiling = min(self.max_delay, self.base_delay * (2 ** (retry_number - 1)))
+        delay = random.uniform(0, ceiling)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def call(
+        self,
+        func: Callable[[], requests.Response],
+        deadline: Optional[Deadline] = None
+    ) -> requests.Response:
+        """
+        按策略执行请求
+
+        参数:
+            func: 发起一次请求并返回响应的函数（重试时原样再次调用）
+            deadline: 截止时间，重试等待不会越过它
+
+        返回:
+            最后一次请求的响应（可能仍是可重试的错误状态码）
+
+        异常:
+            最后一次请求抛出的异常（不可重试或重试次数/时间耗尽）
+            DeadlineExceeded: 开始某次尝试前已超出截止时间
+        """
+        started = time.monotonic()
+        give_up_at = started + self.max_total_time if self.max_total_time else None
+        if deadline is not None and deadline.expires_at is not None:
+            give_up_at = deadline.expires_at if give_up_at is None else min(give_up_at, deadline.expires_at)
+
+        attempt = 0
+        while True:
+            if deadline is not None:
+                deadline.check()
+            attempt += 1
+            retry_after = None
+            try:
+                response = func()
+            except Exception as e:
+                if not self.is_retryable_exception(e) or attempt >= self.max_attempts:
+                    raise
+                error: Optional[BaseException] = e
+                response = None
+            else:
+                if not self.is_retryable_status(response.status_code) or attempt >= self.max_attempts:
+                    return response
+                error = None
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+
+            delay = self.compute_delay(attempt, retry_after)
+
+            # 等待后已超出时间上限则不再重试
+            if give_up_at is not None and time.monotonic() + delay >= give_up_at:
+                if error is not None:
+                    raise error
+                return response
+
+            # 释放连接后再重试
+            if response is not None:
+                response.close()
+
+            self._sleep(delay)
@@ -0,0 +1,393 @@
+"""
+常驻生成服务
+一个进程持有连接池、限流器、熔断器与结果缓存，通过本地 HTTP 或 Unix socket
+为多个短生命周期的调用方提供生成服务
+
+接口:
+    POST /generate  请求体为批量任务行格式的 JSON（prompt/style/selfie/platform/seed/size/references...）
+    GET  /health    服务状态与各组件指标
+"""
+import os
+import json
+import stat
+import time
+import errno
+import socket
+import threading
+import socketserver
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, List, Dict, Any, Tuple
+
+from .config import (
+    SERVER_HOST, SERVER_PORT, SERVER_SOCKET, SERVER_MAX_CONCURRENCY, SERVER_QUEUE_TIMEOUT, REFERENCE_DIR
+)
+from .jobs import JobError, parse_job
+from .strategy import SelfieStrategy
+
+# 请求体大小上限（字节）
+_MAX_BODY_BYTES = 1024 * 1024
+
+UNIX_PREFIX = "unix:"
+
+
+class _WorkerHandler(BaseHTTPRequestHandler):
+    """将 HTTP 请求转交给 WorkerServer"""
+
+    protocol_version = "HTTP/1.1"
+    server_version = "jimeng-selfie"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, self.server.worker.health())
+        else:
+            self._send_json(404, {"success": False, "error": f"未知路径: {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/generate":
+            self._send_json(404, {"success": False, "error": f"未知路径: {self.path}"})
+            return
+
+        length_header = self.headers.get("Content-Length")
+        if length_header is None:
+            self.close_connection = True
+            self._send_json(411, {"success": False, "error": "缺少 Content-Length"})
+            return
+        try:
+            length = int(length_header)
+        except ValueError:
+            length = -1
+        if length < 0:
+            self.close_connection = True
+            self._send_json(400, {"success": False, "error": f"无效的 Content-Length: {length_header}"})
+            return
+        if length > _MAX_BODY_BYTES:
+            self.close_connection = True
+            self._send_json(413, {"success": False, "error": "请求体过大"})
+            return
+
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError as e:
+            self._send_json(400, {"success": False, "error": f"请求体不是有效的 JSON: {e}"})
+            return
+
+        status, result = self.server.worker.handle_generate(data)
+        self._send_json(status, result)
+
+
+class _ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """监听 Unix socket 的多线程 HTTP 服务"""
+
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler 需要 (host, port) 形式的客户端地址
+        return request, ("unix", 0)
+
+
+def _remove_stale_socket(path: str):
+    """
+    清理上次异常退出遗留的 socket 文件
+
+    只删除无人监听的 socket；路径不是 socket 或仍有服务在监听时报错，
+    不会误删普通文件，也不会抢占运行中的服务。
+
+    异常:
+        FileExistsError: 路径存在但不是 socket
+        OSError: socket 仍被其他服务监听（errno 为 EADDRINUSE）
+    """
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(errno.EEXIST, "路径已存在且不是 socket", path)
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except ConnectionRefusedError:
+        os.unlink(path)
+        return
+    except FileNotFoundError:
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, "socket 正被运行中的服务使用", path)
+
+
+class WorkerServer:
+    """
+    常驻生成服务
+
+    所有请求共用一个 JimengAPIClient；同时执行的生成请求数不超过
+    max_concurrency，其余请求排队，排队超过 queue_timeout 秒返回 503。
+    请求中的参考图只接受 http(s) 地址或参考图目录内的文件，不能借此上传服务端的其他文件。
+    """
+
+    def __init__(
+        self,
+        client=None,
+        host: Optional[str] = None,
+        port: Optional[int] = None,
+        unix_socket: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        queue_timeout: Optional[float] = None,
+        reference_dir: Optional[str] = None
+    ):
+        """
+        参数:
+            client: JimengAPIClient 实例（默认新建，服务关闭时一并关闭）
+            host / port: 监听地址（仅在未指定 unix_socket 时使用，port 为 0 表示随机端口）
+            unix_socket: Unix socket 路径
+            max_concurrency: 同时执行的生成请求数
+            queue_timeout: 排队等待上限（秒）
+            reference_dir: 请求可引用的本地参考图目录（默认 REFERENCE_DIR）
+        """
+        self.unix_socket = unix_socket if unix_socket is not None else (SERVER_SOCKET or None)
+        if self.unix_socket:
+            # 先检查 socket 路径，失败时不创建客户端
+            _remove_stale_socket(self.unix_socket)
+
+        if client is None:
+            from .jimeng_api import JimengAPIClient
+            client = JimengAPIClient()
+            self._owns_client = True
+        else:
+            self._owns_client = False
+
+        self.client = client
+        self.max_concurrency = max(1, max_concurrency or SERVER_MAX_CONCURRENCY)
+        self.queue_timeout = queue_timeout if queue_timeout is not None else SERVER_QUEUE_TIMEOUT
+        self.reference_dir = reference_dir or REFERENCE_DIR
+
+        self._slots = threading.BoundedSemaphore(self.max_concurrency)
+        self._strategy = SelfieStrategy()
+        self._strategy_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "succeeded": 0, "failed": 0, "rejected": 0, "in_flight": 0}
+        self._started_at = time.time()
+        self._thread: Optional[threading.Thread] = None
+
+        if self.unix_socket:
+            # 创建时即为 0600，bind 与 chmod 之间不存在其他用户可连接的窗口
+            old_umask = os.umask(0o177)
+            try:
+                self.httpd = _ThreadingUnixHTTPServer(self.unix_socket, _WorkerHandler)
+            finally:
+                os.umask(old_umask)
+            os.chmod(self.unix_socket, 0o600)
+        else:
+            self.httpd = ThreadingHTTPServer(
+                (host or SERVER_HOST, port if port is not None else SERVER_PORT), _WorkerHandler
+            )
+            self.httpd.daemon_threads = True
+        self.httpd.worker = self
+
+    @property
+    def address(self) -> str:
+        """服务地址（unix:<路径> 或 http://host:port）"""
+        if self.unix_socket:
+            return f"{UNIX_PREFIX}{self.unix_socket}"
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _count(self, name: str, delta: int = 1):
+        with self._stats_lock:
+            self._stats[name] += delta
+
+    def _resolve_references(self, references: List[str]) -> List[str]:
+        """
+        检查请求中的参考图: http(s) 地址原样使用，其余视为参考图目录内的文件（相对路径相对于该目录）
+
+        返回:
+            参考图列表（本地文件为解析后的绝对路径）
+
+        异常:
+            JobError: 参考图不在参考图目录内或文件不存在
+        """
+        root = os.path.realpath(self.reference_dir)
+        resolved = []
+        for reference in references:
+            if reference.startswith(("http://", "https://")):
+                resolved.append(reference)
+                continue
+            path = os.path.realpath(os.path.join(root, reference))
+            if os.path.commonpath([root, path]) != root:
+                raise JobError(f"参考图必须是 http(s) 地址或参考图目录内的文件: {reference}")
+            if not os.path.isfile(path):
+                raise JobError(f"参考图不存在: {reference}")
+            resolved.append(path)
+        return resolved
+
+    def handle_generate(self, data: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        处理一个生成请求
+
+        返回:
+            (HTTP 状态码, 响应内容)
+        """
+        self._count("requests")
+        try:
+            with self._strategy_lock:
+                job, style = parse_job(data, self._strategy)
+            if data.get("references"):
+                job["reference_images"] = self._resolve_references(data["references"])
+        except JobError as e:
+            self._count("failed")
+            return 400, {"success": False, "error": str(e)}
+
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._count("rejected")
+            return 503, {"success": False, "error": "服务繁忙，请稍后重试"}
+
+        self._count("in_flight")
+        try:
+            result = self.client.generate(**job)
+        except Exception as e:
+            result = {"success": False, "prompt": job["prompt"], "error": f"任务执行失败: {e}"}
+        finally:
+            self._count("in_flight", -1)
+            self._slots.release()
+
+        self._count("succeeded" if result.get("success") else "failed")
+        return 200, {**result, "style": style}
+
+    def health(self) -> Dict[str, Any]:
+        """服务状态"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        health = {
+            "status": "ok",
+            "address": self.address,
+            "pid": os.getpid(),
+            "uptime": round(time.time() - self._started_at, 3),
+            "max_concurrency": self.max_concurrency,
+            **stats,
+            "breaker": self.client.circuit_breaker.stats(),
+            "pool": self.client.pool_stats(),
+        }
+        if self.client.result_cache is not None:
+            health["cache"] = self.client.result_cache.stats()
+        return health
+
+    def serve_forever(self):
+        """在当前线程处理请求，直到 shutdown()"""
+        self.httpd.serve_forever()
+
+    def start(self) -> "WorkerServer":
+        """在后台线程处理请求"""
+        self._thread = threading.Thread(target=self.serve_forever, name="jimeng-serve", daemon=True)
+        self._thread.start()
+        return self
+
+    def shutdown(self):
+        """停止服务并释放资源"""
+        if self._thread is not None:
+            self.httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self.httpd.server_close()
+        if self.unix_socket and os.path.exists(self.unix_socket):
+            os.unlink(self.unix_socket)
+        if self._owns_client:
+            self.client.close()
+
+    def __enter__(self) -> "WorkerServer":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    """通过 Unix socket 通信的 HTTPConnection"""
+
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+def default_address() -> str:
+    """按配置得到服务地址"""
+    if SERVER_SOCKET:
+        return f"{UNIX_PREFIX}{SERVER_SOCKET}"
+    return f"http://{SERVER_HOST}:{SERVER_PORT}"
+
+
+class ServerClient:
+    """
+    常驻服务的轻量客户端
+
+    只依赖标准库（不导入 requests），适合脚本等短生命周期的调用方。
+    """
+
+    def __init__(self, address: Optional[str] = None, timeout: Optional[float] = 600):
+        """
+        参数:
+            address: 服务地址，unix:<路径>、http://host:port 或 host:port（默认按配置）
+            timeout: 单次请求的超时（秒，需覆盖生成与下载的总耗时）
+        """
+        self.address = address or default_address()
+        self.timeout = timeout
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self.address.startswith(UNIX_PREFIX):
+            return _UnixHTTPConnection(self.address[len(UNIX_PREFIX):], timeout=self.timeout)
+        host = self.address.split("://", 1)[-1].rstrip("/")
+        return http.client.HTTPConnection(host, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        发送请求并解析 JSON 响应
+
+        异常:
+            ConnectionError: 无法连接到服务
+        """
+        conn = self._connection()
+        try:
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8") if data is not None else None
+            headers = {"Content-Type": "application/json"} if body is not None else {}
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            return json.loads(response.read() or b"{}")
+        except (OSError, http.client.HTTPException) as e:
+            raise ConnectionError(f"无法连接生成服务 {self.address}: {e}") from e
+        finally:
+            conn.close()
+
+    def generate(self, prompt: str, **kwargs) -> Dict[str, Any]:
+        """
+        提交生成请求并等待结果
+
+        参数:
+            prompt: 提示词
+            **kwargs: 批量任务行中的其他字段（style/selfie/platform/seed/size/references 等）
+
+        返回:
+            与 JimengAPIClient.generate() 相同格式的结果（额外包含 style）
+        """
+        return self._request("POST", "/generate", {"prompt": prompt, **kwargs})
+
+    def health(self) -> Dict[str, Any]:
+        """服务状态"""
+        return self._request("GET", "/health")
@@ -0,0 +1,118 @@
+"""
+HTTP 连接池会话
+按主机复用 keep-alive 连接，避免每次请求重新进行 TCP/TLS 握手
+"""
+import threading
+from typing import Dict, Any, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .config import HTTP_POOL_CONNECTIONS, HTTP_POOL_MAXSIZE
+
+
+class PooledSession:
+    """带连接池的 HTTP 会话（线程安全，可作为上下文管理器使用）"""
+
+    def __init__(
+        self,
+        pool_connections: Optional[int] = None,
+        pool_maxsize: Optional[int] = None
+    ):
+        """
+        参数:
+            pool_connections: 缓存的主机连接池数量
+            pool_maxsize: 每个主机连接池的最大连接数
+        """
+        self.pool_connections = pool_connections or HTTP_POOL_CONNECTIONS
+        self.pool_maxsize = pool_maxsize or HTTP_POOL_MAXSIZE
+
+        self._session: Optional[requests.Session] = None
+        self._adapter: Optional[HTTPAdapter] = None
+        self._lock = threading.Lock()
+
+    def _create_session(self) -> requests.Session:
+        """创建挂载连接池适配器的会话"""
+        self._adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize
+        )
+        session = requests.Session()
+        session.mount("https://", self._adapter)
+        session.mount("http://", self._adapter)
+        session.headers["Connection"] = "keep-alive"
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """底层 requests 会话（首次访问时创建，close 后可重新创建）"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._create_session()
+        return self._session
+
+    @property
+    def closed(self) -> bool:
+        """会话是否已关闭（或尚未创建）"""
+        return self._session is None
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """发送请求"""
+        return self.session.request(method, url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """发送 GET 请求"""
+        return self.session.get(url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """发送 POST 请求"""
+        return self.session.post(url, **kwargs)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        连接池统计
+
+        返回:
+            {
+                "https://host:443": {
+                    "requests": int,      # 经该连接池发出的请求数
+                    "connections": int,   # 新建连接数
+                    "reused": int,        # 复用连接的请求数
+                    "idle": int           # 当前空闲连接数
+                }
+            }
+        """
+        stats: Dict[str, Dict[str, Any]] = {}
+        if self._adapter is None:
+            return stats
+
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests = getattr(pool, "num_requests", 0)
+            num_connections = getattr(pool, "num_connections", 0)
+            idle = pool.pool.qsize() if pool.pool is not None else 0
+            stats[f"{key.key_scheme}://{key.key_host}:{key.key_port}"] = {
+                "requests": num_requests,
+                "connections": num_connections,
+                "reused": max(0, num_requests - num_connections),
+                "idle": idle,
+            }
+        return stats
+
+    def close(self):
+        """关闭会话并释放所有连接"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+            self._adapter = None
+
+    def __enter__(self) -> "PooledSession":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
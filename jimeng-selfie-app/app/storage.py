@@ -0,0 +1,238 @@
+"""
+输出文件存储工具
+以临时文件 + 原子重命名的方式写入，避免留下不完整的图片
+"""
+import os
+import re
+import time
+import uuid
+import base64
+import shutil
+import hashlib
+import threading
+import tempfile
+from typing import Optional, List, Dict, Any, Iterable, Iterator, Tuple
+
+# 输出目录布局: flat 全部放在一层 / date 按日期 YYYY/MM/DD / hash 按文件名哈希前两位
+OUTPUT_LAYOUTS = ("flat", "date", "hash")
+
+# 输出文件名: {前缀}[_{种子}]_{时间戳}[_{唯一标识}][_{序号}].jpg（旧文件没有唯一标识）
+_OUTPUT_NAME_PATTERN = re.compile(
+    r"^(?P<prefix>.+?)(?:_(?P<seed>\d+))?_(?P<timestamp>\d{10})(?:_(?P<uid>[0-9a-f]{12}))?"
+    r"(?:_(?P<index>\d+))?\.(?:jpe?g|png|webp)$",
+    re.IGNORECASE
+)
+
+# 参与布局迁移的图片扩展名
+_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def atomic_write_chunks(filepath: str, chunks: Iterable[bytes]) -> int:
+    """
+    将分块数据写入临时文件，完成后原子重命名为目标文件
+
+    写入过程中出错时删除临时文件，目标路径不会出现半截文件。
+
+    参数:
+        filepath: 目标文件路径
+        chunks: 字节块迭代器
+
+    返回:
+        写入的总字节数
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    os.makedirs(directory, exist_ok=True)
+
+    fd, temp_path = tempfile.mkstemp(
+        dir=directory,
+        prefix=f".{os.path.basename(filepath)}.",
+        suffix=".part"
+    )
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+        os.replace(temp_path, filepath)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+    return written
+
+
+def link_or_copy(source: str, target: str):
+    """
+    将文件放到目标路径（已存在则原子替换）
+
+    优先硬链接（不占额外空间），跨文件系统时退回复制。
+    """
+    directory = os.path.dirname(os.path.abspath(target))
+    os.makedirs(directory, exist_ok=True)
+
+    temp_path = os.path.join(directory, f".{os.path.basename(target)}.{os.getpid()}.{threading.get_ident()}.part")
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, target)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+def iter_b64_decoded(data: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    分段解码 Base64 字符串
+
+    每次只解码约 chunk_size 字节，避免在原始字符串之外再持有一份完整的解码结果。
+    数据中的换行等空白字符（按行折叠的 Base64）被忽略。
+    """
+    # 4 个 Base64 字符对应 3 个字节，去掉空白后按 4 的倍数切分保证每段可独立解码
+    step = max(4, chunk_size // 3 * 4)
+    carry = ""
+    for start in range(0, len(data), step):
+        piece = carry + "".join(data[start:start + step].split())
+        usable = len(piece) - len(piece) % 4
+        carry = piece[usable:]
+        if usable:
+            yield base64.b64decode(piece[:usable])
+    if carry:
+        yield base64.b64decode(carry)
+
+
+def parse_output_filename(name: str) -> Optional[Dict[str, Any]]:
+    """
+    解析输出文件名
+
+    返回:
+        {"prefix", "seed", "timestamp", "uid", "index"}，不是输出文件名时返回 None
+    """
+    match = _OUTPUT_NAME_PATTERN.match(name)
+    if match is None:
+        return None
+    seed, index = match.group("seed"), match.group("index")
+    return {
+        "prefix": match.group("prefix"),
+        "seed": int(seed) if seed else None,
+        "timestamp": int(match.group("timestamp")),
+        "uid": match.group("uid"),
+        "index": int(index) if index else None,
+    }
+
+
+def shard_dir(name: str, layout: str, timestamp: Optional[float] = None) -> str:
+    """
+    文件在输出目录中的子目录（相对路径，flat 布局为空字符串）
+
+    参数:
+        name: 文件名
+        layout: 目录布局
+        timestamp: 生成时间（date 布局使用，默认当前时间）
+    """
+    if layout == "flat":
+        return ""
+    if layout == "date":
+        return time.strftime("%Y/%m/%d", time.localtime(timestamp if timestamp is not None else time.time()))
+    if layout == "hash":
+        return hashlib.sha1(name.encode("utf-8")).hexdigest()[:2]
+    raise ValueError(f"不支持的输出目录布局: {layout}")
+
+
+def is_safe_prefix(prefix: str) -> bool:
+    """文件名前缀是否只是文件名的一部分（不含路径分隔符、.. 且不是绝对路径）"""
+    separators = {"/", "\\", os.sep, os.altsep or os.sep}
+    return (
+        "\0" not in prefix and ".." not in prefix
+        and not any(sep in prefix for sep in separators) and not os.path.isabs(prefix)
+    )
+
+
+def build_output_path(
+    output_dir: str,
+    prefix: str,
+    seed: Optional[int] = None,
+    index: Optional[int] = None,
+    layout: str = "flat"
+) -> str:
+    """
+    生成不会与其他文件冲突的输出文件路径
+
+    文件名包含随机唯一标识，同一秒内相同前缀与种子的并发任务也不会互相覆盖。
+
+    异常:
+        ValueError: 前缀包含路径（可能写到输出目录之外）
+    """
+    if not is_safe_prefix(prefix):
+        raise ValueError(f"无效的文件名前缀: {prefix!r}")
+    timestamp = int(time.time())
+    seed_suffix = f"_{seed}" if seed else ""
+    index_suffix = f"_{index}" if index is not None else ""
+    filename = f"{prefix}{seed_suffix}_{timestamp}_{uuid.uuid4().hex[:12]}{index_suffix}.jpg"
+    return os.path.join(output_dir, shard_dir(filename, layout, timestamp), filename)
+
+
+def migrate_layout(output_dir: str, layout: str, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    将输出目录中已有的图片移动到指定布局
+
+    date 布局优先使用文件名中的时间戳，无法解析时使用文件修改时间。
+    以 . 开头的文件与目录、renditions 目录不移动；目标已存在时跳过。
+
+    参数:
+        output_dir: 输出目录
+        layout: 目标布局
+        dry_run: 只计算移动方案，不实际移动
+
+    返回:
+        {"moved": [(原路径, 新路径), ...], "skipped": 已在目标位置的文件数, "conflicts": [原路径, ...]}
+    """
+    if layout not in OUTPUT_LAYOUTS:
+        raise ValueError(f"不支持的输出目录布局: {layout}")
+
+    output_dir = os.path.abspath(output_dir)
+    moves: List[Tuple[str, str]] = []
+    conflicts: List[str] = []
+    skipped = 0
+    for root, dirs, files in os.walk(output_dir):
+        dirs[:] = [d for d in dirs if not d.startswith(".") and d != "renditions"]
+        for name in files:
+            if name.startswith(".") or not name.lower().endswith(_IMAGE_EXTENSIONS):
+                continue
+            source = os.path.join(root, name)
+            parsed = parse_output_filename(name)
+            timestamp = parsed["timestamp"] if parsed else os.path.getmtime(source)
+            target = os.path.join(output_dir, shard_dir(name, layout, timestamp), name)
+            if target == source:
+                skipped += 1
+            elif os.path.exists(target):
+                conflicts.append(source)
+            else:
+                moves.append((source, target))
+
+    if not dry_run:
+        for source, target in moves:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(source, target)
+        _remove_empty_dirs(output_dir)
+
+    return {"moved": moves, "skipped": skipped, "conflicts": conflicts}
+
+
+def _remove_empty_dirs(root: str):
+    """删除迁移后留下的空目录（不删除根目录）"""
+    for directory, _, _ in os.walk(root, topdown=False):
+        if directory != root and not os.listdir(directory):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
@@ -159,21 +159,32 @@ class SelfieStrategy:
 
 
 class ReferenceImageManager:
-    """参考图管理器"""
+    """参考图管理器（文件信息与缩略图由 ReferenceIndex 缓存）"""
 
     def __init__(self, reference_dir: str):
         self.reference_dir = reference_dir
         self.supported_formats = [".jpg", ".jpeg", ".png", ".webp"]
+        self._index = None
+
+    @property
+    def index(self):
+        """参考图索引（首次使用时加载，避免启动时导入图像库）"""
+        if self._index is None:
+            from .references import ReferenceIndex
+            self._index = ReferenceIndex(self.reference_dir)
+        return self._index
 
     def list_references(self) -> List[str]:
         """列出所有参考图"""
-        import os
-        references = []
-        if os.path.exists(self.reference_dir):
-            for f in os.listdir(self.reference_dir):
-                if any(f.lower().endswith(ext) for ext in self.supported_formats):
-                    references.append(os.path.join(self.reference_dir, f))
-        return references
+        return [entry["path"] for entry in self.index.entries()]
+
+    def list_reference_info(self) -> List[dict]:
+        """列出所有参考图及其尺寸、格式、内容哈希与缩略图路径"""
+        return self.index.entries()
+
+    def get_thumbnail(self, path: str) -> Optional[str]:
+        """参考图缩略图路径（无法解码时返回 None）"""
+        return self.index.thumbnail(path)
 
     def add_reference(self, source_path: str, name: Optional[str] = None) -> str:
         """添加参考图"""
@@ -195,4 +206,8 @@ class ReferenceImageManager:
         target_path = os.path.join(self.reference_dir, target_name)
         shutil.copy(source_path, target_path)
 
+        # 增量更新索引（不支持的格式不会出现在列表中，无需索引）
+        if target_name.lower().endswith(tuple(self.supported_formats)):
+            self.index.add(target_path)
+
         return target_path
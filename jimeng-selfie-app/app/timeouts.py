@@ -0,0 +1,110 @@
+"""
+超时与截止时间
+区分连接/读取/总超时，并为整个任务（重试、生成、下载）提供统一的截止时间
+"""
+import time
+from typing import Optional, Tuple, Union, Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """超出截止时间"""
+
+
+class Deadline:
+    """
+    截止时间
+
+    基于 time.monotonic()，None 表示不设上限。可在线程间传递，
+    各阶段据此裁剪自己的超时，保证整个任务的最坏耗时可预期。
+    """
+
+    def __init__(self, seconds: Optional[float] = None, clock: Callable[[], float] = time.monotonic):
+        """
+        参数:
+            seconds: 从现在起的时间预算（秒），None 表示不限
+            clock: 时钟函数（便于测试替换）
+
+        异常:
+            TypeError: seconds 不是数字
+        """
+        if seconds is not None and (not isinstance(seconds, (int, float)) or isinstance(seconds, bool)):
+            raise TypeError(f"截止时间必须是秒数: {seconds!r}")
+        self._clock = clock
+        self.expires_at = None if seconds is None else clock() + seconds
+
+    @classmethod
+    def coerce(cls, value: Union["Deadline", float, int, None]) -> "Deadline":
+        """将秒数或 None 转换为 Deadline，Deadline 原样返回"""
+        if isinstance(value, Deadline):
+            return value
+        return cls(value)
+
+    def remaining(self) -> Optional[float]:
+        """剩余秒数（不设上限时为 None）"""
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - self._clock())
+
+    @property
+    def expired(self) -> bool:
+        """是否已过期"""
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def check(self, stage: str = ""):
+        """已过期则抛出 DeadlineExceeded"""
+        if self.expired:
+            raise DeadlineExceeded(f"{stage}超出截止时间" if stage else "超出截止时间")
+
+    def limit(self, seconds: Optional[float]) -> "Deadline":
+        """返回不晚于当前截止时间、且距现在不超过 seconds 的截止时间"""
+        if seconds is None or seconds <= 0:
+            return self
+        limited = Deadline(seconds, self._clock)
+        if self.expires_at is not None and self.expires_at < limited.expires_at:
+            return self
+        return limited
+
+    def clamp(self, timeout: float) -> float:
+        """将超时裁剪到剩余时间以内"""
+        remaining = self.remaining()
+        if remaining is None:
+            return timeout
+        return max(0.001, min(timeout, remaining))
+
+
+class Timeouts:
+    """
+    单个阶段的超时配置
+
+    - connect: 建立连接的超时（秒），用于快速发现失效连接
+    - read:    两次收到数据之间的最长间隔（秒）
+    - total:   该阶段（含重试）的总耗时上限（秒），0 表示不限
+    """
+
+    def __init__(self, connect: float, read: float, total: float = 0):
+        self.connect = connect
+        self.read = read
+        self.total = total
+
+    def stage_deadline(self, deadline: Optional[Deadline] = None) -> Deadline:
+        """结合任务截止时间与本阶段总超时，得到本阶段的截止时间"""
+        return (deadline or Deadline()).limit(self.total)
+
+    def for_request(self, deadline: Optional[Deadline] = None) -> Tuple[float, float]:
+        """requests 使用的 (connect, read) 超时，不超过剩余时间"""
+        if deadline is None:
+            return self.connect, self.read
+        return deadline.clamp(self.connect), deadline.clamp(self.read)
+
+    def __repr__(self) -> str:
+        return f"Timeouts(connect={self.connect}, read={self.read}, total={self.total})"
+
+
+def iter_within(items: Iterable[T], deadline: Deadline, stage: str = "") -> Iterator[T]:
+    """逐项产出，每项之前检查截止时间（用于限制流式读取的总时长）"""
+    for item in items:
+        deadline.check(stage)
+        yield item
@@ -0,0 +1,200 @@
+"""
+结果缓存测试
+测试覆盖：缓存键、读写、淘汰、客户端缓存模式
+"""
+import os
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _write(path: str, data: bytes) -> str:
+    Path(path).write_bytes(data)
+    return path
+
+
+class TestResultCache(unittest.TestCase):
+    """结果缓存测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _cache(self, **kwargs):
+        from app.cache import ResultCache
+        return ResultCache(os.path.join(self.temp_dir, "cache"), **kwargs)
+
+    def _image(self, name: str, data: bytes) -> dict:
+        return {"url": f"https://example.com/{name}", "seed": 1, "size": "1x1",
+                "local_path": _write(os.path.join(self.temp_dir, name), data)}
+
+    def test_key_ignores_transport_fields(self):
+        """测试缓存键忽略 stream/response_format，区分种子"""
+        from app.cache import ResultCache
+
+        base = {"model": "m", "prompt": "p", "size": "2048x2048", "seed": 1}
+        key = ResultCache.make_key(base)
+
+        self.assertEqual(key, ResultCache.make_key({**base, "stream": True, "response_format": "b64_json"}))
+        self.assertEqual(key, ResultCache.make_key(dict(reversed(list(base.items())))))
+        self.assertNotEqual(key, ResultCache.make_key({**base, "seed": 2}))
+        self.assertNotEqual(key, ResultCache.make_key({**base, "image": ["https://example.com/ref.jpg"]}))
+
+    def test_put_then_get(self):
+        """测试写入后可读取"""
+        cache = self._cache(max_bytes=0, max_age=0)
+        cache.put("k1", [self._image("a.jpg", b"aaaa")])
+
+        hit = cache.get("k1")
+        self.assertEqual(len(hit), 1)
+        self.assertEqual(Path(hit[0]["cache_path"]).read_bytes(), b"aaaa")
+        self.assertIsNone(cache.get("missing"))
+        self.assertEqual(cache.stats(), {"entries": 1, "bytes": 4})
+
+    def test_lru_eviction_by_bytes(self):
+        """测试超过容量时淘汰最久未访问的条目"""
+        cache = self._cache(max_bytes=10, max_age=0)
+        cache.put("old", [self._image("a.jpg", b"x" * 4)])
+        time.sleep(0.01)
+        cache.put("recent", [self._image("b.jpg", b"y" * 4)])
+        time.sleep(0.01)
+        cache.get("old")
+        time.sleep(0.01)
+        cache.put("new", [self._image("c.jpg", b"z" * 4)])
+
+        self.assertIsNotNone(cache.get("old"))
+        self.assertIsNone(cache.get("recent"))
+        self.assertIsNotNone(cache.get("new"))
+
+    def test_age_eviction(self):
+        """测试过期条目被淘汰"""
+        cache = self._cache(max_bytes=0, max_age=60)
+        cache.put("k", [self._image("a.jpg", b"a")])
+
+        with patch("app.cache.time.time", return_value=time.time() + 120):
+            cache.evict()
+
+        self.assertIsNone(cache.get("k"))
+
+    def test_expired_entry_is_miss_without_eviction(self):
+        """测试读取时检查过期时间，无需等待下一次写入触发淘汰"""
+        cache = self._cache(max_bytes=0, max_age=60)
+        cache.put("k", [self._image("a.jpg", b"a")])
+        self.assertIsNotNone(cache.get("k"))
+
+        with patch("app.cache.time.time", return_value=time.time() + 120):
+            self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_concurrent_puts_leave_complete_entry(self):
+        """测试并发写入同一键后条目完整，不留下临时目录"""
+        import threading
+
+        cache = self._cache(max_bytes=0, max_age=0)
+        images = [[self._image(f"{t}_{i}.jpg", f"{t}".encode() * 8) for i in range(3)] for t in range(6)]
+        threads = [threading.Thread(target=cache.put, args=("k", imgs)) for imgs in images]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        hit = cache.get("k")
+        self.assertEqual(len(hit), 3)
+        contents = {Path(image["cache_path"]).read_bytes() for image in hit}
+        self.assertEqual(len(contents), 1)
+        entry_parent = os.path.dirname(os.path.dirname(hit[0]["cache_path"]))
+        self.assertEqual(os.listdir(entry_parent), ["k"])
+
+    def test_missing_file_invalidates_entry(self):
+        """测试缓存文件被删除后视为未命中"""
+        cache = self._cache(max_bytes=0, max_age=0)
+        cache.put("k", [self._image("a.jpg", b"a")])
+        os.remove(cache.get("k")[0]["cache_path"])
+
+        self.assertIsNone(cache.get("k"))
+        self.assertEqual(cache.stats()["entries"], 0)
+
+
+class TestClientCache(unittest.TestCase):
+    """客户端缓存模式测试"""
+
+    def setUp(self):
+        from app.cache import ResultCache
+        from app.jimeng_api import JimengAPIClient
+
+        self.temp_dir = tempfile.mkdtemp()
+        self.client = JimengAPIClient(
+            api_key="test",
+            result_cache=ResultCache(os.path.join(self.temp_dir, "cache"), max_bytes=0, max_age=0)
+        )
+        self.client.output_dir = os.path.join(self.temp_dir, "output")
+
+        api_response = MagicMock()
+        api_response.status_code = 200
+        api_response.json.return_value = {"data": [{"url": "https://example.com/a.jpg"}]}
+        download_response = MagicMock()
+        download_response.status_code = 200
+        download_response.iter_content.return_value = [b"image-bytes"]
+
+        self.post = patch("app.jimeng_api.requests.Session.post", return_value=api_response).start()
+        patch("app.jimeng_api.requests.Session.get", return_value=download_response).start()
+
+    def tearDown(self):
+        import shutil
+        patch.stopall()
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def test_repeat_request_served_from_cache(self):
+        """测试相同种子的重复请求直接返回缓存"""
+        first = self.client.generate("test prompt", seed=42)
+        second = self.client.generate("test prompt", seed=42)
+
+        self.assertEqual(self.post.call_count, 1)
+        self.assertFalse(first["cached"])
+        self.assertTrue(second["cached"])
+        self.assertTrue(second["success"])
+        self.assertEqual(Path(second["local_path"]).read_bytes(), b"image-bytes")
+
+    def test_refresh_and_bypass(self):
+        """测试 refresh 与 bypass 模式都会重新请求"""
+        self.client.generate("test prompt", seed=42)
+        refreshed = self.client.generate("test prompt", seed=42, cache_mode="refresh")
+        bypassed = self.client.generate("test prompt", seed=42, cache_mode="bypass")
+
+        self.assertEqual(self.post.call_count, 3)
+        self.assertFalse(refreshed["cached"])
+        self.assertFalse(bypassed["cached"])
+
+    def test_random_seed_not_cached(self):
+        """测试未指定种子的请求不使用缓存"""
+        self.client.generate("test prompt")
+        self.client.generate("test prompt")
+
+        self.assertEqual(self.post.call_count, 2)
+        self.assertEqual(self.client.result_cache.stats()["entries"], 0)
+
+    def test_stream_shares_cache(self):
+        """测试流式生成写入缓存，与普通生成共用缓存键"""
+        self.post.return_value.iter_lines.return_value = [
+            'data: {"url": "https://example.com/a.jpg"}', "", "data: [DONE]"
+        ]
+        streamed = self.client.generate_stream("test prompt", seed=42)
+        cached = self.client.generate("test prompt", seed=42)
+
+        self.assertTrue(streamed["success"], streamed["error"])
+        self.assertEqual(self.post.call_count, 1)
+        self.assertTrue(cached["cached"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,155 @@
+"""
+配置加载测试
+测试覆盖：配置文件缓存、按修改时间重新加载、Settings 快照、数值配置解析
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+from app import config
+
+
+class _ConfigTestCase(unittest.TestCase):
+    """使用临时配置目录，并清空相关环境变量"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.config_file = Path(self.temp_dir) / "config.env"
+        env = {"JIMENG_CONFIG_DIR": self.temp_dir}
+        for key in config.Settings.ENV_KEYS[1:]:
+            env[key] = ""
+        self.env_patcher = patch.dict(os.environ, env)
+        self.env_patcher.start()
+
+    def tearDown(self):
+        self.env_patcher.stop()
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _write_config(self, text: str, mtime_ns: int):
+        self.config_file.write_text(text, encoding="utf-8")
+        os.utime(self.config_file, ns=(mtime_ns, mtime_ns))
+
+
+class TestConfigCache(_ConfigTestCase):
+    """配置文件缓存测试"""
+
+    def test_file_parsed_once(self):
+        """文件未修改时只解析一次"""
+        self._write_config("ARK_API_KEY=file-key\nMODEL_NAME=m1\n", 1_000_000_000)
+
+        with patch.object(config, "_parse_config_file", wraps=config._parse_config_file) as parse:
+            self.assertEqual(config._get_config("ARK_API_KEY"), "file-key")
+            self.assertEqual(config._get_config("MODEL_NAME"), "m1")
+            self.assertEqual(config._get_config("MISSING", "default"), "default")
+            self.assertEqual(parse.call_count, 1)
+
+    def test_reload_on_mtime_change(self):
+        """修改时间变化后重新解析"""
+        self._write_config("ARK_API_KEY=old-key\n", 1_000_000_000)
+        self.assertEqual(config._get_config("ARK_API_KEY"), "old-key")
+
+        self._write_config("ARK_API_KEY=new-key\n", 2_000_000_000)
+        self.assertEqual(config._get_config("ARK_API_KEY"), "new-key")
+
+    def test_missing_file(self):
+        """配置文件不存在时使用默认值，创建后生效"""
+        self.assertEqual(config._get_config("ARK_API_KEY", "none"), "none")
+
+        self._write_config("ARK_API_KEY=created\n", 1_000_000_000)
+        self.assertEqual(config._get_config("ARK_API_KEY", "none"), "created")
+
+    def test_env_overrides_file(self):
+        """环境变量优先于配置文件"""
+        self._write_config("ARK_API_KEY=file-key\n", 1_000_000_000)
+        with patch.dict(os.environ, {"ARK_API_KEY": "env-key"}):
+            self.assertEqual(config._get_config("ARK_API_KEY"), "env-key")
+
+
+class TestSettings(_ConfigTestCase):
+    """Settings 快照测试"""
+
+    def test_settings_cached(self):
+        """配置未变化时返回同一实例"""
+        self._write_config("ARK_API_URL=https://a.example.com\n", 1_000_000_000)
+        first = config.get_settings()
+        self.assertIs(config.get_settings(), first)
+        self.assertEqual(first.api_url, "https://a.example.com")
+        self.assertEqual(first.model_name, config.DEFAULT_MODEL_NAME)
+
+    def test_settings_follow_file_and_env(self):
+        """配置文件或环境变量变化后返回新实例"""
+        self._write_config("ARK_API_KEY=k1\n", 1_000_000_000)
+        first = config.get_settings()
+
+        self._write_config("ARK_API_KEY=k2\n", 2_000_000_000)
+        second = config.get_settings()
+        self.assertIsNot(second, first)
+        self.assertEqual(second.api_key, "k2")
+
+        with patch.dict(os.environ, {"MODEL_NAME": "env-model"}):
+            self.assertEqual(config.get_settings().model_name, "env-model")
+
+    def test_repr_masks_key(self):
+        """repr 不暴露完整 API Key"""
+        self._write_config("ARK_API_KEY=secret-api-key\n", 1_000_000_000)
+        self.assertNotIn("secret-api-key", repr(config.get_settings()))
+
+    def test_client_reload_settings(self):
+        """客户端按需重新读取 Key 与接口地址"""
+        from app.jimeng_api import JimengAPIClient
+
+        self._write_config("ARK_API_KEY=k1\nARK_API_URL=https://a.example.com\n", 1_000_000_000)
+        with patch.dict(os.environ, {"OUTPUT_DIR": self.temp_dir}), \
+                JimengAPIClient(api_key="k1") as client, JimengAPIClient() as implicit:
+            self.assertTrue(implicit.reload_settings())
+            self.assertFalse(implicit.reload_settings())
+
+            self._write_config("ARK_API_KEY=k2\nARK_API_URL=https://b.example.com\n", 2_000_000_000)
+            self.assertTrue(implicit.reload_settings())
+            self.assertEqual(implicit.api_key, "k2")
+            self.assertEqual(implicit.api_url, "https://b.example.com")
+
+            client.reload_settings()
+            self.assertEqual(client.api_key, "k1")
+            self.assertEqual(client.api_url, "https://b.example.com")
+
+
+
+class TestNumericConfig(_ConfigTestCase):
+    """数值配置测试"""
+
+    def test_invalid_number_falls_back_to_default(self):
+        """无法转换的数值配置打印指明配置项的警告并使用默认值"""
+        import io
+
+        self._write_config("SERVER_PORT=80a\nRETRY_BASE_DELAY=0.5\n", 1_000_000_000)
+        with patch("sys.stderr", new_callable=io.StringIO) as stderr:
+            self.assertEqual(config._get_int("SERVER_PORT", 8765), 8765)
+            self.assertEqual(config._get_float("RETRY_BASE_DELAY", 1), 0.5)
+            self.assertEqual(config._get_float("MISSING", 3), 3.0)
+        self.assertIn("SERVER_PORT", stderr.getvalue())
+        self.assertNotIn("RETRY_BASE_DELAY", stderr.getvalue())
+
+    def test_invalid_number_does_not_break_import(self):
+        """写错的数值配置不会让导入失败（--help 等命令照常可用）"""
+        import subprocess
+
+        env = dict(os.environ, BATCH_MAX_WORKERS="four", PYTHONDONTWRITEBYTECODE="1")
+        proc = subprocess.run(
+            [sys.executable, "-c", "from app import config; print(config.BATCH_MAX_WORKERS)"],
+            cwd=str(PROJECT_ROOT / "jimeng-selfie-app"), env=env, capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(proc.returncode, 0, proc.stderr)
+        self.assertEqual(proc.stdout.strip(), "4")
+        self.assertIn("BATCH_MAX_WORKERS", proc.stderr)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,300 @@
+"""
+近重复检测测试
+测试覆盖：感知哈希稳定性、BK 树查询、索引增量更新与持久化、后处理检查
+"""
+import os
+import sys
+import time
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _pattern(seed: int, size=(256, 256)) -> Image.Image:
+    """按种子生成随机色块图"""
+    rng = random.Random(seed)
+    image = Image.new("RGB", size, (rng.randrange(256),) * 3)
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse(
+            (x, y, x + rng.randrange(25, 125), y + rng.randrange(25, 125)),
+            fill=tuple(rng.randrange(256) for _ in range(3))
+        )
+    return image
+
+
+class TestHashes(unittest.TestCase):
+    """感知哈希测试"""
+
+    def test_similar_images_are_close(self):
+        """缩放、调亮后的图片距离很小，不同图片距离很大"""
+        from app.dedup import phash, dhash, hamming
+
+        original = _pattern(1)
+        variant = ImageEnhance.Brightness(original.resize((180, 180))).enhance(1.1)
+        other = _pattern(2)
+        for func in (phash, dhash):
+            with self.subTest(func=func.__name__):
+                self.assertLessEqual(hamming(func(original), func(variant)), 4)
+                self.assertGreater(hamming(func(original), func(other)), 16)
+                self.assertLess(func(original), 1 << 64)
+
+
+class TestBKTree(unittest.TestCase):
+    """BK 树测试"""
+
+    def test_search_matches_brute_force(self):
+        """查询结果与逐个比较一致"""
+        from app.dedup import BKTree, hamming
+
+        rng = random.Random(0)
+        keys = [rng.getrandbits(64) for _ in range(2000)]
+        # 加入若干近邻
+        keys += [keys[i] ^ (1 << rng.randrange(64)) for i in range(50)]
+        tree = BKTree()
+        for i, key in enumerate(keys):
+            tree.add(key, i)
+
+        for query in keys[:20] + [rng.getrandbits(64)]:
+            expected = sorted(i for i, key in enumerate(keys) if hamming(key, query) <= 8)
+            self.assertEqual(sorted(i for _, i in tree.search(query, 8)), expected)
+
+    def test_remove(self):
+        """删除后不再命中，相同哈希的其他值保留"""
+        from app.dedup import BKTree
+
+        tree = BKTree()
+        tree.add(5, "a")
+        tree.add(5, "b")
+        tree.add(6, "c")
+        self.assertTrue(tree.remove(5, "a"))
+        self.assertFalse(tree.remove(5, "a"))
+        self.assertEqual(sorted(v for _, v in tree.search(5, 2)), ["b", "c"])
+        self.assertEqual(len(tree), 2)
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    """近重复索引测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.output_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _save(self, name: str, image: Image.Image) -> str:
+        path = os.path.join(self.output_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        image.save(path, "PNG" if name.endswith((".png", ".part")) else "JPEG")
+        return path
+
+    def test_refresh_is_incremental_and_persistent(self):
+        """只为新增或修改的文件计算哈希，删除的文件移出索引，重新打开后索引仍在"""
+        from app.dedup import DuplicateIndex
+
+        first = self._save("a.png", _pattern(1))
+        self._save("sub/b.jpg", _pattern(2))
+        self._save("renditions/x/a.jpg", _pattern(1))   # 派生文件不参与索引
+        self._save(".a.png.part", _pattern(1))          # 下载中的临时文件
+
+        index = DuplicateIndex(self.output_dir)
+        self.assertEqual(index.refresh(), {"added": 2, "removed": 0, "failed": 0, "total": 2})
+        self.assertEqual(index.refresh()["added"], 0)
+
+        os.remove(first)
+        self._save("c.png", _pattern(3))
+        reopened = DuplicateIndex(self.output_dir)
+        self.assertEqual(len(reopened), 2)
+        self.assertEqual(reopened.refresh(), {"added": 1, "removed": 1, "failed": 0, "total": 2})
+
+        self.assertEqual(len(DuplicateIndex(self.output_dir)), 2)
+
+    def test_find_near_duplicates(self):
+        """按汉明距离查找近重复，排除自身，可限定时间范围"""
+        from app.dedup import DuplicateIndex
+
+        original = self._save("a.png", _pattern(1))
+        old_variant = self._save("b.jpg", ImageEnhance.Contrast(_pattern(1)).enhance(1.1))
+        self._save("c.png", _pattern(2))
+        os.utime(old_variant, (time.time() - 3600, time.time() - 3600))
+
+        index = DuplicateIndex(self.output_dir, max_distance=6)
+        index.refresh()
+
+        matches = index.find(original)
+        self.assertEqual([m["path"] for m in matches], [old_variant])
+        self.assertEqual(index.find(original, since=time.time() - 60), [])
+        self.assertTrue(index.is_duplicate(old_variant))
+
+        # 未入索引的图片也可以查询
+        outside = os.path.join(self.temp_dir.name, "new.png")
+        _pattern(1).resize((128, 128)).save(outside)
+        self.assertIn(original, [m["path"] for m in index.find(outside)])
+
+    def test_postprocess_flags_duplicates(self):
+        """后处理把新图片加入索引并标记近重复"""
+        from app.dedup import DuplicateIndex
+
+        existing = self._save("old.png", _pattern(1))
+        index = DuplicateIndex(self.output_dir)
+        index.refresh()
+
+        fresh = self._save("new.png", _pattern(2))
+        repeat = self._save("repeat.png", _pattern(1).resize((200, 200)))
+        result = {"success": True, "images": [{"local_path": fresh}, {"local_path": repeat}, {"url": "u"}]}
+        index(result)
+
+        self.assertEqual(result["images"][0]["duplicates"], [])
+        self.assertEqual(result["images"][1]["duplicates"], [existing])
+        self.assertEqual(result["duplicates"], [existing])
+        self.assertEqual(len(index), 3)
+
+    def test_relocate_keeps_hashes(self):
+        """文件移动后更新路径，不重新计算哈希"""
+        from unittest.mock import patch
+        from app.dedup import DuplicateIndex
+
+        source = self._save("a.png", _pattern(1))
+        index = DuplicateIndex(self.output_dir)
+        index.refresh()
+        target = os.path.join(self.output_dir, "ab", "a.png")
+        os.makedirs(os.path.dirname(target))
+        os.rename(source, target)
+
+        self.assertEqual(index.relocate([(source, target)]), 1)
+        with patch("app.dedup.image_hash") as image_hash:
+            reopened = DuplicateIndex(self.output_dir)
+            self.assertEqual(reopened.refresh(), {"added": 0, "removed": 0, "failed": 0, "total": 1})
+        image_hash.assert_not_called()
+
+    def test_compact_drops_stale_records(self):
+        """覆盖写入的记录在压缩后只保留最新一条"""
+        from app.dedup import DuplicateIndex
+
+        path = self._save("a.png", _pattern(1))
+        index = DuplicateIndex(self.output_dir)
+        index.add(path)
+        self._save("a.png", _pattern(2))
+        os.utime(path, (time.time() + 5, time.time() + 5))
+        index.add(path)
+        with open(index.index_path, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+        index.compact()
+        with open(index.index_path, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 1)
+        self.assertEqual(len(DuplicateIndex(self.output_dir)), 1)
+
+    def test_compact_keeps_records_of_other_processes(self):
+        """压缩时重新读取索引文件，其他实例（进程）追加的记录不会丢失"""
+        from app.dedup import DuplicateIndex
+
+        first = self._save("a.png", _pattern(1))
+        second = self._save("b.png", _pattern(2))
+        mine = DuplicateIndex(self.output_dir)
+        mine.add(first)
+
+        DuplicateIndex(self.output_dir).add(second)
+        mine.compact()
+
+        self.assertEqual(len(DuplicateIndex(self.output_dir)), 2)
+        self.assertEqual(len(mine), 2)
+
+    def test_refresh_keeps_records_added_during_scan(self):
+        """刷新在文件锁内重新读取索引，扫描期间其他实例（进程）加入的记录不会丢失或被移除"""
+        from app.dedup import DuplicateIndex
+
+        self._save("a.png", _pattern(1))
+        mine = DuplicateIndex(self.output_dir)
+        scan = mine._iter_images
+
+        def scan_then_concurrent_add():
+            yield from scan()
+            DuplicateIndex(self.output_dir).add(self._save("late.png", _pattern(2)))
+
+        mine._iter_images = scan_then_concurrent_add
+        self.assertEqual(mine.refresh(), {"added": 1, "removed": 0, "failed": 0, "total": 2})
+        mine.compact()
+
+        self.assertEqual(len(DuplicateIndex(self.output_dir)), 2)
+        self.assertEqual(len(mine), 2)
+
+    @unittest.skipIf(os.name == "nt", "文件锁仅在 POSIX 上跨进程生效")
+    def test_concurrent_processes_share_index(self):
+        """多个进程同时追加并压缩索引，所有记录都保留且每行完整"""
+        import json
+        import subprocess
+
+        paths = [self._save(f"{i}.png", _pattern(i, (64, 64))) for i in range(12)]
+        script = (
+            "import sys\n"
+            f"sys.path.insert(0, {str(PROJECT_ROOT / 'jimeng-selfie-app')!r})\n"
+            "from app.dedup import DuplicateIndex\n"
+            "index = DuplicateIndex(sys.argv[1])\n"
+            "for path in sys.argv[2:]:\n"
+            "    index.add(path)\n"
+            "    index.compact()\n"
+        )
+        workers = [
+            subprocess.Popen([sys.executable, "-c", script, self.output_dir, *paths[i::3]])
+            for i in range(3)
+        ]
+        for worker in workers:
+            self.assertEqual(worker.wait(timeout=60), 0)
+
+        from app.dedup import DuplicateIndex
+
+        index_path = DuplicateIndex(self.output_dir).index_path
+        with open(index_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r["path"] for r in records), sorted(os.path.basename(p) for p in paths))
+
+
+    @unittest.skipIf(os.name == "nt", "文件锁仅在 POSIX 上跨进程生效")
+    def test_concurrent_refresh_and_add(self):
+        """多个进程交替放入图片、加入索引并刷新，所有记录都保留且每行完整"""
+        import json
+        import subprocess
+
+        with tempfile.TemporaryDirectory() as staging:
+            sources = []
+            for i in range(12):
+                sources.append(os.path.join(staging, f"{i}.png"))
+                _pattern(i, (64, 64)).save(sources[-1])
+            script = (
+                "import os, sys, shutil\n"
+                f"sys.path.insert(0, {str(PROJECT_ROOT / 'jimeng-selfie-app')!r})\n"
+                "from app.dedup import DuplicateIndex\n"
+                "index = DuplicateIndex(sys.argv[1])\n"
+                "for source in sys.argv[2:]:\n"
+                "    target = os.path.join(sys.argv[1], os.path.basename(source))\n"
+                "    shutil.copyfile(source, target)\n"
+                "    index.add(target)\n"
+                "    index.refresh()\n"
+            )
+            workers = [
+                subprocess.Popen([sys.executable, "-c", script, self.output_dir, *sources[i::3]])
+                for i in range(3)
+            ]
+            for worker in workers:
+                self.assertEqual(worker.wait(timeout=60), 0)
+
+        from app.dedup import DuplicateIndex
+
+        index = DuplicateIndex(self.output_dir)
+        index.compact()
+        with open(index.index_path, encoding="utf-8") as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(sorted(r["path"] for r in records), sorted(f"{i}.png" for i in range(12)))
+
+if __name__ == "__main__":
+    unittest.main()
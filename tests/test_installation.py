@@ -515,7 +515,7 @@ class TestAPIClient(unittest.TestCase):
             self.assertFalse(result["success"])
             self.assertIn("API Key", result["error"])
 
-    @patch("app.jimeng_api.requests.post")
+    @patch("app.jimeng_api.requests.Session.post")
     def test_api_call_success_mocked(self, mock_post):
         """测试API调用成功（模拟）"""
         from app.jimeng_api import JimengAPIClient
@@ -534,7 +534,7 @@ class TestAPIClient(unittest.TestCase):
         self.assertTrue(result["success"])
         self.assertEqual(result["url"], "https://example.com/image.jpg")
 
-    @patch("app.jimeng_api.requests.post")
+    @patch("app.jimeng_api.requests.Session.post")
     def test_api_call_failure_mocked(self, mock_post):
         """测试API调用失败（模拟）"""
         from app.jimeng_api import JimengAPIClient
@@ -558,8 +558,8 @@ class TestAPIClient(unittest.TestCase):
 class TestImageGeneration(unittest.TestCase):
     """图片生成测试"""
 
-    @patch("app.jimeng_api.requests.post")
-    @patch("app.jimeng_api.requests.get")
+    @patch("app.jimeng_api.requests.Session.post")
+    @patch("app.jimeng_api.requests.Session.get")
     def test_image_generation_success_mocked(self, mock_get, mock_post):
         """测试图片生成成功（模拟）"""
         from app.jimeng_api import JimengAPIClient
@@ -576,6 +576,7 @@ class TestImageGeneration(unittest.TestCase):
         mock_download_response = MagicMock()
         mock_download_response.status_code = 200
         mock_download_response.content = b"fake_image_data"
+        mock_download_response.iter_content.return_value = [b"fake_image_data"]
         mock_get.return_value = mock_download_response
 
         with tempfile.TemporaryDirectory() as temp_dir:
@@ -820,7 +821,7 @@ class TestErrorHandling(unittest.TestCase):
         """测试网络超时处理"""
         from app.jimeng_api import JimengAPIClient
 
-        with patch("app.jimeng_api.requests.post") as mock_post:
+        with patch("app.jimeng_api.requests.Session.post") as mock_post:
             import requests
             mock_post.side_effect = requests.exceptions.Timeout()
 
@@ -0,0 +1,369 @@
+"""
+即梦 API 客户端测试
+测试覆盖：连接池会话、异步客户端、批量生成、多图生成、流式响应
+"""
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+class _FakeArkHandler(BaseHTTPRequestHandler):
+    """模拟 Ark 接口与图片 CDN 的本地服务"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str = "application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        base_url = f"http://127.0.0.1:{self.server.server_port}"
+        data = [{"url": f"{base_url}/image_{i}.jpg"} for i in range(payload.get("n", 1))]
+
+        if payload.get("stream"):
+            events = [
+                {"type": "image_generation.partial_succeeded", "image_index": i, **item}
+                for i, item in enumerate(data)
+            ]
+            body = "".join(f"data: {json.dumps(e)}\n\n" for e in events) + "data: [DONE]\n\n"
+            self._send(200, body.encode(), "text/event-stream")
+            return
+
+        self._send(200, json.dumps({"data": data}).encode())
+
+    def do_GET(self):
+        self._send(200, b"fake_image_data", "image/jpeg")
+
+
+class FakeArkServer:
+    """在后台线程运行的本地模拟服务"""
+
+    def __init__(self):
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _FakeArkHandler)
+        self.httpd.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/api/v3/images/generations"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self) -> "FakeArkServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class TestPooledSession(unittest.TestCase):
+    """连接池会话测试"""
+
+    def test_connections_are_reused(self):
+        """测试同一主机的连续请求复用连接"""
+        from app.session import PooledSession
+
+        with FakeArkServer() as server, PooledSession(pool_maxsize=2) as session:
+            for _ in range(3):
+                response = session.get(server.url)
+                self.assertEqual(response.status_code, 200)
+
+            stats = session.stats()
+            self.assertEqual(len(stats), 1)
+            host_stats = next(iter(stats.values()))
+            self.assertEqual(host_stats["requests"], 3)
+            self.assertEqual(host_stats["connections"], 1)
+            self.assertEqual(host_stats["reused"], 2)
+
+    def test_close_releases_session(self):
+        """测试关闭后统计清空且可重新使用"""
+        from app.session import PooledSession
+
+        session = PooledSession()
+        self.assertTrue(session.closed)
+        session.session
+        self.assertFalse(session.closed)
+        session.close()
+        self.assertTrue(session.closed)
+        self.assertEqual(session.stats(), {})
+
+    def test_client_context_manager(self):
+        """测试客户端生成与下载共用连接池"""
+        from app.jimeng_api import JimengAPIClient
+
+        with FakeArkServer() as server, tempfile.TemporaryDirectory() as temp_dir:
+            with JimengAPIClient(api_key="test") as client:
+                client.api_url = server.url
+                client.output_dir = temp_dir
+
+                for _ in range(2):
+                    result = client.generate("test prompt")
+                    self.assertTrue(result["success"], result["error"])
+                    self.assertTrue(os.path.exists(result["local_path"]))
+
+                host_stats = next(iter(client.pool_stats().values()))
+                self.assertEqual(host_stats["requests"], 4)
+                self.assertEqual(host_stats["connections"], 1)
+
+            self.assertTrue(client.session.closed)
+
+
+class TestAsyncClient(unittest.TestCase):
+    """asyncio 接口（线程卸载）测试"""
+
+    def test_concurrent_generation(self):
+        """测试并发生成返回与同步接口一致的结果"""
+        from app.async_api import ThreadedJimengAPIClient
+
+        async def run(server_url: str, temp_dir: str):
+            async with ThreadedJimengAPIClient(api_key="test", max_concurrency=2) as client:
+                client.client.api_url = server_url
+                client.output_dir = temp_dir
+                return await asyncio.gather(
+                    *[client.generate(f"prompt {i}") for i in range(5)]
+                )
+
+        with FakeArkServer() as server, tempfile.TemporaryDirectory() as temp_dir:
+            results = asyncio.run(run(server.url, temp_dir))
+
+        self.assertEqual(len(results), 5)
+        for i, result in enumerate(results):
+            self.assertTrue(result["success"], result["error"])
+            self.assertEqual(result["prompt"], f"prompt {i}")
+            self.assertIsNotNone(result["local_path"])
+
+    def test_concurrency_is_bounded(self):
+        """测试同时执行的请求数不超过上限"""
+        import threading
+        import time
+        from app.async_api import ThreadedJimengAPIClient
+
+        lock = threading.Lock()
+        state = {"active": 0, "peak": 0}
+
+        def fake_generate(prompt, **kwargs):
+            with lock:
+                state["active"] += 1
+                state["peak"] = max(state["peak"], state["active"])
+            time.sleep(0.02)
+            with lock:
+                state["active"] -= 1
+            return {"success": True, "prompt": prompt}
+
+        async def run():
+            async with ThreadedJimengAPIClient(api_key="test", max_concurrency=3) as client:
+                client.client.generate = fake_generate
+                return await asyncio.gather(*[client.generate("p") for _ in range(10)])
+
+        results = asyncio.run(run())
+        self.assertEqual(len(results), 10)
+        self.assertLessEqual(state["peak"], 3)
+
+    def test_usable_from_multiple_event_loops(self):
+        """测试同一客户端可在不同事件循环中使用"""
+        from app.async_api import ThreadedJimengAPIClient
+
+        client = ThreadedJimengAPIClient(api_key="test", max_concurrency=2)
+        client.client.generate = lambda prompt, **kwargs: {"success": True, "prompt": prompt}
+
+        async def run(prompt):
+            results = await asyncio.gather(*[client.generate(prompt) for _ in range(4)])
+            return [r["prompt"] for r in results], client.in_flight
+
+        self.assertEqual(asyncio.run(run("a")), (["a"] * 4, 0))
+        self.assertEqual(asyncio.run(run("b")), (["b"] * 4, 0))
+        asyncio.run(client.aclose())
+
+
+class TestBatchGeneration(unittest.TestCase):
+    """批量生成测试"""
+
+    def test_results_keep_input_order(self):
+        """测试结果顺序与任务顺序一致"""
+        from app.jimeng_api import JimengAPIClient
+
+        jobs = [{"prompt": f"variant {i}", "seed": 100 + i} for i in range(6)]
+
+        with FakeArkServer() as server, tempfile.TemporaryDirectory() as temp_dir:
+            with JimengAPIClient(api_key="test") as client:
+                client.api_url = server.url
+                client.output_dir = temp_dir
+                results = client.generate_batch(jobs, max_workers=3)
+
+        self.assertEqual([r["prompt"] for r in results], [j["prompt"] for j in jobs])
+        self.assertEqual([r["seed"] for r in results], [j["seed"] for j in jobs])
+        self.assertTrue(all(r["success"] for r in results))
+
+    def test_errors_are_isolated(self):
+        """测试单个任务异常不影响其他任务"""
+        from unittest.mock import patch
+        from app.jimeng_api import JimengAPIClient
+
+        def fake_generate(prompt, **kwargs):
+            if prompt == "bad":
+                raise RuntimeError("boom")
+            return {"success": True, "prompt": prompt}
+
+        client = JimengAPIClient(api_key="test")
+        with patch.object(client, "generate", side_effect=fake_generate):
+            results = client.generate_batch(
+                [{"prompt": "a"}, {"prompt": "bad"}, {"prompt": "c"}]
+            )
+
+        self.assertTrue(results[0]["success"])
+        self.assertFalse(results[1]["success"])
+        self.assertIn("boom", results[1]["error"])
+        self.assertTrue(results[2]["success"])
+
+    def test_bad_deadline_fails_only_its_job(self):
+        """无效的 deadline 只让对应任务失败，有效的 deadline 从提交时开始计时"""
+        from unittest.mock import patch
+        from app.jimeng_api import JimengAPIClient
+        from app.timeouts import Deadline
+
+        seen = {}
+
+        def fake_generate(prompt, **kwargs):
+            seen[prompt] = kwargs.get("deadline")
+            return {"success": True, "prompt": prompt}
+
+        client = JimengAPIClient(api_key="test")
+        with patch.object(client, "generate", side_effect=fake_generate):
+            results = client.generate_batch([{"prompt": "a", "deadline": "soon"}, {"prompt": "b", "deadline": 30}])
+        client.close()
+
+        self.assertFalse(results[0]["success"])
+        self.assertIn("截止时间", results[0]["error"])
+        self.assertTrue(results[1]["success"])
+        self.assertIsInstance(seen["b"], Deadline)
+        self.assertLessEqual(seen["b"].remaining(), 30)
+        self.assertNotIn("a", seen)
+
+    def test_iter_batch_yields_every_job(self):
+        """测试流式返回覆盖所有任务"""
+        from unittest.mock import patch
+        from app.jimeng_api import JimengAPIClient
+
+        client = JimengAPIClient(api_key="test")
+        with patch.object(client, "generate", side_effect=lambda prompt, **kw: {"prompt": prompt}):
+            indexes = sorted(i for i, _ in client.iter_batch([{"prompt": str(i)} for i in range(5)]))
+
+        self.assertEqual(indexes, list(range(5)))
+
+
+class TestMultiImageGeneration(unittest.TestCase):
+    """单请求多图生成测试"""
+
+    def test_payload_enables_sequential_generation(self):
+        """测试 n > 1 时启用多图模式"""
+        from app.jimeng_api import JimengAPIClient
+
+        client = JimengAPIClient(api_key="test")
+        single = client._build_payload("p", n=1)
+        multi = client._build_payload("p", n=4)
+
+        self.assertNotIn("sequential_image_generation_options", single)
+        self.assertEqual(multi["n"], 4)
+        self.assertEqual(multi["sequential_image_generation"], "auto")
+        self.assertEqual(multi["sequential_image_generation_options"], {"max_images": 4})
+
+    def test_all_images_downloaded(self):
+        """测试返回并下载全部图片"""
+        from app.jimeng_api import JimengAPIClient
+
+        with FakeArkServer() as server, tempfile.TemporaryDirectory() as temp_dir:
+            with JimengAPIClient(api_key="test") as client:
+                client.api_url = server.url
+                client.output_dir = temp_dir
+                result = client.generate("test prompt", n=4, seed=7)
+
+            self.assertTrue(result["success"], result["error"])
+            self.assertEqual(len(result["images"]), 4)
+            paths = [image["local_path"] for image in result["images"]]
+            self.assertEqual(len(set(paths)), 4)
+            self.assertTrue(all(os.path.exists(p) for p in paths))
+            self.assertTrue(all(image["seed"] == 7 for image in result["images"]))
+            self.assertEqual(result["local_path"], paths[0])
+
+
+class TestStreamingGeneration(unittest.TestCase):
+    """流式响应测试"""
+
+    def test_sse_parsing(self):
+        """测试 SSE 事件解析"""
+        from app.jimeng_api import iter_sse_events
+
+        lines = [
+            'data: {"a": 1}',
+            "",
+            ": keep-alive comment",
+            "event: image",
+            'data: {"b":',
+            "data: 2}",
+            "",
+            'data: {"c": 3}',
+            'data: {"d": 4}',
+            "data: [DONE]",
+            'data: {"ignored": true}',
+        ]
+        self.assertEqual(
+            list(iter_sse_events(lines)),
+            [{"a": 1}, {"b": 2}, {"c": 3}, {"d": 4}]
+        )
+
+    def test_callback_fires_per_image(self):
+        """测试每张图片到达时触发回调并完成下载"""
+        from app.jimeng_api import JimengAPIClient
+
+        arrived = []
+
+        with FakeArkServer() as server, tempfile.TemporaryDirectory() as temp_dir:
+            with JimengAPIClient(api_key="test") as client:
+                client.api_url = server.url
+                client.output_dir = temp_dir
+                result = client.generate_stream("test prompt", n=3, on_image=arrived.append)
+
+            self.assertTrue(result["success"], result["error"])
+            self.assertEqual([image["index"] for image in arrived], [0, 1, 2])
+            self.assertEqual(len(result["images"]), 3)
+            self.assertTrue(all(os.path.exists(i["local_path"]) for i in result["images"]))
+
+    def test_stream_error_event(self):
+        """测试流中只有失败事件时返回错误"""
+        from unittest.mock import patch, MagicMock
+        from app.jimeng_api import JimengAPIClient
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.iter_lines.return_value = [
+            'data: {"type": "image_generation.partial_failed", "error": {"message": "sensitive content"}}',
+            "",
+            "data: [DONE]",
+        ]
+
+        client = JimengAPIClient(api_key="test")
+        with patch("app.jimeng_api.requests.Session.post", return_value=mock_response):
+            result = client.generate_stream("test prompt", save_to_file=False)
+
+        self.assertFalse(result["success"])
+        self.assertIn("sensitive content", result["error"])
+        self.assertTrue(mock_response.close.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,370 @@
+"""
+持久化任务队列测试
+测试覆盖：幂等提交、状态流转、崩溃续跑、已生成任务不重复计费、队列批量任务
+"""
+import io
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+import unittest
+from unittest.mock import patch
+from pathlib import Path
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+class Crash(BaseException):
+    """模拟进程在任务执行中途退出"""
+
+
+class FakeClient:
+    """记录调用次数的客户端替身"""
+
+    def __init__(self, output_dir: str, fail_download: bool = False, crash_download: bool = False):
+        self.output_dir = output_dir
+        self.fail_download = fail_download
+        self.crash_download = crash_download
+        self.generate_calls = []
+        self.download_calls = 0
+        self.download_pending = []
+        self.deadlines = []
+        self.recorded = []
+
+    def request(self, prompt, filename_prefix="jimeng", deadline=None, **kwargs):
+        self.generate_calls.append(prompt)
+        self.deadlines.append(deadline)
+        if "fail" in prompt:
+            return {"success": False, "prompt": prompt, "seed": None, "images": [], "error": "boom"}, None
+        seed = kwargs.get("seed", 7)
+        result = {
+            "success": True, "prompt": prompt, "seed": seed, "error": None, "local_path": None,
+            "url": f"https://cdn/{prompt}.jpg", "cached": False,
+            "images": [{"url": f"https://cdn/{prompt}.jpg", "local_path": None, "seed": seed, "size": "1x1"}],
+        }
+        pending = {"prefix": filename_prefix, "deadline": self.make_deadline(deadline), "response_format": "url",
+                   "started": 0.0, "cache_key": None, "size": None, "metadata": None}
+        return result, pending
+
+    def download(self, result, pending):
+        self.download_calls += 1
+        self.download_pending.append(pending)
+        if self.crash_download:
+            raise Crash()
+        for index, image in enumerate(result["images"]):
+            if self.fail_download:
+                image["local_path"] = None
+                continue
+            path = os.path.join(self.output_dir, f"{pending['prefix']}_{image['seed']}_{index}.jpg")
+            Path(path).write_bytes(b"img")
+            image["local_path"] = path
+        if self.fail_download:
+            result["error"] = "图片下载失败"
+            return False
+        result["local_path"] = result["images"][0]["local_path"]
+        self.recorded.append(result["prompt"])
+        return True
+
+    @staticmethod
+    def make_deadline(deadline=None):
+        from app.timeouts import Deadline
+        return Deadline.coerce(deadline)
+
+
+class TestJobQueue(unittest.TestCase):
+    """任务队列测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, "queue.sqlite3")
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _queue(self, **kwargs):
+        from app.jobqueue import JobQueue
+        return JobQueue(self.db_path, **kwargs)
+
+    def test_submit_is_idempotent(self):
+        """重复提交同一任务只保留一条记录"""
+        queue = self._queue()
+        first = queue.submit({"prompt": "a", "seed": 1})
+        second = queue.submit({"seed": 1, "prompt": "a"})
+        explicit = queue.submit({"prompt": "a", "seed": 1}, key="job-1")
+
+        self.assertEqual(first, second)
+        self.assertEqual(explicit, "job-1")
+        self.assertEqual(queue.counts()["queued"], 2)
+
+        with self.assertRaises(ValueError):
+            queue.submit({"prompt": "a", "save_to_file": False})
+
+    def test_run_processes_all_jobs(self):
+        """所有任务执行完毕，失败任务记录错误"""
+        from app.jobqueue import SUCCEEDED, FAILED
+        from app.retry import RetryPolicy
+
+        queue = self._queue(retry_policy=RetryPolicy(max_attempts=1))
+        keys = [queue.submit({"prompt": p, "seed": i}) for i, p in enumerate(["a", "b", "fail"])]
+        client = FakeClient(self.temp_dir)
+        seen = []
+
+        counts = queue.run(client, max_workers=2, on_result=seen.append)
+
+        self.assertEqual(counts["succeeded"], 2)
+        self.assertEqual(counts["failed"], 1)
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(sorted(client.generate_calls), ["a", "b", "fail"])
+        self.assertEqual(sorted(client.recorded), ["a", "b"])
+
+        job = queue.get(keys[0])
+        self.assertEqual(job["status"], SUCCEEDED)
+        self.assertTrue(job["result"]["success"])
+        self.assertTrue(os.path.exists(job["result"]["local_path"]))
+        self.assertEqual(queue.get(keys[2])["status"], FAILED)
+        self.assertEqual(queue.get(keys[2])["error"], "boom")
+
+        # 再次运行不会重复执行
+        queue.run(client)
+        self.assertEqual(len(client.generate_calls), 3)
+
+    def test_crash_during_download_does_not_regenerate(self):
+        """生成后、下载完成前退出，续跑时只重新下载"""
+        from app.jobqueue import GENERATED, SUCCEEDED
+
+        queue = self._queue()
+        key = queue.submit({"prompt": "a"})
+
+        crashing = FakeClient(self.temp_dir, crash_download=True)
+        job = queue.claim()
+        with self.assertRaises(Crash):
+            queue.process(crashing, job)
+        self.assertEqual(queue.get(key)["status"], GENERATED)
+
+        # 租约过期后任务可被重新领取
+        queue._update(key, job["lease_owner"], lease_until=0)
+
+        resumed = FakeClient(self.temp_dir)
+        queue.run(resumed)
+
+        job = queue.get(key)
+        self.assertEqual(job["status"], SUCCEEDED)
+        self.assertEqual(resumed.generate_calls, [])
+        self.assertEqual(resumed.download_calls, 1)
+        self.assertEqual(job["generate_attempts"], 1)
+
+    def test_process_uses_staged_client_with_deadline(self):
+        """生成与下载都通过分阶段接口进行，续跑下载时沿用任务的截止时间"""
+        queue = self._queue()
+        key = queue.submit({"prompt": "a", "deadline": 30})
+
+        crashing = FakeClient(self.temp_dir, crash_download=True)
+        job = queue.claim()
+        with self.assertRaises(Crash):
+            queue.process(crashing, job)
+        self.assertEqual(crashing.deadlines, [30])
+        self.assertIsNotNone(crashing.download_pending[0]["deadline"])
+
+        queue._update(key, job["lease_owner"], lease_until=0)
+        resumed = FakeClient(self.temp_dir)
+        queue.run(resumed)
+
+        pending = resumed.download_pending[0]
+        self.assertEqual(pending["prefix"], "jimeng")
+        self.assertLessEqual(pending["deadline"].remaining(), 30)
+        self.assertTrue(queue.get(key)["result"]["success"])
+
+    def test_stale_lease_of_dead_process_is_released(self):
+        """本机已退出进程持有的租约立即释放"""
+        from app.jobqueue import SUCCEEDED
+
+        queue = self._queue()
+        key = queue.submit({"prompt": "a"})
+        job = queue.claim()
+
+        proc = subprocess.Popen([sys.executable, "-c", "pass"])
+        proc.wait()
+        dead_owner = f"{socket.gethostname()}:{proc.pid}:1"
+        queue._update(key, job["lease_owner"], lease_owner=dead_owner, lease_until=time.time() + 3600)
+
+        client = FakeClient(self.temp_dir)
+        queue.run(client)
+
+        job = queue.get(key)
+        self.assertEqual(job["status"], SUCCEEDED)
+        self.assertEqual(job["generate_attempts"], 2)
+
+    def test_download_failures_keep_generation(self):
+        """下载多次失败后标记失败，重试只重新下载"""
+        from app.jobqueue import FAILED, SUCCEEDED
+
+        queue = self._queue(max_download_attempts=2)
+        key = queue.submit({"prompt": "a"})
+
+        failing = FakeClient(self.temp_dir, fail_download=True)
+        queue.run(failing)
+        job = queue.get(key)
+        self.assertEqual(job["status"], FAILED)
+        self.assertEqual(failing.download_calls, 2)
+        self.assertIsNotNone(job["images"])
+
+        self.assertEqual(queue.retry_failed(), 1)
+        working = FakeClient(self.temp_dir)
+        queue.run(working)
+
+        self.assertEqual(queue.get(key)["status"], SUCCEEDED)
+        self.assertEqual(len(failing.generate_calls) + len(working.generate_calls), 1)
+
+    def test_failed_generation_retried_by_policy(self):
+        """生成失败按重试策略重新排队，尝试次数用尽后才标记失败"""
+        from app.jobqueue import FAILED, SUCCEEDED
+        from app.retry import RetryPolicy
+
+        queue = self._queue(retry_policy=RetryPolicy(max_attempts=3, base_delay=0.01))
+        failing = queue.submit({"prompt": "fail"})
+        flaky = queue.submit({"prompt": "flaky"})
+
+        client = FakeClient(self.temp_dir)
+        request = client.request
+        calls = {"flaky": 0}
+
+        def flaky_request(prompt, **kwargs):
+            if prompt == "flaky":
+                calls["flaky"] += 1
+                if calls["flaky"] == 1:
+                    client.generate_calls.append(prompt)
+                    return {"success": False, "prompt": prompt, "seed": None, "images": [], "error": "503"}, None
+            return request(prompt, **kwargs)
+
+        client.request = flaky_request
+        seen = []
+        queue.run(client, max_workers=2, on_result=seen.append)
+
+        self.assertEqual(client.generate_calls.count("fail"), 3)
+        self.assertEqual(queue.get(failing)["status"], FAILED)
+        self.assertEqual(queue.get(failing)["generate_attempts"], 3)
+        self.assertEqual(queue.get(flaky)["status"], SUCCEEDED)
+        self.assertEqual(queue.get(flaky)["generate_attempts"], 2)
+        self.assertEqual(sum(record["status"] in (FAILED, SUCCEEDED) for record in seen), 2)
+
+    def test_worker_exception_fails_only_that_job(self):
+        """执行任务时抛出异常只标记该任务失败，其他任务继续执行"""
+        from app.jobqueue import FAILED, SUCCEEDED
+
+        queue = self._queue()
+        broken = queue.submit({"prompt": "broken"})
+        fine = queue.submit({"prompt": "fine"})
+
+        client = FakeClient(self.temp_dir)
+        request = client.request
+
+        def raising_request(prompt, **kwargs):
+            if prompt == "broken":
+                raise RuntimeError("unexpected")
+            return request(prompt, **kwargs)
+
+        client.request = raising_request
+        with patch("builtins.print"):
+            counts = queue.run(client)
+
+        self.assertEqual(counts["succeeded"], 1)
+        self.assertEqual(queue.get(broken)["status"], FAILED)
+        self.assertIn("unexpected", queue.get(broken)["error"])
+        self.assertEqual(queue.get(fine)["status"], SUCCEEDED)
+
+    def test_lost_lease_update_is_ignored(self):
+        """租约被接管后，原执行者的更新不生效"""
+        queue = self._queue()
+        key = queue.submit({"prompt": "a"})
+        queue.claim()
+        self.assertFalse(queue._update(key, "other:1:1", status="failed"))
+        self.assertEqual(queue.get(key)["status"], "running")
+
+
+class TestQueuedJobsFile(unittest.TestCase):
+    """队列批量任务文件测试"""
+
+    def test_rerun_emits_stored_results(self):
+        """同一任务文件重新运行时直接输出已完成任务的结果"""
+        from app.jobqueue import JobQueue
+        from app.jobs import run_jobs_queued
+
+        lines = [
+            '{"id": "a", "prompt": "girl", "selfie": true}\n',
+            '{"prompt": "b", "seed": 2}\n',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = JobQueue(os.path.join(temp_dir, "queue.sqlite3"))
+
+            client = FakeClient(temp_dir)
+            first = io.StringIO()
+            stats = run_jobs_queued(queue, client, lines, first)
+            self.assertEqual(stats["succeeded"], 2)
+            self.assertEqual(len(client.generate_calls), 2)
+
+            rerun_client = FakeClient(temp_dir)
+            second = io.StringIO()
+            stats = run_jobs_queued(queue, rerun_client, lines, second)
+            self.assertEqual(stats["succeeded"], 2)
+            self.assertEqual(rerun_client.generate_calls, [])
+
+            before = {r["line"]: r for r in map(json.loads, first.getvalue().splitlines())}
+            after = {r["line"]: r for r in map(json.loads, second.getvalue().splitlines())}
+            self.assertEqual(before[1]["style"], after[1]["style"])
+            self.assertEqual(before[2]["local_path"], after[2]["local_path"])
+
+    def test_jobs_leased_elsewhere_reported_as_pending(self):
+        """其他执行者持有租约的任务输出未完成的结果，而不是被静默遗漏"""
+        from app.jobqueue import JobQueue
+        from app.jobs import run_jobs_queued
+
+        lines = ['{"id": "a", "prompt": "one"}\n', '{"id": "b", "prompt": "two"}\n']
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = JobQueue(os.path.join(temp_dir, "queue.sqlite3"))
+            queue.submit({"prompt": "one"}, key="a")
+            queue.claim()  # 模拟另一个仍在运行的执行者领取了任务 a
+
+            client = FakeClient(temp_dir)
+            out = io.StringIO()
+            with patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                stats = run_jobs_queued(queue, client, lines, out)
+
+        records = {r["line"]: r for r in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(stats, {"total": 2, "succeeded": 1, "failed": 1})
+        self.assertEqual(client.generate_calls, ["two"])
+        self.assertIn("其他执行者", records[1]["error"])
+        self.assertIn("1 个任务", stderr.getvalue())
+
+    def test_duplicate_lines_get_error_result(self):
+        """幂等键重复的任务行不执行，但仍输出一行错误结果"""
+        from app.jobqueue import JobQueue
+        from app.jobs import run_jobs_queued
+
+        lines = [
+            '{"id": "a", "prompt": "one"}\n',
+            '{"id": "a", "prompt": "two"}\n',
+            '{"prompt": "b", "seed": 2}\n',
+            '{"prompt": "b", "seed": 2}\n',
+        ]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            queue = JobQueue(os.path.join(temp_dir, "queue.sqlite3"))
+            client = FakeClient(temp_dir)
+            out = io.StringIO()
+            stats = run_jobs_queued(queue, client, lines, out)
+
+        records = {r["line"]: r for r in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(sorted(records), [1, 2, 3, 4])
+        self.assertEqual(stats, {"total": 4, "succeeded": 2, "failed": 2})
+        self.assertEqual(sorted(client.generate_calls), ["b", "one"])
+        self.assertIn("第 1 行", records[2]["error"])
+        self.assertIn("第 3 行", records[4]["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,260 @@
+"""
+批量任务文件测试
+测试覆盖：任务行解析、JSONL 结果输出、CLI --jobs 模式
+"""
+import io
+import os
+import sys
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _fake_generate(prompt, **kwargs):
+    """按提示词返回固定结果的 generate 替身"""
+    if "fail" in prompt:
+        return {"success": False, "prompt": prompt, "error": "boom", "images": []}
+    return {
+        "success": True, "prompt": prompt, "seed": kwargs.get("seed", 1),
+        "url": "https://example.com/a.jpg", "local_path": f"/tmp/{kwargs.get('seed', 1)}.jpg",
+        "images": [{"url": "https://example.com/a.jpg", "local_path": f"/tmp/{kwargs.get('seed', 1)}.jpg"}],
+        "cached": False, "error": None,
+    }
+
+
+class TestParseJob(unittest.TestCase):
+    """任务行解析测试"""
+
+    def setUp(self):
+        from app.strategy import SelfieStrategy
+        self.strategy = SelfieStrategy()
+
+    def test_plain_prompt(self):
+        """未指定风格时提示词原样使用，生成参数透传"""
+        from app.jobs import parse_job
+
+        job, style = parse_job(
+            {"prompt": "a cat", "seed": 7, "size": "1024x1024", "references": ["https://r/1.jpg"]},
+            self.strategy
+        )
+        self.assertIsNone(style)
+        self.assertEqual(job["prompt"], "a cat")
+        self.assertEqual(job["seed"], 7)
+        self.assertEqual(job["size"], "1024x1024")
+        self.assertEqual(job["reference_images"], ["https://r/1.jpg"])
+
+    def test_style_builds_prompt(self):
+        """指定风格时补全提示词，他拍风格按他拍增强"""
+        from app.jobs import parse_job
+
+        job, style = parse_job({"prompt": "女孩", "style": "街拍风格"}, self.strategy)
+        self.assertEqual(style, "街拍风格")
+        self.assertIn(self.strategy.get_other_prompt_enhancement("街拍风格"), job["prompt"])
+
+        job, style = parse_job({"prompt": "女孩", "selfie": True, "platform": "private"}, self.strategy)
+        self.assertIn(style, self.strategy.selfie_styles)
+        self.assertTrue(job["prompt"].startswith("女孩，"))
+
+    def test_invalid_jobs(self):
+        """缺少提示词或参考图格式错误时报错"""
+        from app.jobs import parse_job, JobError
+
+        for data in ({}, {"prompt": " "}, {"prompt": "x", "references": "url"}, ["prompt"]):
+            with self.subTest(data=data):
+                with self.assertRaises(JobError):
+                    parse_job(data, self.strategy)
+
+    def test_invalid_field_types(self):
+        """透传字段类型错误时报错，不会传给 generate()"""
+        from app.jobs import parse_job, JobError
+
+        invalid = {
+            "seed": ["1", 1.5, True],
+            "n": ["2", 2.0, False],
+            "deadline": ["soon", 0, -5, True],
+            "watermark": ["false", 0],
+            "size": [2048, ["2048x2048"]],
+            "cache_mode": [1],
+            "filename_prefix": [7, {"a": 1}],
+        }
+        for field, values in invalid.items():
+            for value in values:
+                with self.subTest(field=field, value=value):
+                    with self.assertRaisesRegex(JobError, field):
+                        parse_job({"prompt": "x", field: value}, self.strategy)
+
+        job, _ = parse_job({"prompt": "x", "seed": 3, "n": 2, "deadline": 1.5, "watermark": False}, self.strategy)
+        self.assertEqual((job["seed"], job["n"], job["deadline"], job["watermark"]), (3, 2, 1.5, False))
+
+
+class TestRunJobs(unittest.TestCase):
+    """批量执行测试"""
+
+    def test_one_result_line_per_job(self):
+        """每个任务输出一行结果，无效行也有对应的错误结果"""
+        from app.jimeng_api import JimengAPIClient
+        from app.jobs import run_jobs
+
+        lines = [
+            '{"id": "a", "prompt": "first", "seed": 1}\n',
+            "\n",
+            "# comment\n",
+            "not json\n",
+            '{"id": "c", "prompt": "please fail"}\n',
+            '{"id": "d", "prompt": "fourth", "seed": 4}\n',
+        ]
+        out = io.StringIO()
+        client = JimengAPIClient(api_key="test")
+        with patch.object(client, "generate", side_effect=_fake_generate) as generate:
+            stats = run_jobs(client, lines, out, max_workers=2)
+        client.close()
+
+        self.assertEqual(generate.call_count, 3)
+        self.assertEqual(stats, {"total": 4, "succeeded": 2, "failed": 2})
+
+        records = {r["line"]: r for r in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(sorted(records), [1, 4, 5, 6])
+        self.assertEqual(records[1]["id"], "a")
+        self.assertTrue(records[1]["success"])
+        self.assertEqual(records[1]["images"], ["/tmp/1.jpg"])
+        self.assertIn("第 4 行", records[4]["error"])
+        self.assertEqual(records[5]["error"], "boom")
+        self.assertEqual(records[6]["seed"], 4)
+
+    def test_bad_field_does_not_stop_batch(self):
+        """字段类型错误的行输出错误结果，其余任务照常执行"""
+        from app.jimeng_api import JimengAPIClient
+        from app.jobs import run_jobs
+
+        lines = ['{"prompt": "a", "deadline": "soon"}\n', '{"prompt": "b", "seed": 2}\n']
+        out = io.StringIO()
+        with JimengAPIClient(api_key="test") as client, \
+                patch.object(client, "generate", side_effect=_fake_generate):
+            stats = run_jobs(client, lines, out)
+
+        records = {r["line"]: r for r in map(json.loads, out.getvalue().splitlines())}
+        self.assertEqual(stats, {"total": 2, "succeeded": 1, "failed": 1})
+        self.assertIn("deadline", records[1]["error"])
+        self.assertTrue(records[2]["success"])
+
+    def test_results_stream_before_input_ends(self):
+        """读到一行即开始执行，结果不必等全部任务读取完毕（适用于 --jobs -）"""
+        import threading
+        from app.jimeng_api import JimengAPIClient
+        from app.jobs import run_jobs
+
+        first_result = threading.Event()
+
+        class Out(io.StringIO):
+            def write(self, text):
+                first_result.set()
+                return super().write(text)
+
+        def lines():
+            yield '{"prompt": "a", "seed": 1}\n'
+            # 输入方等到第一个结果输出后才写入下一行
+            self.assertTrue(first_result.wait(5))
+            yield '{"prompt": "b", "seed": 2}\n'
+
+        out = Out()
+        with JimengAPIClient(api_key="test") as client, \
+                patch.object(client, "generate", side_effect=_fake_generate):
+            stats = run_jobs(client, lines(), out)
+
+        self.assertEqual(stats, {"total": 2, "succeeded": 2, "failed": 0})
+
+    def test_run_jobs_through_pipeline(self):
+        """指定流水线时按阶段执行"""
+        from unittest.mock import MagicMock
+        from app.jimeng_api import JimengAPIClient
+        from app.jobs import run_jobs
+        from app.pipeline import GenerationPipeline
+
+        response = MagicMock(status_code=200)
+        response.json.return_value = {"data": [{"url": "https://cdn/a.jpg"}]}
+        out = io.StringIO()
+        with JimengAPIClient(api_key="test") as client, \
+                patch.object(client, "_post_generation", return_value=response), \
+                patch.object(client, "_download_image", return_value="/tmp/a.jpg"):
+            with GenerationPipeline(client) as pipeline:
+                stats = run_jobs(client, ['{"prompt": "a"}\n', '{"prompt": "b"}\n'], out, pipeline=pipeline)
+
+        self.assertEqual(stats["succeeded"], 2)
+        self.assertEqual(pipeline.stats()["download"]["processed"], 2)
+
+
+class TestCLIJobs(unittest.TestCase):
+    """CLI --jobs 模式测试"""
+
+    def test_jobs_file_to_results_file(self):
+        """从文件读取任务，结果写入文件，有失败任务时退出码为 1"""
+        from app import cli
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            jobs_file = os.path.join(temp_dir, "jobs.jsonl")
+            results_file = os.path.join(temp_dir, "results.jsonl")
+            with open(jobs_file, "w", encoding="utf-8") as f:
+                f.write('{"prompt": "ok", "seed": 3}\n{"prompt": "fail"}\n')
+
+            argv = ["jimeng-selfie", "--jobs", jobs_file, "--results", results_file,
+                    "-j", "2", "-o", temp_dir]
+            with patch.object(sys, "argv", argv), \
+                    patch("app.jimeng_api.JimengAPIClient.generate", side_effect=_fake_generate), \
+                    patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                with self.assertRaises(SystemExit) as ctx:
+                    cli.main()
+
+            self.assertEqual(ctx.exception.code, 1)
+            self.assertIn("成功 1 个，失败 1 个", stderr.getvalue())
+            with open(results_file, encoding="utf-8") as f:
+                records = [json.loads(line) for line in f]
+            self.assertEqual(sorted(r["success"] for r in records), [False, True])
+
+    def test_jobs_from_stdin(self):
+        """- 表示从标准输入读取任务"""
+        from app import cli
+
+        stdin = io.StringIO('{"prompt": "ok"}\n')
+        with patch.object(sys, "argv", ["jimeng-selfie", "--jobs", "-"]), \
+                patch("app.jimeng_api.JimengAPIClient.generate", side_effect=_fake_generate), \
+                patch("sys.stdin", stdin), \
+                patch("sys.stdout", new_callable=io.StringIO) as stdout, \
+                patch("sys.stderr", new_callable=io.StringIO):
+            with self.assertRaises(SystemExit) as ctx:
+                cli.main()
+
+        self.assertEqual(ctx.exception.code, 0)
+        self.assertTrue(json.loads(stdout.getvalue())["success"])
+
+    def test_ignored_option_combinations_rejected(self):
+        """--queue、--server、--jobs 与 --character 模式下不生效的选项报错退出"""
+        from app import cli
+
+        cases = [
+            (["--jobs", "-", "--queue", "--pipeline"], "--pipeline"),
+            (["--jobs", "-", "--queue", "q.db", "--renditions", "--dedup"], "--renditions, --dedup"),
+            (["--prompt", "girl", "--server", "-o", "out"], "--output"),
+            (["--prompt", "girl", "--server", "unix:/tmp/s", "--dedup"], "--dedup"),
+            (["--jobs", "-", "--server"], "--server"),
+            (["--character", "西娅", "--scene", "cafe_alone", "--renditions", "--dedup", "--server"],
+             "--renditions, --dedup, --server"),
+        ]
+        for options, message in cases:
+            with self.subTest(options=options), \
+                    patch.object(sys, "argv", ["jimeng-selfie", *options]), \
+                    patch("sys.stdout", new_callable=io.StringIO), \
+                    patch("sys.stderr", new_callable=io.StringIO) as stderr:
+                with self.assertRaises(SystemExit) as ctx:
+                    cli.main()
+                self.assertEqual(ctx.exception.code, 2)
+                self.assertIn(f"不支持 {message}", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+"""
+图片清单测试
+测试覆盖：记录与查询、索引使用、客户端写入、旧文件导入、CLI 子命令
+"""
+import io
+import os
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _result(prompt, paths, seed=1):
+    return {
+        "success": True, "prompt": prompt, "seed": seed, "cached": False,
+        "images": [{"url": f"https://cdn/{i}.jpg", "local_path": p, "seed": seed, "size": "1024x1024"}
+                   for i, p in enumerate(paths)],
+    }
+
+
+class TestManifest(unittest.TestCase):
+    """清单读写测试"""
+
+    def setUp(self):
+        from app.manifest import Manifest
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.manifest = Manifest(os.path.join(self.temp_dir.name, "manifest.sqlite3"))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _path(self, name):
+        return os.path.join(self.temp_dir.name, name)
+
+    def test_record_and_query(self):
+        """按风格、平台、种子、提示词与时间组合查询"""
+        m = self.manifest
+        self.assertEqual(m.record(_result("cafe girl", [self._path("a.jpg"), self._path("b.jpg")], seed=5),
+                                  model="seedream", prefix="batch",
+                                  metadata={"style": "咖啡厅自拍", "platform": "x", "job": "j1"}), 2)
+        m.record(_result("beach girl", [self._path("c.jpg")], seed=6),
+                 metadata={"style": "海边自拍", "platform": "x"})
+        m.record(_result("cafe girl", [self._path("d.jpg")], seed=7),
+                 metadata={"style": "咖啡厅自拍", "platform": "private"})
+
+        rows = m.query(style="咖啡厅自拍", platform="x")
+        self.assertEqual(sorted(r["path"] for r in rows), [self._path("a.jpg"), self._path("b.jpg")])
+        self.assertEqual(rows[0]["metadata"], {"job": "j1"})
+        self.assertEqual(rows[0]["model"], "seedream")
+        self.assertEqual(rows[0]["size"], "1024x1024")
+
+        self.assertEqual(m.count(prompt=" cafe girl "), 3)
+        self.assertEqual([r["path"] for r in m.query(seed=6)], [self._path("c.jpg")])
+        self.assertEqual(m.count(platform="x", since=time.time() - 60), 3)
+        self.assertEqual(m.count(until=time.time() - 60), 0)
+        self.assertEqual(len(m.query(limit=2)), 2)
+        self.assertEqual([r["seed"] for r in m.query(order_by="seed", descending=False)], [5, 5, 6, 7])
+        with self.assertRaises(ValueError):
+            m.query(order_by="path; DROP TABLE images")
+
+    def test_queries_use_indexes(self):
+        """常用查询走索引而不是全表扫描"""
+        import sqlite3
+
+        conn = sqlite3.connect(self.manifest.db_path)
+        try:
+            for where in ("style = 'a' AND platform = 'x' AND created_at >= 0", "seed = 1",
+                          "prompt_hash = 'h'", "created_at >= 0", "platform = 'x'"):
+                plan = " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN SELECT * FROM images WHERE {where}"))
+                self.assertIn("USING INDEX", plan, where)
+        finally:
+            conn.close()
+
+    def test_get_remove_prune(self):
+        """重复记录覆盖，删除与清理失效记录"""
+        existing = self._path("keep.jpg")
+        Path(existing).touch()
+        self.manifest.record(_result("p", [existing, self._path("gone.jpg")]))
+        self.manifest.record(_result("p2", [existing]), metadata={"style": "s"})
+
+        self.assertEqual(self.manifest.get(existing)["prompt"], "p2")
+        self.assertEqual(self.manifest.prune(), 1)
+        self.assertEqual(self.manifest.count(), 1)
+        self.assertTrue(self.manifest.remove(existing))
+        self.assertIsNone(self.manifest.get(existing))
+
+    def test_import_files(self):
+        """从旧文件名导入前缀、种子与时间"""
+        for name in ("selfie_咖啡厅自拍_123_1700000000.jpg", "cli_gen_1700000001_2.jpg", "notes.txt"):
+            Path(self._path(name)).touch()
+
+        self.assertEqual(self.manifest.import_files(self.temp_dir.name), 2)
+        self.assertEqual(self.manifest.import_files(self.temp_dir.name), 0)
+        row = self.manifest.get(self._path("selfie_咖啡厅自拍_123_1700000000.jpg"))
+        self.assertEqual((row["prefix"], row["seed"], row["created_at"]), ("selfie_咖啡厅自拍", 123, 1700000000))
+        self.assertEqual(self.manifest.get(self._path("cli_gen_1700000001_2.jpg"))["prefix"], "cli_gen")
+
+
+class TestClientManifest(unittest.TestCase):
+    """客户端写入清单测试"""
+
+    def test_generate_records_saved_images(self):
+        """generate() 保存图片后写入清单，附加信息随图片记录"""
+        from app.jimeng_api import JimengAPIClient
+        from app.manifest import Manifest
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            manifest = Manifest(os.path.join(temp_dir, "m.sqlite3"))
+            response = MagicMock(status_code=200)
+            response.json.return_value = {"data": [{"url": "https://cdn/a.jpg", "size": "2048x2048"}]}
+            with JimengAPIClient(api_key="test", manifest=manifest) as client, \
+                    patch.object(client, "_post_generation", return_value=response), \
+                    patch.object(client, "_download_image", return_value=os.path.join(temp_dir, "a.jpg")):
+                client.generate("a girl", seed=9, metadata={"style": "海边自拍", "platform": "xiaohongshu"})
+                client.generate("not saved", save_to_file=False)
+
+            rows = manifest.query()
+            self.assertEqual(len(rows), 1)
+            self.assertEqual(rows[0]["style"], "海边自拍")
+            self.assertEqual(rows[0]["platform"], "xiaohongshu")
+            self.assertEqual(rows[0]["seed"], 9)
+            self.assertEqual(rows[0]["model"], client.model)
+
+    def test_generate_stream_records_saved_images(self):
+        """generate_stream() 保存图片后同样写入清单"""
+        from app.jimeng_api import JimengAPIClient
+        from app.manifest import Manifest
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            manifest = Manifest(os.path.join(temp_dir, "m.sqlite3"))
+            response = MagicMock(status_code=200)
+            response.iter_lines.return_value = [
+                'data: {"type": "image_generation.partial_succeeded", "url": "https://cdn/a.jpg", "size": "2048x2048"}',
+                "",
+                "data: [DONE]",
+            ]
+            with JimengAPIClient(api_key="test", manifest=manifest) as client, \
+                    patch.object(client, "_post_generation", return_value=response), \
+                    patch.object(client, "_download_image", return_value=os.path.join(temp_dir, "a.jpg")):
+                result = client.generate_stream("a girl", seed=9, metadata={"style": "海边自拍", "platform": "x"})
+
+            self.assertTrue(result["success"], result["error"])
+            rows = manifest.query()
+            self.assertEqual(len(rows), 1)
+            self.assertEqual((rows[0]["path"], rows[0]["style"], rows[0]["seed"]),
+                             (os.path.join(temp_dir, "a.jpg"), "海边自拍", 9))
+
+    def test_parse_job_carries_style(self):
+        """批量任务的风格与平台写入 metadata"""
+        from app.jobs import parse_job
+        from app.strategy import SelfieStrategy
+
+        job, style = parse_job({"prompt": "女孩", "style": "街拍风格", "platform": "x"}, SelfieStrategy())
+        self.assertEqual(job["metadata"], {"style": "街拍风格", "platform": "x"})
+
+
+class TestManifestCLI(unittest.TestCase):
+    """manifest 子命令测试"""
+
+    def test_query_subcommand(self):
+        """按条件输出匹配的图片路径"""
+        from app import cli
+        from app.manifest import Manifest
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            db = os.path.join(temp_dir, "m.sqlite3")
+            manifest = Manifest(db)
+            manifest.record(_result("a", ["/data/a.jpg"]), metadata={"style": "咖啡厅自拍", "platform": "x"})
+            manifest.record(_result("b", ["/data/b.jpg"]), metadata={"style": "海边自拍", "platform": "x"})
+
+            argv = ["jimeng-selfie", "manifest", "--db", db, "--style", "咖啡厅自拍", "--since", "7d"]
+            with patch.object(sys, "argv", argv), patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                cli.main()
+            self.assertIn("/data/a.jpg", stdout.getvalue())
+            self.assertNotIn("/data/b.jpg", stdout.getvalue())
+
+            argv = ["jimeng-selfie", "manifest", "--db", db, "--platform", "x", "--count"]
+            with patch.object(sys, "argv", argv), patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                cli.main()
+            self.assertEqual(stdout.getvalue().strip(), "2")
+
+    def test_parse_time(self):
+        """相对时长与日期"""
+        from app.cli import _parse_time
+        from datetime import datetime
+
+        self.assertAlmostEqual(_parse_time("2h"), time.time() - 7200, delta=5)
+        self.assertEqual(_parse_time("2024-01-31"), datetime(2024, 1, 31).timestamp())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,169 @@
+"""
+分阶段流水线测试
+测试覆盖：阶段衔接、下载不阻塞生成、背压、后处理、阶段指标
+"""
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _ok_response(payload, **kwargs):
+    """按请求体返回 n 张图片地址的响应"""
+    response = MagicMock(status_code=200)
+    response.json.return_value = {
+        "data": [{"url": f"https://cdn/{payload['seed']}_{i}.jpg"} for i in range(payload.get("n", 1))]
+    }
+    return response
+
+
+class TestGenerationPipeline(unittest.TestCase):
+    """流水线测试"""
+
+    def setUp(self):
+        from app.jimeng_api import JimengAPIClient
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.client = JimengAPIClient(api_key="test")
+        self.client.output_dir = self.temp_dir.name
+
+    def tearDown(self):
+        self.client.close()
+        self.temp_dir.cleanup()
+
+    def test_results_match_generate(self):
+        """流水线结果与 generate() 格式一致"""
+        from app.pipeline import GenerationPipeline
+
+        def fake_download(url, prefix, seed=None, index=None, deadline=None):
+            return f"{self.temp_dir.name}/{prefix}_{seed}_{index}.jpg"
+
+        jobs = [{"prompt": f"p{i}", "seed": 10 + i, "n": 2} for i in range(5)]
+        with patch.object(self.client, "_post_generation", side_effect=_ok_response), \
+                patch.object(self.client, "_download_image", side_effect=fake_download):
+            with GenerationPipeline(self.client, 2, 3, 1) as pipeline:
+                results = dict(pipeline.run(jobs))
+
+        self.assertEqual(sorted(results), list(range(5)))
+        for index, result in results.items():
+            self.assertTrue(result["success"])
+            self.assertEqual(result["seed"], 10 + index)
+            self.assertEqual(len(result["images"]), 2)
+            self.assertEqual(result["local_path"], result["images"][0]["local_path"])
+            self.assertTrue(result["local_path"].endswith(f"_{10 + index}_0.jpg"))
+
+    def test_staged_client_api(self):
+        """request() 只调用生成接口，download() 保存图片；失败写入错误信息且不抛出异常"""
+        def fake_download(url, prefix, seed=None, index=None, deadline=None):
+            return f"{self.temp_dir.name}/{prefix}_{seed}.jpg"
+
+        with patch.object(self.client, "_post_generation", side_effect=_ok_response), \
+                patch.object(self.client, "_download_image", side_effect=fake_download) as download:
+            result, pending = self.client.request("p", seed=3, filename_prefix="staged")
+            download.assert_not_called()
+            self.assertTrue(result["success"])
+            self.assertIsNone(result["local_path"])
+
+            self.assertTrue(self.client.download(result, pending))
+            self.assertEqual(result["local_path"], f"{self.temp_dir.name}/staged_3.jpg")
+
+            download.side_effect = OSError("disk full")
+            result, pending = self.client.request("p", seed=4)
+            self.assertFalse(self.client.download(result, pending))
+            self.assertIn("disk full", result["error"])
+
+        with patch.object(self.client, "_post_generation", side_effect=ConnectionError("down")):
+            result, pending = self.client.request("p")
+        self.assertIsNone(pending)
+        self.assertIn("down", result["error"])
+
+        failed = self.client.failed_result("p", "bad job")
+        self.assertFalse(failed["success"])
+        self.assertEqual(failed["error"], "bad job")
+
+    def test_download_does_not_block_generation(self):
+        """下载阻塞时生成阶段继续处理后续任务"""
+        from app.pipeline import GenerationPipeline
+
+        release = threading.Event()
+
+        def slow_download(url, prefix, seed=None, index=None, deadline=None):
+            release.wait(5)
+            return f"{self.temp_dir.name}/{seed}.jpg"
+
+        with patch.object(self.client, "_post_generation", side_effect=_ok_response), \
+                patch.object(self.client, "_download_image", side_effect=slow_download):
+            pipeline = GenerationPipeline(self.client, generate_workers=1, download_workers=1,
+                                          postprocess_workers=1, queue_size=4)
+            futures = [pipeline.submit({"prompt": str(i), "seed": i + 1}) for i in range(4)]
+
+            # 唯一的下载线程被占用时，生成线程仍然完成了所有请求
+            for _ in range(500):
+                if pipeline.stats()["generate"]["processed"] == 4:
+                    break
+                threading.Event().wait(0.01)
+            stats = pipeline.stats()
+            self.assertEqual(stats["generate"]["processed"], 4)
+            self.assertEqual(stats["download"]["busy"], 1)
+            self.assertEqual(stats["download"]["queue_depth"], 3)
+            self.assertFalse(any(f.done() for f in futures))
+
+            release.set()
+            pipeline.close()
+
+        self.assertTrue(all(f.result()["success"] for f in futures))
+        stats = pipeline.stats()
+        self.assertEqual(stats["download"]["processed"], 4)
+        self.assertEqual(stats["postprocess"]["processed"], 4)
+        self.assertGreater(stats["download"]["throughput"], 0)
+
+    def test_postprocessors_and_errors(self):
+        """后处理函数依次执行，出错不影响生成结果"""
+        from app.pipeline import GenerationPipeline
+
+        def tag(result):
+            result["tagged"] = True
+
+        def broken(result):
+            raise ValueError("bad image")
+
+        with patch.object(self.client, "_post_generation", side_effect=_ok_response), \
+                patch.object(self.client, "_download_image", return_value="/tmp/x.jpg"):
+            with GenerationPipeline(self.client, postprocessors=[tag, broken]) as pipeline:
+                result = pipeline.submit({"prompt": "a", "seed": 1}).result(5)
+
+        self.assertTrue(result["success"])
+        self.assertTrue(result["tagged"])
+        self.assertEqual(result["postprocess_errors"], ["broken: bad image"])
+
+    def test_failures_skip_later_stages(self):
+        """生成失败、参数错误与异常都以错误结果结束"""
+        from app.pipeline import GenerationPipeline
+
+        def flaky(payload, **kwargs):
+            if payload["prompt"] == "boom":
+                raise RuntimeError("exploded")
+            return MagicMock(status_code=400, text="bad request", json=MagicMock(return_value={}))
+
+        with patch.object(self.client, "_post_generation", side_effect=flaky):
+            with GenerationPipeline(self.client) as pipeline:
+                api_error = pipeline.submit({"prompt": "a"}).result(5)
+                raised = pipeline.submit({"prompt": "boom"}).result(5)
+                bad_args = pipeline.submit({"prompt": "a", "unknown": 1}).result(5)
+                bad_deadline = pipeline.submit({"prompt": "a", "deadline": "soon"}).result(5)
+
+        self.assertFalse(api_error["success"])
+        self.assertIn("exploded", raised["error"])
+        self.assertIn("任务参数错误", bad_args["error"])
+        self.assertIn("截止时间", bad_deadline["error"])
+        self.assertEqual(pipeline.stats()["download"]["processed"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+角色档案测试
+测试覆盖：提示词预编译、档案文件合并、参考图绑定、只加载一次、客户端与批量任务集成
+"""
+import os
+import sys
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from PIL import Image
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+class TestProfileLibrary(unittest.TestCase):
+    """角色档案库测试"""
+
+    def setUp(self):
+        from app.profiles import ProfileLibrary
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.profile_dir = os.path.join(self.temp_dir.name, "characters")
+        self.reference_dir = os.path.join(self.temp_dir.name, "refs")
+        os.makedirs(self.profile_dir)
+        os.makedirs(self.reference_dir)
+        self.library = ProfileLibrary(self.profile_dir, self.reference_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write_profile(self, filename, data):
+        Path(self.profile_dir, filename).write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    def test_builtin_prompts_precompiled(self):
+        """内置角色的每个 场景 × 风格 组合都已生成，与 build_full_prompt 结果一致"""
+        from app.profiles import SCENES, scene_fragment
+        from app.config import SELFIE_STYLES, OTHER_STYLES
+
+        profile = self.library.get("西娅")
+        self.assertEqual(len(profile._prompts), len(SCENES) * (1 + len(SELFIE_STYLES) + len(OTHER_STYLES)))
+
+        expected = self.library.strategy.build_full_prompt(
+            profile.appearance, "街拍风格", scene_fragment(SCENES["cafe_alone"]), is_selfie=False
+        )
+        with patch.object(self.library.strategy, "build_full_prompt") as build:
+            self.assertEqual(profile.prompt("cafe_alone", "街拍风格"), expected)
+            plain = profile.prompt("front_view")
+        build.assert_not_called()
+        self.assertIn("场景：纯白色或浅灰色背景", plain)
+        self.assertNotIn("\n", plain)
+
+        with self.assertRaises(ValueError):
+            profile.prompt("moon_base")
+        with self.assertRaises(ValueError):
+            profile.prompt("cafe_alone", "不存在的风格")
+        with self.assertRaises(ValueError):
+            self.library.get("无名")
+
+    def test_profile_files_merge_and_bad_files_skipped(self):
+        """档案文件覆盖场景字段、添加自定义场景；无效档案被跳过"""
+        self._write_profile("lin.json", {
+            "name": "林", "appearance": "一位30岁的男性",
+            "scenes": {"gym": {"clothing": "黑色背心"}, "rooftop": {"description": "城市天台夜景"}},
+        })
+        self._write_profile("broken.json", {"name": "坏档案"})
+        Path(self.profile_dir, "garbage.json").write_text("{", encoding="utf-8")
+
+        with patch("builtins.print"):
+            self.assertEqual(sorted(self.library.names()), ["林", "西娅"])
+        profile = self.library.get("林")
+        self.assertIn("服装：黑色背心", profile.prompt("gym"))
+        self.assertIn("健身房", profile.prompt("gym"))
+        self.assertIn("场景：城市天台夜景", profile.prompt("rooftop", "海边自拍"))
+
+    def test_references_bound_from_index(self):
+        """按文件名通配符绑定参考图，无法解码的文件不使用"""
+        for name in ("西娅_正面.png", "西娅_侧面.png", "其他.png"):
+            Image.new("RGB", (32, 32)).save(os.path.join(self.reference_dir, name))
+        Path(self.reference_dir, "西娅_损坏.jpg").write_bytes(b"not an image")
+        self._write_profile("lin.json", {"name": "林", "appearance": "男性", "references": ["其他.*"]})
+
+        xia = self.library.get("西娅")
+        self.assertEqual([os.path.basename(p) for p in xia.reference_paths], ["西娅_侧面.png", "西娅_正面.png"])
+        self.assertEqual([os.path.basename(p) for p in self.library.get("林").reference_paths], ["其他.png"])
+
+        request = self.library.request("西娅", "beach", "海边自拍", platform="x")
+        self.assertEqual(request["reference_images"], xia.reference_paths)
+        self.assertEqual(request["filename_prefix"], "西娅_beach")
+        self.assertEqual(request["metadata"],
+                         {"character": "西娅", "scene": "beach", "style": "海边自拍", "platform": "x"})
+        self.assertNotIn("reference_images", self.library.request("西娅", "beach", use_references=False))
+
+    def test_loaded_once_until_reload(self):
+        """档案只加载一次，reload() 后读取新档案"""
+        with patch.object(self.library, "_read_profiles", wraps=self.library._read_profiles) as read:
+            self.library.get("西娅")
+            self.library.request("西娅", "park")
+            self.assertNotIn("林", self.library)
+            self.assertEqual(read.call_count, 1)
+
+            self._write_profile("lin.json", {"name": "林", "appearance": "男性"})
+            self.library.reload()
+            self.assertIn("林", self.library)
+            self.assertEqual(read.call_count, 2)
+
+
+class TestCharacterGeneration(unittest.TestCase):
+    """客户端与批量任务集成测试"""
+
+    def setUp(self):
+        from app.profiles import ProfileLibrary
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        Image.new("RGB", (32, 32)).save(os.path.join(self.temp_dir.name, "西娅_基准图.png"))
+        self.library = ProfileLibrary(os.path.join(self.temp_dir.name, "none"), self.temp_dir.name)
+        self.patcher = patch("app.profiles._library", self.library)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        self.temp_dir.cleanup()
+
+    def test_generate_character(self):
+        """generate_character() 使用档案中的提示词与参考图，未知场景返回失败结果"""
+        from app.jimeng_api import JimengAPIClient
+
+        with JimengAPIClient(api_key="test") as client, \
+                patch.object(client, "generate", return_value={"success": True}) as generate:
+            self.assertTrue(client.generate_character("西娅", "cafe_alone", seed=3)["success"])
+            result = client.generate_character("西娅", "moon_base")
+
+        kwargs = generate.call_args.kwargs
+        self.assertEqual(generate.call_count, 1)
+        self.assertEqual(kwargs["prompt"], self.library.get("西娅").prompt("cafe_alone"))
+        self.assertEqual([os.path.basename(p) for p in kwargs["reference_images"]], ["西娅_基准图.png"])
+        self.assertEqual(kwargs["seed"], 3)
+        self.assertFalse(result["success"])
+        self.assertIn("moon_base", result["error"])
+
+    def test_parse_character_job(self):
+        """批量任务可按角色与场景生成，任务中的参考图覆盖档案参考图"""
+        from app.jobs import parse_job, JobError
+        from app.strategy import SelfieStrategy
+
+        job, style = parse_job({"character": "西娅", "scene": "gym", "style": "运动风格", "seed": 5},
+                               SelfieStrategy())
+        self.assertEqual(style, "运动风格")
+        self.assertEqual(job["prompt"], self.library.get("西娅").prompt("gym", "运动风格"))
+        self.assertEqual(job["seed"], 5)
+        self.assertEqual(len(job["reference_images"]), 1)
+
+        job, _ = parse_job({"character": "西娅", "scene": "gym", "references": ["https://r/1.jpg"]},
+                           SelfieStrategy())
+        self.assertEqual(job["reference_images"], ["https://r/1.jpg"])
+
+        with self.assertRaises(JobError):
+            parse_job({"character": "西娅"}, SelfieStrategy())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,245 @@
+"""
+参考图索引测试
+测试覆盖：元数据记录、增量刷新、缩略图缓存、参考图预处理与缓存、ReferenceImageManager 集成
+"""
+import os
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch
+
+from PIL import Image
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _save_image(path, size=(1200, 800), color=(10, 20, 30), fmt="PNG"):
+    Image.new("RGB", size, color).save(path, fmt)
+
+
+class TestReferenceIndex(unittest.TestCase):
+    """参考图索引测试"""
+
+    def setUp(self):
+        from app.references import ReferenceIndex
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.ref_dir = self.temp_dir.name
+        self.index = ReferenceIndex(self.ref_dir, thumbnail_size=64)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_metadata_and_thumbnail(self):
+        """记录尺寸、格式、内容哈希，并生成缩略图"""
+        from app.references import file_sha256
+
+        path = os.path.join(self.ref_dir, "face.png")
+        _save_image(path)
+        Path(self.ref_dir, "notes.txt").write_text("x")
+
+        entries = self.index.entries()
+        self.assertEqual(len(entries), 1)
+        entry = entries[0]
+        self.assertEqual((entry["name"], entry["path"]), ("face.png", path))
+        self.assertEqual((entry["width"], entry["height"], entry["format"]), (1200, 800, "PNG"))
+        self.assertEqual(entry["sha256"], file_sha256(path))
+        with Image.open(entry["thumbnail"]) as thumbnail:
+            self.assertEqual(thumbnail.size, (64, 43))
+
+    def test_refresh_only_reads_changed_files(self):
+        """未变化的文件不重新读取，修改与删除会被发现，重新打开后沿用索引"""
+        from app.references import ReferenceIndex
+
+        a = os.path.join(self.ref_dir, "a.png")
+        b = os.path.join(self.ref_dir, "b.jpg")
+        _save_image(a)
+        _save_image(b, fmt="JPEG")
+        self.assertTrue(self.index.refresh())
+        self.assertFalse(self.index.refresh())
+
+        _save_image(a, size=(100, 100), color=(200, 0, 0))
+        os.utime(a, (time.time() + 5, time.time() + 5))
+        os.remove(b)
+        with patch.object(self.index, "_read", wraps=self.index._read) as read:
+            self.assertTrue(self.index.refresh())
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual([(e["name"], e["width"]) for e in self.index.entries()], [("a.png", 100)])
+        # 旧内容的缩略图被清理
+        self.assertEqual(len(os.listdir(self.index.thumbnail_dir)), 1)
+
+        reopened = ReferenceIndex(self.ref_dir, thumbnail_size=64)
+        with patch("app.references.Image.open") as image_open:
+            self.assertEqual(reopened.get("a.png")["width"], 100)
+        image_open.assert_not_called()
+
+    def test_duplicates_and_undecodable_files(self):
+        """内容相同的文件共用缩略图，无法解码的文件也会列出"""
+        for name in ("x.png", "y.png"):
+            _save_image(os.path.join(self.ref_dir, name))
+        Path(self.ref_dir, "broken.jpg").write_bytes(b"not an image")
+
+        sha = self.index.get("x.png")["sha256"]
+        self.assertEqual([e["name"] for e in self.index.find_by_hash(sha)], ["x.png", "y.png"])
+        self.assertEqual(self.index.thumbnail("x.png"), self.index.thumbnail("y.png"))
+        self.assertIsNone(self.index.get("broken.jpg")["format"])
+        self.assertIsNone(self.index.thumbnail("broken.jpg"))
+
+        # 缩略图被删除后按需重新生成
+        os.remove(self.index.thumbnail("x.png"))
+        self.assertTrue(os.path.exists(self.index.thumbnail("x.png")))
+
+    def test_read_only_reference_dir(self):
+        """参考图目录不可写时索引与缩略图放到缓存目录，缓存目录也不可写时只在内存中保留"""
+        from app.references import ReferenceIndex
+
+        _save_image(os.path.join(self.ref_dir, "face.png"))
+        with tempfile.TemporaryDirectory() as cache_dir, \
+                patch("app.references.os.access", return_value=False):
+            index = ReferenceIndex(self.ref_dir, thumbnail_size=64, cache_dir=cache_dir)
+            entry = index.entries()[0]
+            self.assertTrue(entry["thumbnail"].startswith(cache_dir))
+            self.assertTrue(os.path.exists(index.index_path))
+            self.assertEqual(os.listdir(self.ref_dir), ["face.png"])
+
+            unwritable = ReferenceIndex(self.ref_dir, thumbnail_size=64, cache_dir=os.path.join(cache_dir, "ro"))
+            error = OSError(30, "Read-only file system")
+            with patch("app.references.atomic_write_chunks", side_effect=error), \
+                    patch("sys.stdout") as stdout:
+                self.assertEqual([e["name"] for e in unwritable.entries()], ["face.png"])
+                self.assertEqual((unwritable.get("face.png")["width"], unwritable.thumbnail("face.png")), (1200, None))
+                unwritable.add(os.path.join(self.ref_dir, "face.png"))
+            self.assertEqual(sum("[WARN]" in str(call) for call in stdout.write.call_args_list), 1)
+
+
+class TestReferencePreparer(unittest.TestCase):
+    """参考图预处理测试"""
+
+    def setUp(self):
+        from app.references import ReferencePreparer
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.temp_dir.name, "cache")
+        self.preparer = ReferencePreparer(max_side=256, quality=80, cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _decode(self, uri):
+        import io
+        import base64
+
+        header, data = uri.split(",", 1)
+        return header, Image.open(io.BytesIO(base64.b64decode(data)))
+
+    def test_large_image_downscaled_to_jpeg(self):
+        """大图缩小到最长边并编码为 JPEG，URL 原样返回"""
+        path = os.path.join(self.temp_dir.name, "big.png")
+        _save_image(path, size=(1200, 800))
+
+        uri, url = self.preparer.prepare_all([path, "https://cdn/ref.jpg"])
+        header, image = self._decode(uri)
+        self.assertEqual(header, "data:image/jpeg;base64")
+        self.assertEqual((image.format, image.size), ("JPEG", (256, 171)))
+        self.assertEqual(url, "https://cdn/ref.jpg")
+        self.assertEqual(self.preparer.prepare("data:image/png;base64,AAAA"), "data:image/png;base64,AAAA")
+
+    def test_alpha_kept_and_small_jpeg_passthrough(self):
+        """透明图编码为 PNG，已满足要求的小 JPEG 直接使用原文件"""
+        import base64
+
+        alpha = os.path.join(self.temp_dir.name, "alpha.png")
+        Image.new("RGBA", (400, 100), (255, 0, 0, 128)).save(alpha)
+        header, image = self._decode(self.preparer.prepare(alpha))
+        self.assertEqual((header, image.mode, image.size), ("data:image/png;base64", "RGBA", (256, 64)))
+
+        small = os.path.join(self.temp_dir.name, "small.jpg")
+        Image.effect_noise((100, 80), 64).convert("RGB").save(small, "JPEG", quality=40, optimize=True)
+        uri = self.preparer.prepare(small)
+        self.assertEqual(base64.b64decode(uri.split(",", 1)[1]), Path(small).read_bytes())
+
+    def test_metadata_never_passed_through(self):
+        """带 EXIF（含 GPS）的小 JPEG 重新编码，发出的数据不含元数据"""
+        import base64
+
+        exif = Image.Exif()
+        exif[0x010F] = "PhoneCam"
+        exif[0x8825] = {1: "N", 2: (35.0, 41.0, 22.0)}
+        tagged = os.path.join(self.temp_dir.name, "tagged.jpg")
+        Image.effect_noise((100, 80), 64).convert("RGB").save(
+            tagged, "JPEG", quality=40, optimize=True, exif=exif
+        )
+
+        uri = self.preparer.prepare(tagged)
+        data = base64.b64decode(uri.split(",", 1)[1])
+        self.assertNotEqual(data, Path(tagged).read_bytes())
+        self.assertNotIn(b"PhoneCam", data)
+        _, image = self._decode(uri)
+        self.assertEqual(len(image.getexif()), 0)
+        self.assertEqual(image.size, (100, 80))
+
+    def test_cached_by_content(self):
+        """重复使用不再解码；新实例从磁盘缓存读取；内容变化后重新处理"""
+        from app.references import ReferencePreparer, file_sha256
+
+        path = os.path.join(self.temp_dir.name, "face.png")
+        _save_image(path)
+        first = self.preparer.prepare(path)
+
+        with patch("app.references.Image.open") as image_open, \
+                patch("app.references.file_sha256", wraps=file_sha256) as sha:
+            self.assertEqual(self.preparer.prepare(path), first)
+            sha.assert_not_called()
+            fresh = ReferencePreparer(max_side=256, quality=80, cache_dir=self.cache_dir)
+            self.assertEqual(fresh.prepare(path), first)
+        image_open.assert_not_called()
+        self.assertEqual(self.preparer.stats()["memory_hits"], 1)
+        self.assertEqual(fresh.stats()["disk_hits"], 1)
+
+        _save_image(path, color=(200, 0, 0))
+        os.utime(path, (time.time() + 5, time.time() + 5))
+        self.assertNotEqual(self.preparer.prepare(path), first)
+        self.assertEqual(self.preparer.stats()["prepared"], 2)
+
+    def test_payload_uses_prepared_references(self):
+        """客户端请求体中的本地参考图被替换为 data URI"""
+        from app.jimeng_api import JimengAPIClient
+
+        path = os.path.join(self.temp_dir.name, "face.png")
+        _save_image(path)
+        with JimengAPIClient(api_key="test") as client:
+            client.reference_preparer = self.preparer
+            payload = client._build_payload("a girl", "2K", False, [path, "https://cdn/ref.jpg"])
+        self.assertTrue(payload["image"][0].startswith("data:image/jpeg;base64,"))
+        self.assertEqual(payload["image"][1], "https://cdn/ref.jpg")
+
+
+class TestReferenceImageManager(unittest.TestCase):
+    """参考图管理器集成测试"""
+
+    def test_add_reference_updates_index(self):
+        """添加参考图后立即出现在列表中，并带有缩略图"""
+        from app.strategy import ReferenceImageManager
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            source = os.path.join(temp_dir, "source.png")
+            _save_image(source)
+            manager = ReferenceImageManager(os.path.join(temp_dir, "refs"))
+
+            target = manager.add_reference(source, name="hero")
+            self.assertTrue(target.endswith("hero.png"))
+            with patch.object(manager.index, "_read") as read:
+                self.assertEqual(manager.list_references(), [target])
+            read.assert_not_called()
+
+            info = manager.list_reference_info()[0]
+            self.assertEqual((info["width"], info["height"]), (1200, 800))
+            self.assertTrue(os.path.exists(manager.get_thumbnail(target)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,156 @@
+"""
+平台发布版本测试
+测试覆盖：比例裁剪、尺寸上限、输出格式、EXIF 去除与方向校正、进程池后处理
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+
+from PIL import Image
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+# EXIF 标签: 方向 / 相机型号
+ORIENTATION = 0x0112
+MODEL = 0x0110
+
+
+def _make_image(path: str, size=(2000, 1000), orientation=None):
+    """生成带 EXIF 的测试图片"""
+    image = Image.new("RGB", size, (200, 120, 40))
+    exif = Image.Exif()
+    exif[MODEL] = "TestCam"
+    if orientation:
+        exif[ORIENTATION] = orientation
+    image.save(path, "JPEG", exif=exif.tobytes())
+
+
+class TestRender(unittest.TestCase):
+    """单个版本生成测试"""
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.temp_dir.name, "source.jpg")
+        _make_image(self.source)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_crop_resize_and_strip_exif(self):
+        """按平台比例居中裁剪并限制尺寸，输出不含 EXIF"""
+        from app.renditions import RenditionSpec, render
+
+        target = os.path.join(self.temp_dir.name, "out", "x.jpg")
+        info = render(self.source, RenditionSpec.for_platform("x"), target)
+
+        with Image.open(target) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.size, (800, 1000))
+            self.assertEqual(len(image.getexif()), 0)
+        self.assertEqual((info["width"], info["height"]), (800, 1000))
+        self.assertEqual(info["bytes"], os.path.getsize(target))
+
+    def test_keep_aspect_and_webp(self):
+        """未指定比例时保持原比例，按最大尺寸缩小"""
+        from app.renditions import RenditionSpec, render
+
+        target = os.path.join(self.temp_dir.name, "private.webp")
+        render(self.source, RenditionSpec.for_platform("private"), target)
+
+        with Image.open(target) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, (1280, 640))
+
+    def test_exif_orientation_applied(self):
+        """EXIF 方向先应用到像素上再裁剪"""
+        from app.renditions import RenditionSpec, render
+
+        rotated = os.path.join(self.temp_dir.name, "rotated.jpg")
+        _make_image(rotated, size=(1000, 800), orientation=6)  # 需顺时针旋转 90 度
+        target = os.path.join(self.temp_dir.name, "rotated_out.png")
+        render(rotated, RenditionSpec("test", format="png"), target)
+
+        with Image.open(target) as image:
+            self.assertEqual(image.size, (800, 1000))
+            self.assertNotIn("exif", image.info)
+
+    def test_unknown_format(self):
+        """不支持的格式报错"""
+        from app.renditions import RenditionSpec
+
+        with self.assertRaises(ValueError):
+            RenditionSpec("x", format="gif")
+
+
+class TestRenditionProcessor(unittest.TestCase):
+    """进程池后处理测试"""
+
+    def test_process_result(self):
+        """为结果中的每张图片生成所有平台版本"""
+        from app.renditions import RenditionProcessor
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = [os.path.join(temp_dir, f"img_{i}.jpg") for i in range(2)]
+            for path in paths:
+                _make_image(path, size=(600, 900))
+            result = {
+                "success": True,
+                "images": [{"local_path": paths[0]}, {"local_path": paths[1]}, {"url": "https://cdn/x.jpg"}],
+            }
+
+            with RenditionProcessor(["x", "xiaohongshu"], max_workers=2) as processor:
+                processor(result)
+
+            self.assertEqual(sorted(result["renditions"]), ["x", "xiaohongshu"])
+            self.assertEqual(result["renditions"]["x"], [
+                os.path.join(temp_dir, "renditions", "x", "img_0.jpg"),
+                os.path.join(temp_dir, "renditions", "x", "img_1.jpg"),
+            ])
+            for path in result["renditions"]["xiaohongshu"]:
+                with Image.open(path) as image:
+                    self.assertEqual(image.size, (600, 800))
+            self.assertEqual(len(result["images"][0]["renditions"]), 2)
+            self.assertNotIn("renditions", result["images"][2])
+
+    def test_no_saved_images(self):
+        """没有本地图片时不启动进程池"""
+        from app.renditions import RenditionProcessor
+
+        processor = RenditionProcessor(["x"])
+        result = {"success": False, "images": []}
+        processor.process(result)
+        self.assertNotIn("renditions", result)
+        self.assertIsNone(processor._executor)
+
+
+class TestCLIRenditions(unittest.TestCase):
+    """直接生成模式的平台版本测试"""
+
+    def test_corrupt_image_reported(self):
+        """图片无法解码时报告失败，不中断 CLI"""
+        import io
+        from unittest.mock import patch
+        from app import cli
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "broken.jpg")
+            Path(path).write_bytes(b"not an image")
+            result = {"success": True, "url": "https://cdn/a.jpg", "local_path": path,
+                      "images": [{"url": "https://cdn/a.jpg", "local_path": path}]}
+
+            argv = ["jimeng-selfie", "--prompt", "a cat", "--renditions", "--platform", "x"]
+            with patch.object(sys, "argv", argv), \
+                    patch("app.jimeng_api.JimengAPIClient.generate", return_value=result), \
+                    patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                cli.main()
+
+        self.assertIn("[+] 成功", stdout.getvalue())
+        self.assertIn("x 版本生成失败", stdout.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
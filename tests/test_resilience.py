@@ -0,0 +1,465 @@
+"""
+请求容错测试
+测试覆盖：重试策略、令牌桶限流、熔断器、超时与截止时间
+"""
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+import requests
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+def _response(status_code: int, headers: dict = None) -> MagicMock:
+    """构造模拟响应"""
+    response = MagicMock()
+    response.status_code = status_code
+    response.headers = headers or {}
+    return response
+
+
+class TestRetryPolicy(unittest.TestCase):
+    """重试策略测试"""
+
+    def setUp(self):
+        self.sleeps = []
+
+    def _policy(self, **kwargs):
+        from app.retry import RetryPolicy
+        kwargs.setdefault("base_delay", 1.0)
+        kwargs.setdefault("max_delay", 10.0)
+        kwargs.setdefault("max_total_time", 100.0)
+        return RetryPolicy(sleep=self.sleeps.append, **kwargs)
+
+    def test_retries_retryable_status(self):
+        """测试 5xx 响应重试后成功"""
+        responses = [_response(503), _response(502), _response(200)]
+        policy = self._policy(max_attempts=3)
+
+        result = policy.call(lambda: responses.pop(0))
+
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_non_retryable_status_returns_immediately(self):
+        """测试 4xx 响应不重试"""
+        calls = []
+        policy = self._policy(max_attempts=5)
+
+        result = policy.call(lambda: calls.append(1) or _response(401))
+
+        self.assertEqual(result.status_code, 401)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.sleeps, [])
+
+    def test_retry_after_is_honored(self):
+        """测试等待时长不少于 Retry-After"""
+        responses = [_response(429, {"Retry-After": "7"}), _response(200)]
+        policy = self._policy(max_attempts=3)
+
+        policy.call(lambda: responses.pop(0))
+
+        self.assertGreaterEqual(self.sleeps[0], 7)
+
+    def test_exponential_backoff_ceiling(self):
+        """测试退避上限按指数增长且不超过 max_delay"""
+        policy = self._policy(base_delay=1.0, max_delay=5.0)
+
+        for retry_number, ceiling in [(1, 1.0), (2, 2.0), (3, 4.0), (6, 5.0)]:
+            for _ in range(20):
+                self.assertLessEqual(policy.compute_delay(retry_number), ceiling)
+
+    def test_exhausted_retries_raise_last_error(self):
+        """测试重试耗尽后抛出最后一次异常"""
+        policy = self._policy(max_attempts=3)
+
+        def fail():
+            raise requests.exceptions.ConnectionError("refused")
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            policy.call(fail)
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_total_time_cap(self):
+        """测试等待会超出总时长上限时放弃重试"""
+        responses = [_response(429, {"Retry-After": "60"}), _response(200)]
+        policy = self._policy(max_attempts=5, max_total_time=10.0)
+
+        result = policy.call(lambda: responses.pop(0))
+
+        self.assertEqual(result.status_code, 429)
+        self.assertEqual(self.sleeps, [])
+
+    def test_parse_retry_after_http_date(self):
+        """测试解析 HTTP 日期格式的 Retry-After"""
+        from app.retry import parse_retry_after
+
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertIsNone(parse_retry_after("soon"))
+
+    def test_generate_keeps_seed_across_retries(self):
+        """测试重试使用相同的请求体（种子不变）"""
+        from app.jimeng_api import JimengAPIClient
+
+        success = _response(200)
+        success.json.return_value = {"data": [{"url": "https://example.com/a.jpg"}]}
+        responses = [_response(500), success]
+
+        client = JimengAPIClient(api_key="test", retry_policy=self._policy(max_attempts=3))
+        with patch("app.jimeng_api.requests.Session.post", side_effect=lambda *a, **kw: responses.pop(0)) as mock_post:
+            result = client.generate("test prompt", save_to_file=False)
+
+        self.assertTrue(result["success"], result["error"])
+        seeds = [call[1]["json"]["seed"] for call in mock_post.call_args_list]
+        self.assertEqual(len(seeds), 2)
+        self.assertEqual(seeds[0], seeds[1])
+
+
+class FakeClock:
+    """可手动推进的时钟"""
+
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.now += seconds
+
+
+class TestTokenBucket(unittest.TestCase):
+    """令牌桶限流测试"""
+
+    def test_burst_then_wait(self):
+        """测试突发额度用完后需要等待"""
+        from app.ratelimit import TokenBucket
+
+        clock = FakeClock()
+        bucket = TokenBucket(rate=2, burst=3, clock=clock, sleep=clock.sleep)
+
+        for _ in range(3):
+            self.assertEqual(bucket.try_acquire(), 0)
+        self.assertAlmostEqual(bucket.try_acquire(), 0.5)
+
+        clock.sleep(0.5)
+        self.assertEqual(bucket.try_acquire(), 0)
+
+    def test_acquire_blocks_until_refilled(self):
+        """测试 acquire 等待令牌补充"""
+        from app.ratelimit import TokenBucket
+
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, burst=1, clock=clock, sleep=clock.sleep)
+
+        start = clock.now
+        for _ in range(4):
+            self.assertTrue(bucket.acquire())
+        self.assertAlmostEqual(clock.now - start, 3.0)
+
+    def test_acquire_timeout(self):
+        """测试等待超时返回 False"""
+        from app.ratelimit import TokenBucket
+
+        bucket = TokenBucket(rate=0.01, burst=1)
+        self.assertTrue(bucket.acquire(timeout=0))
+        self.assertFalse(bucket.acquire(timeout=0.01))
+
+    def test_state_shared_through_file(self):
+        """测试使用同一状态文件的限流器共享配额"""
+        from app.ratelimit import TokenBucket, fcntl
+
+        if fcntl is None:
+            self.skipTest("当前平台不支持文件锁")
+
+        clock = FakeClock()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            state_file = os.path.join(temp_dir, "bucket.json")
+            first = TokenBucket(rate=1, burst=2, state_file=state_file, clock=clock)
+            second = TokenBucket(rate=1, burst=2, state_file=state_file, clock=clock)
+
+            self.assertEqual(first.try_acquire(), 0)
+            self.assertEqual(second.try_acquire(), 0)
+            self.assertGreater(first.try_acquire(), 0)
+            self.assertGreater(second.try_acquire(), 0)
+
+    def test_threads_never_exceed_burst(self):
+        """测试多线程并发取令牌不会超发"""
+        from app.ratelimit import TokenBucket
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            bucket = TokenBucket(rate=0.001, burst=5, state_file=os.path.join(temp_dir, "b.json"))
+            granted = []
+
+            def worker():
+                for _ in range(5):
+                    if bucket.try_acquire() == 0:
+                        granted.append(1)
+
+            threads = [threading.Thread(target=worker) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(len(granted), 5)
+
+    def test_client_acquires_before_each_attempt(self):
+        """测试客户端每次生成请求前取得令牌"""
+        from app.jimeng_api import JimengAPIClient
+
+        limiter = MagicMock()
+        success = _response(200)
+        success.json.return_value = {"data": [{"url": "https://example.com/a.jpg"}]}
+        responses = [_response(503), success]
+
+        client = JimengAPIClient(
+            api_key="test",
+            retry_policy=self._retry_policy(),
+            rate_limiter=limiter
+        )
+        with patch("app.jimeng_api.requests.Session.post", side_effect=lambda *a, **kw: responses.pop(0)):
+            result = client.generate("test prompt", save_to_file=False)
+
+        self.assertTrue(result["success"])
+        self.assertEqual(limiter.acquire.call_count, 2)
+
+    @staticmethod
+    def _retry_policy():
+        from app.retry import RetryPolicy
+        return RetryPolicy(max_attempts=3, sleep=lambda s: None)
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    """熔断器测试"""
+
+    def _breaker(self, clock, **kwargs):
+        from app.breaker import CircuitBreaker
+        kwargs.setdefault("failure_threshold", 3)
+        kwargs.setdefault("recovery_timeout", 10)
+        return CircuitBreaker(clock=clock, **kwargs)
+
+    def test_opens_after_consecutive_failures(self):
+        """测试连续失败达到阈值后快速失败"""
+        from app.breaker import CircuitOpenError, OPEN
+
+        clock = FakeClock()
+        breaker = self._breaker(clock)
+        for _ in range(3):
+            breaker.before_request()
+            breaker.record_failure()
+
+        self.assertEqual(breaker.state, OPEN)
+        with self.assertRaises(CircuitOpenError) as ctx:
+            breaker.before_request()
+        self.assertAlmostEqual(ctx.exception.retry_in, 10)
+        self.assertEqual(breaker.stats()["rejected_count"], 1)
+
+    def test_success_resets_failure_count(self):
+        """测试成功会清零连续失败计数"""
+        from app.breaker import CLOSED
+
+        breaker = self._breaker(FakeClock())
+        for _ in range(2):
+            breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, CLOSED)
+
+    def test_half_open_probe_recovers(self):
+        """测试冷却后只放行一个探测请求，探测成功则恢复"""
+        from app.breaker import CircuitOpenError, CLOSED, HALF_OPEN, OPEN
+
+        clock = FakeClock()
+        events = []
+        breaker = self._breaker(clock)
+        breaker.add_listener(lambda old, new, b: events.append((old, new)))
+        for _ in range(3):
+            breaker.record_failure()
+
+        clock.sleep(10)
+        self.assertEqual(breaker.state, HALF_OPEN)
+        breaker.before_request()
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record_success()
+
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertEqual(events, [("closed", OPEN), (OPEN, HALF_OPEN), (HALF_OPEN, CLOSED)])
+
+    def test_failed_probe_reopens(self):
+        """测试探测失败重新熔断"""
+        from app.breaker import OPEN
+
+        clock = FakeClock()
+        breaker = self._breaker(clock)
+        for _ in range(3):
+            breaker.record_failure()
+
+        clock.sleep(10)
+        breaker.before_request()
+        breaker.record_failure()
+
+        self.assertEqual(breaker.state, OPEN)
+        self.assertEqual(breaker.stats()["open_count"], 2)
+
+    def test_client_fails_fast_when_open(self):
+        """测试熔断后客户端不再发送请求"""
+        from app.jimeng_api import JimengAPIClient
+
+        client = JimengAPIClient(
+            api_key="test",
+            retry_policy=TestTokenBucket._retry_policy(),
+            circuit_breaker=self._breaker(FakeClock(), failure_threshold=2)
+        )
+        with patch("app.jimeng_api.requests.Session.post", return_value=_response(503)) as mock_post:
+            first = client.generate("test prompt", save_to_file=False)
+            second = client.generate("test prompt", save_to_file=False)
+
+        self.assertFalse(first["success"])
+        self.assertEqual(mock_post.call_count, 2)
+        self.assertFalse(second["success"])
+        self.assertIn("熔断", second["error"])
+
+    def test_probe_released_when_request_not_sent(self):
+        """测试限流等待失败时归还探测名额，熔断器不会卡在半开状态"""
+        from app.jimeng_api import JimengAPIClient
+        from app.breaker import HALF_OPEN, CLOSED
+
+        clock = FakeClock()
+        breaker = self._breaker(clock, failure_threshold=1)
+        breaker.record_failure()
+        clock.sleep(10)
+
+        limiter = MagicMock()
+        limiter.acquire.return_value = False
+        client = JimengAPIClient(
+            api_key="test",
+            retry_policy=TestTokenBucket._retry_policy(),
+            circuit_breaker=breaker,
+            rate_limiter=limiter
+        )
+        with patch("app.jimeng_api.requests.Session.post") as mock_post:
+            result = client.generate("test prompt", save_to_file=False)
+        self.assertFalse(result["success"])
+        mock_post.assert_not_called()
+        self.assertEqual(breaker.state, HALF_OPEN)
+
+        # 名额已归还，下一个请求可以作为探测发出并恢复
+        breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CLOSED)
+
+
+class TestTimeoutsAndDeadline(unittest.TestCase):
+    """分阶段超时与任务截止时间测试"""
+
+    def test_deadline_remaining_and_limit(self):
+        """测试截止时间计算与合并"""
+        from app.timeouts import Deadline, DeadlineExceeded
+
+        clock = FakeClock()
+        deadline = Deadline(10, clock)
+        self.assertEqual(deadline.remaining(), 10)
+        self.assertIs(deadline.limit(20), deadline)
+        self.assertEqual(deadline.limit(3).remaining(), 3)
+        self.assertIsNone(Deadline().remaining())
+
+        clock.sleep(10)
+        self.assertTrue(deadline.expired)
+        with self.assertRaises(DeadlineExceeded):
+            deadline.check()
+
+    def test_request_timeouts_clamped(self):
+        """测试连接/读取超时被裁剪到剩余时间"""
+        from app.timeouts import Deadline, Timeouts
+
+        clock = FakeClock()
+        timeouts = Timeouts(connect=5, read=60, total=0)
+        self.assertEqual(timeouts.for_request(), (5, 60))
+        self.assertEqual(timeouts.for_request(Deadline(20, clock)), (5, 20))
+
+    def test_generation_uses_split_timeouts(self):
+        """测试生成请求使用 (connect, read) 超时"""
+        from app.jimeng_api import JimengAPIClient
+        from app.timeouts import Timeouts
+
+        success = _response(200)
+        success.json.return_value = {"data": [{"url": "https://example.com/a.jpg"}]}
+
+        client = JimengAPIClient(api_key="test")
+        client.generate_timeouts = Timeouts(connect=3, read=45)
+        with patch("app.jimeng_api.requests.Session.post", return_value=success) as mock_post:
+            client.generate("test prompt", save_to_file=False)
+
+        self.assertEqual(mock_post.call_args[1]["timeout"], (3, 45))
+
+    def test_expired_deadline_fails_without_request(self):
+        """测试任务截止时间已过时不再发送请求"""
+        from app.jimeng_api import JimengAPIClient
+        from app.timeouts import Deadline
+
+        clock = FakeClock()
+        deadline = Deadline(1, clock)
+        clock.sleep(2)
+
+        client = JimengAPIClient(api_key="test")
+        with patch("app.jimeng_api.requests.Session.post") as mock_post:
+            result = client.generate("test prompt", save_to_file=False, deadline=deadline)
+
+        self.assertFalse(mock_post.called)
+        self.assertFalse(result["success"])
+        self.assertIn("截止时间", result["error"])
+
+    def test_retry_stops_at_deadline(self):
+        """测试重试等待不越过截止时间"""
+        from app.retry import RetryPolicy
+        from app.timeouts import Deadline
+
+        sleeps = []
+        policy = RetryPolicy(max_attempts=5, base_delay=1, max_total_time=0, sleep=sleeps.append)
+        responses = [_response(429, {"Retry-After": "5"}), _response(200)]
+
+        result = policy.call(lambda: responses.pop(0), deadline=Deadline(2))
+
+        self.assertEqual(result.status_code, 429)
+        self.assertEqual(sleeps, [])
+
+    def test_download_aborts_past_deadline(self):
+        """测试下载超出截止时间时放弃且不留文件"""
+        import tempfile
+        from app.jimeng_api import JimengAPIClient
+        from app.timeouts import Deadline
+
+        clock = FakeClock()
+        deadline = Deadline(1, clock)
+
+        def slow_chunks(chunk_size):
+            yield b"first"
+            clock.sleep(5)
+            yield b"second"
+
+        download = _response(200)
+        download.iter_content.side_effect = slow_chunks
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            client = JimengAPIClient(api_key="test")
+            client.output_dir = temp_dir
+            with patch("app.jimeng_api.requests.Session.get", return_value=download):
+                path = client._download_image("https://example.com/a.jpg", deadline=deadline)
+
+            self.assertIsNone(path)
+            self.assertEqual(os.listdir(temp_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
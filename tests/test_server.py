@@ -0,0 +1,201 @@
+"""
+常驻生成服务测试
+测试覆盖：HTTP 与 Unix socket 接口、请求校验、并发上限、健康检查
+"""
+import os
+import sys
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+class FakeClient:
+    """不访问网络的客户端替身"""
+
+    def __init__(self, gate: threading.Event = None):
+        from app.breaker import CircuitBreaker
+
+        self.gate = gate
+        self.calls = []
+        self.circuit_breaker = CircuitBreaker()
+        self.result_cache = None
+
+    def generate(self, prompt, **kwargs):
+        self.calls.append((prompt, kwargs))
+        if self.gate is not None:
+            self.gate.wait(5)
+        return {"success": True, "prompt": prompt, "seed": kwargs.get("seed"),
+                "url": "https://cdn/a.jpg", "local_path": "/tmp/a.jpg", "images": [], "error": None}
+
+    def pool_stats(self):
+        return {}
+
+
+class TestWorkerServer(unittest.TestCase):
+    """常驻服务测试"""
+
+    def test_generate_over_http(self):
+        """通过本地 HTTP 提交生成请求"""
+        from app.server import WorkerServer, ServerClient
+
+        client = FakeClient()
+        with WorkerServer(client, host="127.0.0.1", port=0, unix_socket="") as server:
+            caller = ServerClient(server.address, timeout=10)
+            result = caller.generate("a cat", seed=5, size="1024x1024")
+            health = caller.health()
+
+        self.assertTrue(result["success"])
+        self.assertEqual(result["seed"], 5)
+        self.assertIsNone(result["style"])
+        self.assertEqual(client.calls[0][1]["size"], "1024x1024")
+        self.assertEqual(health["status"], "ok")
+        self.assertEqual(health["requests"], 1)
+        self.assertEqual(health["succeeded"], 1)
+        self.assertEqual(health["breaker"]["state"], "closed")
+
+    @unittest.skipUnless(hasattr(__import__("socket"), "AF_UNIX"), "需要 Unix socket")
+    def test_generate_over_unix_socket(self):
+        """通过 Unix socket 提交请求，风格由服务端策略补全"""
+        from app.server import WorkerServer, ServerClient
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "jimeng.sock")
+            with WorkerServer(FakeClient(), unix_socket=path) as server:
+                self.assertEqual(server.address, f"unix:{path}")
+                self.assertEqual(os.stat(path).st_mode & 0o777, 0o600)
+                result = ServerClient(server.address, timeout=10).generate("女孩", style="镜面自拍")
+            self.assertFalse(os.path.exists(path))
+
+        self.assertTrue(result["success"])
+        self.assertEqual(result["style"], "镜面自拍")
+        self.assertTrue(result["prompt"].startswith("女孩，"))
+
+    @unittest.skipUnless(hasattr(__import__("socket"), "AF_UNIX"), "需要 Unix socket")
+    def test_socket_path_safety(self):
+        """只清理无人监听的 socket，普通文件与运行中服务的 socket 不会被删除"""
+        import socket
+        from app.server import WorkerServer, ServerClient
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            regular = os.path.join(temp_dir, "notes.txt")
+            Path(regular).write_text("keep")
+            with self.assertRaises(FileExistsError):
+                WorkerServer(FakeClient(), unix_socket=regular)
+            self.assertEqual(Path(regular).read_text(), "keep")
+
+            path = os.path.join(temp_dir, "jimeng.sock")
+            with WorkerServer(FakeClient(), unix_socket=path):
+                with self.assertRaises(OSError):
+                    WorkerServer(FakeClient(), unix_socket=path)
+                self.assertTrue(os.path.exists(path))
+
+            # 遗留的 socket 文件（无人监听）被清理后重新监听
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            stale.bind(path)
+            stale.close()
+            with WorkerServer(FakeClient(), unix_socket=path) as server:
+                self.assertEqual(ServerClient(server.address, timeout=10).health()["status"], "ok")
+
+    def test_invalid_request(self):
+        """缺少提示词返回 400"""
+        from app.server import WorkerServer
+
+        with WorkerServer(FakeClient(), host="127.0.0.1", port=0, unix_socket="") as server:
+            status, body = server.handle_generate({"seed": 1})
+
+        self.assertEqual(status, 400)
+        self.assertFalse(body["success"])
+
+    def test_prefix_with_path_rejected(self):
+        """filename_prefix 带路径时返回 400，不调用生成"""
+        from app.server import WorkerServer
+
+        client = FakeClient()
+        with WorkerServer(client, host="127.0.0.1", port=0, unix_socket="") as server:
+            status, body = server.handle_generate({"prompt": "a", "filename_prefix": "../../tmp/escape"})
+
+        self.assertEqual(status, 400)
+        self.assertIn("filename_prefix", body["error"])
+        self.assertEqual(client.calls, [])
+
+    def test_references_limited_to_reference_dir(self):
+        """参考图只接受 http(s) 地址或参考图目录内的文件"""
+        from app.server import WorkerServer
+
+        with tempfile.TemporaryDirectory() as ref_dir, tempfile.NamedTemporaryFile(suffix=".png") as outside:
+            Path(ref_dir, "face.png").write_bytes(b"img")
+            client = FakeClient()
+            with WorkerServer(client, host="127.0.0.1", port=0, unix_socket="", reference_dir=ref_dir) as server:
+                for reference in (outside.name, "../" + os.path.basename(outside.name), "missing.png"):
+                    with self.subTest(reference=reference):
+                        status, body = server.handle_generate({"prompt": "a", "references": [reference]})
+                        self.assertEqual(status, 400)
+                self.assertEqual(client.calls, [])
+
+                status, _ = server.handle_generate(
+                    {"prompt": "a", "references": ["https://cdn/r.jpg", "face.png"]}
+                )
+
+            self.assertEqual(status, 200)
+            self.assertEqual(client.calls[0][1]["reference_images"],
+                             ["https://cdn/r.jpg", os.path.join(os.path.realpath(ref_dir), "face.png")])
+
+    def test_bad_content_length(self):
+        """缺少或无效的 Content-Length 返回 411 / 400"""
+        import http.client
+        from app.server import WorkerServer
+
+        with WorkerServer(FakeClient(), host="127.0.0.1", port=0, unix_socket="") as server:
+            host, port = server.httpd.server_address[:2]
+            for headers, expected in (({}, 411), ({"Content-Length": "abc"}, 400), ({"Content-Length": "-1"}, 400)):
+                with self.subTest(headers=headers):
+                    conn = http.client.HTTPConnection(host, port, timeout=10)
+                    conn.putrequest("POST", "/generate")
+                    for name, value in headers.items():
+                        conn.putheader(name, value)
+                    conn.endheaders()
+                    response = conn.getresponse()
+                    self.assertEqual(response.status, expected)
+                    self.assertFalse(json.loads(response.read())["success"])
+                    conn.close()
+
+    def test_busy_server_rejects(self):
+        """并发已满且排队超时返回 503"""
+        from app.server import WorkerServer
+
+        gate = threading.Event()
+        client = FakeClient(gate)
+        with WorkerServer(client, host="127.0.0.1", port=0, unix_socket="",
+                          max_concurrency=1, queue_timeout=0.05) as server:
+            first = threading.Thread(target=server.handle_generate, args=({"prompt": "slow"},))
+            first.start()
+            while not client.calls:
+                threading.Event().wait(0.01)
+
+            status, body = server.handle_generate({"prompt": "second"})
+            gate.set()
+            first.join()
+            health = server.health()
+
+        self.assertEqual(status, 503)
+        self.assertEqual(health["rejected"], 1)
+        self.assertEqual(health["in_flight"], 0)
+
+    def test_unreachable_server(self):
+        """服务未启动时抛出 ConnectionError"""
+        from app.server import ServerClient
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            caller = ServerClient(f"unix:{os.path.join(temp_dir, 'missing.sock')}", timeout=1)
+            with self.assertRaises(ConnectionError):
+                caller.health()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+"""
+启动性能测试
+测试覆盖：包的按需导入、CLI 冷启动导入耗时预算（基于 python -X importtime）
+"""
+import os
+import sys
+import subprocess
+import unittest
+from pathlib import Path
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+APP_ROOT = PROJECT_ROOT / "jimeng-selfie-app"
+sys.path.insert(0, str(APP_ROOT))
+
+# 导入 app.cli 的累计耗时预算（毫秒），慢速 CI 可通过环境变量放宽
+IMPORT_BUDGET_MS = float(os.environ.get("JIMENG_IMPORT_BUDGET_MS", "80"))
+
+# 不涉及生成的命令不应加载的模块
+HEAVY_MODULES = ("requests", "urllib3", "app.jimeng_api")
+
+
+def _run_python(*args: str) -> subprocess.CompletedProcess:
+    """在应用目录下启动新的解释器"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=str(APP_ROOT), env=env, capture_output=True, text=True, timeout=60
+    )
+
+
+def _import_times(module: str) -> dict:
+    """
+    解析 -X importtime 输出
+
+    返回:
+        {模块名: 累计耗时（微秒）}
+    """
+    proc = _run_python("-X", "importtime", "-c", f"import {module}")
+    if proc.returncode != 0:
+        raise AssertionError(proc.stderr)
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        try:
+            times[name.strip()] = int(cumulative)
+        except ValueError:
+            continue  # 表头行
+    return times
+
+
+class TestLazyImports(unittest.TestCase):
+    """按需导入测试"""
+
+    def test_cli_import_skips_http_stack(self):
+        """导入 CLI 不加载 HTTP 客户端"""
+        times = _import_times("app.cli")
+        self.assertIn("app.cli", times)
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_server_client_skips_http_stack(self):
+        """常驻服务的轻量客户端只依赖标准库"""
+        times = _import_times("app.server")
+        for module in HEAVY_MODULES:
+            self.assertNotIn(module, times)
+
+    def test_list_styles_skips_http_stack(self):
+        """--list-styles / --help 不加载 HTTP 客户端"""
+        code = (
+            "import sys\n"
+            "from app.cli import main\n"
+            "sys.argv = ['jimeng-selfie'] + sys.argv[1:]\n"
+            "try:\n"
+            "    main()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            f"print('LOADED', [m for m in {HEAVY_MODULES!r} if m in sys.modules])\n"
+        )
+        for flag in ("--list-styles", "--help"):
+            with self.subTest(flag=flag):
+                proc = _run_python("-c", code, flag)
+                self.assertEqual(proc.returncode, 0, proc.stderr)
+                self.assertIn("LOADED []", proc.stdout)
+
+    def test_lazy_attribute_access(self):
+        """包级导出在首次访问时加载"""
+        import app
+        from app.jimeng_api import JimengAPIClient
+
+        self.assertIs(app.JimengAPIClient, JimengAPIClient)
+        self.assertIn("ThreadedJimengAPIClient", dir(app))
+        with self.assertRaises(AttributeError):
+            app.not_exported
+
+
+class TestStartupBudget(unittest.TestCase):
+    """冷启动导入耗时预算"""
+
+    def test_cli_import_within_budget(self):
+        """app.cli 累计导入耗时不超过预算（取三次最小值以降低抖动）"""
+        best_ms = min(_import_times("app.cli")["app.cli"] for _ in range(3)) / 1000
+        self.assertLess(
+            best_ms, IMPORT_BUDGET_MS,
+            f"导入 app.cli 耗时 {best_ms:.1f} ms，超出预算 {IMPORT_BUDGET_MS:.0f} ms"
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
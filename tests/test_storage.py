@@ -0,0 +1,292 @@
+"""
+输出存储测试
+测试覆盖：原子写入、流式下载、Base64 解码写入、输出目录布局与迁移
+"""
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest.mock import patch, MagicMock
+
+# 添加项目路径
+PROJECT_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(PROJECT_ROOT / "jimeng-selfie-app"))
+
+
+class TestAtomicWrite(unittest.TestCase):
+    """原子写入测试"""
+
+    def test_chunks_written_in_order(self):
+        """测试分块按顺序写入目标文件"""
+        from app.storage import atomic_write_chunks
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            target = os.path.join(temp_dir, "sub", "image.jpg")
+            written = atomic_write_chunks(target, [b"ab", b"", b"cd"])
+
+            self.assertEqual(written, 4)
+            self.assertEqual(Path(target).read_bytes(), b"abcd")
+            self.assertEqual(os.listdir(os.path.dirname(target)), ["image.jpg"])
+
+    def test_failure_leaves_no_partial_file(self):
+        """测试写入中断时不留下半截文件"""
+        from app.storage import atomic_write_chunks
+
+        def broken_chunks():
+            yield b"partial"
+            raise IOError("connection reset")
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            target = os.path.join(temp_dir, "image.jpg")
+            with self.assertRaises(IOError):
+                atomic_write_chunks(target, broken_chunks())
+
+            self.assertEqual(os.listdir(temp_dir), [])
+
+
+class TestStreamingDownload(unittest.TestCase):
+    """流式下载测试"""
+
+    def test_download_uses_streaming(self):
+        """测试下载以流式分块读取"""
+        from app.jimeng_api import JimengAPIClient
+
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.iter_content.return_value = [b"x" * 10, b"y" * 10]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            client = JimengAPIClient(api_key="test")
+            client.output_dir = temp_dir
+            client.download_chunk_size = 10
+
+            with patch("app.jimeng_api.requests.Session.get", return_value=mock_response) as mock_get:
+                path = client._download_image("https://example.com/a.jpg", "test", 1)
+
+            self.assertTrue(mock_get.call_args[1]["stream"])
+            mock_response.iter_content.assert_called_with(chunk_size=10)
+            self.assertEqual(Path(path).read_bytes(), b"x" * 10 + b"y" * 10)
+            self.assertTrue(mock_response.close.called)
+
+    def test_failed_download_returns_none(self):
+        """测试非 200 响应不写入文件"""
+        from app.jimeng_api import JimengAPIClient
+
+        mock_response = MagicMock()
+        mock_response.status_code = 404
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            client = JimengAPIClient(api_key="test")
+            client.output_dir = temp_dir
+
+            with patch("app.jimeng_api.requests.Session.get", return_value=mock_response):
+                path = client._download_image("https://example.com/a.jpg")
+
+            self.assertIsNone(path)
+            self.assertEqual(os.listdir(temp_dir), [])
+
+
+class TestBase64Response(unittest.TestCase):
+    """b64_json 响应格式测试"""
+
+    def test_chunked_decode_matches_full_decode(self):
+        """测试分段解码结果与整体解码一致"""
+        import base64
+        from app.storage import iter_b64_decoded
+
+        raw = os.urandom(10007)
+        encoded = base64.b64encode(raw).decode()
+        chunks = list(iter_b64_decoded(encoded, chunk_size=1000))
+
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), raw)
+
+    def test_line_wrapped_payload_decoded(self):
+        """按行折叠（含 CRLF 与缩进）的 Base64 也能分段解码"""
+        import base64
+        from app.storage import iter_b64_decoded
+
+        raw = os.urandom(10007)
+        wrapped = base64.encodebytes(raw).decode()
+        self.assertEqual(b"".join(iter_b64_decoded(wrapped, chunk_size=1000)), raw)
+
+        crlf = "\r\n  ".join(wrapped.splitlines())
+        self.assertEqual(b"".join(iter_b64_decoded(crlf, chunk_size=999)), raw)
+
+    def test_generate_writes_b64_image(self):
+        """测试 b64_json 模式直接写入文件而不请求 CDN"""
+        import base64
+        from app.jimeng_api import JimengAPIClient
+
+        raw = b"\xff\xd8fake-jpeg" * 100
+        mock_response = MagicMock()
+        mock_response.status_code = 200
+        mock_response.json.return_value = {
+            "data": [{"b64_json": base64.b64encode(raw).decode()}]
+        }
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            client = JimengAPIClient(api_key="test", response_format="b64_json")
+            client.output_dir = temp_dir
+
+            with patch("app.jimeng_api.requests.Session.post", return_value=mock_response) as mock_post, \
+                    patch("app.jimeng_api.requests.Session.get") as mock_get:
+                result = client.generate("test prompt")
+
+            self.assertEqual(mock_post.call_args[1]["json"]["response_format"], "b64_json")
+            self.assertFalse(mock_get.called)
+            self.assertTrue(result["success"], result["error"])
+            self.assertIsNone(result["url"])
+            self.assertNotIn("b64_json", result["images"][0])
+            self.assertEqual(Path(result["local_path"]).read_bytes(), raw)
+
+    def test_auto_selector_prefers_faster_format(self):
+        """测试 auto 模式选择耗时更短的格式"""
+        from app.response_format import ResponseFormatSelector
+
+        selector = ResponseFormatSelector("auto", explore_every=0)
+        first = selector.choose()
+        selector.record(first, 5.0)
+        second = selector.choose()
+        self.assertNotEqual(first, second)
+        selector.record(second, 1.0)
+
+        self.assertEqual(selector.choose(), second)
+        self.assertEqual(selector.choose(save_to_file=False), "url")
+
+    def test_invalid_mode_rejected(self):
+        """测试无效响应格式"""
+        from app.response_format import ResponseFormatSelector
+
+        with self.assertRaises(ValueError):
+            ResponseFormatSelector("png")
+
+
+class TestOutputLayout(unittest.TestCase):
+    """输出目录布局测试"""
+
+    def test_names_are_unique_within_a_second(self):
+        """同一秒内相同前缀与种子的文件名不冲突，且可解析"""
+        from app.storage import build_output_path, parse_output_filename
+
+        with patch("app.storage.time.time", return_value=1700000000):
+            paths = {build_output_path("/out", "batch", seed=7) for _ in range(200)}
+        self.assertEqual(len(paths), 200)
+
+        parsed = parse_output_filename(os.path.basename(next(iter(paths))))
+        self.assertEqual((parsed["prefix"], parsed["seed"], parsed["timestamp"]), ("batch", 7, 1700000000))
+        self.assertEqual(len(parsed["uid"]), 12)
+        self.assertEqual(parse_output_filename("old_5_1700000000_2.jpg")["index"], 2)
+        self.assertIsNone(parse_output_filename("notes.txt"))
+
+    def test_sharded_layouts(self):
+        """date 按日期分目录，hash 按文件名哈希分目录"""
+        import time
+        from app.storage import build_output_path
+
+        with patch("app.storage.time.time", return_value=1700000000):
+            date_path = build_output_path("/out", "p", layout="date")
+        expected = time.strftime("%Y/%m/%d", time.localtime(1700000000))
+        self.assertEqual(os.path.dirname(date_path), os.path.join("/out", expected))
+
+        hash_path = build_output_path("/out", "p", index=1, layout="hash")
+        shard = os.path.relpath(os.path.dirname(hash_path), "/out")
+        self.assertRegex(shard, r"^[0-9a-f]{2}$")
+        self.assertEqual(os.path.dirname(build_output_path("/out", "p")), "/out")
+
+        with self.assertRaises(ValueError):
+            build_output_path("/out", "p", layout="tree")
+
+    def test_prefix_cannot_escape_output_dir(self):
+        """带路径的前缀被拒绝，客户端不会为其调用生成接口"""
+        from app.storage import build_output_path
+        from app.jimeng_api import JimengAPIClient
+
+        for prefix in ("../../tmp/escape", "sub/name", "..", "/abs", "a\\b"):
+            with self.subTest(prefix=prefix):
+                with self.assertRaises(ValueError):
+                    build_output_path("/srv/out", prefix, 1)
+        self.assertTrue(build_output_path("/srv/out", "西娅_beach", 1).startswith("/srv/out/西娅_beach_1_"))
+
+        with JimengAPIClient(api_key="test") as client, \
+                patch.object(client, "_post_generation") as post:
+            result = client.generate("p", filename_prefix="../escape")
+        post.assert_not_called()
+        self.assertIn("文件名前缀", result["error"])
+
+    def test_client_uses_layout(self):
+        """客户端按 output_layout 保存图片"""
+        from app.jimeng_api import JimengAPIClient
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            client = JimengAPIClient(api_key="test")
+            client.output_dir = temp_dir
+            client.output_layout = "hash"
+            path = client._write_b64_image("aGVsbG8=", "p", seed=3)
+            client.close()
+
+            self.assertEqual(os.path.dirname(os.path.dirname(path)), temp_dir)
+            self.assertEqual(Path(path).read_bytes(), b"hello")
+
+    def test_migrate_layout(self):
+        """已有文件按布局移动，空目录清理，重复迁移不再移动"""
+        import time
+        from app.storage import migrate_layout
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            names = ["a_1_1700000000.jpg", "b_1700000000_0123456789ab_1.jpg", "other.png"]
+            os.makedirs(os.path.join(temp_dir, "nested"))
+            for name in names[:2]:
+                Path(temp_dir, name).write_bytes(b"x")
+            Path(temp_dir, "nested", names[2]).write_bytes(b"x")
+            Path(temp_dir, ".dedup_index.jsonl").write_text("")
+            os.utime(os.path.join(temp_dir, "nested", names[2]), (1600000000, 1600000000))
+
+            plan = migrate_layout(temp_dir, "date", dry_run=True)
+            self.assertEqual(len(plan["moved"]), 3)
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, names[0])))
+
+            report = migrate_layout(temp_dir, "date")
+            day = time.strftime("%Y/%m/%d", time.localtime(1700000000))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, day, names[0])))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, day, names[1])))
+            old_day = time.strftime("%Y/%m/%d", time.localtime(1600000000))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, old_day, names[2])))
+            self.assertFalse(os.path.exists(os.path.join(temp_dir, "nested")))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, ".dedup_index.jsonl")))
+            self.assertEqual(len(report["moved"]), 3)
+
+            again = migrate_layout(temp_dir, "date")
+            self.assertEqual((len(again["moved"]), again["skipped"]), (0, 3))
+
+            # 迁移回平铺布局
+            self.assertEqual(len(migrate_layout(temp_dir, "flat")["moved"]), 3)
+            self.assertEqual(sorted(os.listdir(temp_dir)), sorted([".dedup_index.jsonl"] + names))
+
+    def test_migrate_cli_updates_manifest(self):
+        """迁移命令同步更新图片清单"""
+        import io
+        from app import cli
+        from app.manifest import Manifest
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            output = os.path.join(temp_dir, "out")
+            os.makedirs(output)
+            source = os.path.join(output, "a_1_1700000000.jpg")
+            Path(source).write_bytes(b"x")
+            db = os.path.join(temp_dir, "m.sqlite3")
+            Manifest(db).record({"success": True, "prompt": "p", "images": [{"local_path": source}]})
+
+            argv = ["jimeng-selfie", "migrate-output", "--layout", "hash", "-o", output, "--db", db]
+            with patch.object(sys, "argv", argv), patch("sys.stdout", new_callable=io.StringIO) as stdout:
+                cli.main()
+
+            self.assertIn("已移动 1 张图片", stdout.getvalue())
+            rows = Manifest(db).query()
+            self.assertNotEqual(rows[0]["path"], source)
+            self.assertTrue(os.path.exists(rows[0]["path"]))
+
+
+if __name__ == "__main__":
+    unittest.main()